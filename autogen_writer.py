@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+
+import contextlib
+import hashlib
+import io
+import os
+
+# Paths written by write_if_changed() in this process
+g_updated_files:list[str] = []
+g_unchanged_files:list[str] = []
+
+def _file_digest(path:str) -> bytes|None:
+    try:
+        with open(path, "rb") as f:
+            return hashlib.sha256(f.read()).digest()
+    except FileNotFoundError:
+        return None
+
+# Writes content to path only if the hash of the contents differs from the existing file.
+# The unchanged file keeps its mtime, so make/ccache do not rebuild the translation units
+# which include it. The new contents are written to a temporary file first and then renamed,
+# so an interrupted run never leaves a truncated file behind.
+# Returns True if the file was (re)written.
+def write_if_changed(path:str, content:str) -> bool:
+    data = content.encode("utf-8")
+    if _file_digest(path) == hashlib.sha256(data).digest():
+        g_unchanged_files.append(path)
+        return False
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    g_updated_files.append(path)
+    return True
+
+# Same as open(path, "w"), but the contents are buffered in memory and passed to
+# write_if_changed() when the with-block exits without exception.
+@contextlib.contextmanager
+def open_if_changed(path:str):
+    buf = io.StringIO()
+    yield buf
+    write_if_changed(path, buf.getvalue())
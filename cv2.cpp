@@ -1,34 +1,72 @@
-#include <ruby.h>
-#include <opencv2/opencv.hpp>
-#include <opencv2/core/types.hpp>
-#include <opencv2/core/types_c.h>
-#include <numo/narray.h>
-#include <sstream>
-#include <string>
-#include <type_traits>
-#include <vector>
-#include <cstdio>
-#include <cstdlib>
-#include <cstdarg>
-
-static int trace_printf(const char *filename, int line, const char *fmt, ...){
-    const char *s_env = getenv("RBOPENCV_TRACE");
-    if (s_env && atoi(s_env)) {
-        va_list ap;
-        va_start(ap, fmt);
-        int ret = 0;
-        ret += printf("[%s %d] ", filename, line);
-        ret += vprintf(fmt, ap);
-        va_end(ap);
-        return ret;
+#include "rbopencv.hpp"
+#include <atomic>
+#include <list>
+#include <mutex>
+#include <unordered_map>
+
+#ifndef RBOPENCV_DISABLE_TRACE
+bool rbopencv_trace_enabled = false;
+
+int trace_printf(const char *filename, int line, const char *fmt, ...){
+    va_list ap;
+    va_start(ap, fmt);
+    int ret = 0;
+    ret += printf("[%s %d] ", filename, line);
+    ret += vprintf(fmt, ap);
+    va_end(ap);
+    return ret;
+}
+#endif
+
+#ifdef RBOPENCV_ENABLE_STATS
+// Registered statistics. They are registered while the GVL is held.
+static RbopencvStats* g_stats_list = NULL;
+
+RbopencvStats::RbopencvStats(const char* name) : name(name), next(g_stats_list) {
+    reset();
+    g_stats_list = this;
+}
+
+void RbopencvStats::reset() {
+    calls = 0;
+    misses = 0;
+    total_ns = 0;
+    for (int i = 0; i < NUM_BUCKETS; i++)
+        histogram[i] = 0;
+}
+#endif
+
+// CV2.stats: returns {"function name" => {calls:, overload_misses:, total_time: (sec), histogram: [...]}}
+// of the wrappers called so far. histogram[i] is the number of the calls which took less than 2**i
+// microseconds (and 2**(i-1) or more). It is empty unless built with --enable-stats.
+static VALUE wrap_stats(VALUE self){
+    VALUE ret = rb_hash_new();
+#ifdef RBOPENCV_ENABLE_STATS
+    for (RbopencvStats* stats = g_stats_list; stats; stats = stats->next) {
+        VALUE histogram = rb_ary_new_capa(RbopencvStats::NUM_BUCKETS);
+        for (int i = 0; i < RbopencvStats::NUM_BUCKETS; i++)
+            rb_ary_push(histogram, ULL2NUM(stats->histogram[i].load()));
+        VALUE entry = rb_hash_new();
+        rb_hash_aset(entry, ID2SYM(rb_intern("calls")), ULL2NUM(stats->calls.load()));
+        rb_hash_aset(entry, ID2SYM(rb_intern("overload_misses")), ULL2NUM(stats->misses.load()));
+        rb_hash_aset(entry, ID2SYM(rb_intern("total_time")), DBL2NUM(stats->total_ns.load() / 1e9));
+        rb_hash_aset(entry, ID2SYM(rb_intern("histogram")), histogram);
+        rb_hash_aset(ret, rb_str_new_cstr(stats->name), entry);
     }
-    return 0;
+#endif
+    return ret;
 }
 
-#define TRACE_PRINTF(fmt, ...) trace_printf(__FILE__, __LINE__, fmt, ##__VA_ARGS__)
+// CV2.reset_stats: clears the statistics
+static VALUE wrap_reset_stats(VALUE self){
+#ifdef RBOPENCV_ENABLE_STATS
+    for (RbopencvStats* stats = g_stats_list; stats; stats = stats->next)
+        stats->reset();
+#endif
+    return Qnil;
+}
 
-using namespace cv;
-using namespace std;
+thread_local bool rbopencv_without_gvl = false;
 
 //TODO Below variable is originally defined as TLSData<...> and TLSData is defined in opencv2/core/utils/tls.hpp
 thread_local std::vector<std::string> conversionErrorsTLS;
@@ -41,28 +79,20 @@ void rbRaiseCVOverloadException(const std::string& functionName)
     for (const auto& convErr : conversionErrors) {
         msg += convErr;
     }
+    conversionErrorsTLS.clear();
     rb_raise(rb_eTypeError, "%s", msg.c_str());
 }
 
+void rbClearArgumentConversionErrors()
+{
+    conversionErrorsTLS.clear();
+}
+
 void rbPopulateArgumentConversionErrors(const std::string& msg)
 {
     conversionErrorsTLS.push_back(msg);
 }
 
-using vector_int = std::vector<int>;
-using vector_char = std::vector<char>;
-using vector_uchar = std::vector<uchar>;
-using vector_float = std::vector<float>;
-using vector_double = std::vector<double>;
-using vector_String = std::vector<std::string>;
-using vector_string = std::vector<std::string>;
-using vector_Mat = std::vector<Mat>;
-using vector_Point = std::vector<Point>;
-using vector_Point2f = std::vector<Point2f>;
-using vector_Rect = std::vector<Rect>;
-using vector_vector_int = std::vector<std::vector<int>>;
-using vector_vector_Point2f = std::vector<std::vector<Point2f>>;
-
 const char* db_get_class_name(VALUE o){
     VALUE vtmp1 = rb_funcall(o, rb_intern("class"), 0, 0);
     VALUE vtmp2 = rb_funcall(vtmp1, rb_intern("to_s"), 0, 0);
@@ -110,51 +140,244 @@ void db_dump_narray_view(int level, const narray_view_t* nav){
     }
 }
 
+// Pool of the data buffers of the NArrays allocated for output Mats. It is disabled by default
+// (limit == 0), and enabled by CV2.set_output_pool_limit(bytes).
+//
+// The buffers are allocated by cv::fastMalloc() (aligned to CV_MALLOC_ALIGN, i.e. 64 bytes) and
+// given to NArrays which do not own them. Each of the NArrays refers to a hidden PooledBuffer
+// object, which returns the buffer to the pool when the NArray is collected. The idle buffers are
+// looked up by their size in bytes, and the least recently returned ones are freed when their
+// total size exceeds the limit. It is used only while the GVL is held.
+class OutputBufferPool {
+public:
+    ~OutputBufferPool() { set_limit(0); }
+
+    bool enabled() const { return limit > 0; }
+
+    void set_limit(size_t bytes) {
+        limit = bytes;
+        evict();
+    }
+
+    // Returns an uninitialized buffer of size bytes
+    void* get(size_t size) {
+        auto it = by_size.find(size);
+        if (it == by_size.end()) {
+            misses++;
+            return cv::fastMalloc(size);
+        }
+        hits++;
+        void* data = it->second->data;
+        idle_bytes -= size;
+        lru.erase(it->second);
+        by_size.erase(it);
+        return data;
+    }
+
+    void put(void* data, size_t size) {
+        if (size > limit) {
+            cv::fastFree(data);
+            return;
+        }
+        lru.push_front(Entry{data, size});
+        by_size.emplace(size, lru.begin());
+        idle_bytes += size;
+        evict();
+    }
+
+    size_t limit = 0;
+    size_t idle_bytes = 0;
+    unsigned long long hits = 0;
+    unsigned long long misses = 0;
+
+private:
+    struct Entry {
+        void* data;
+        size_t size;
+    };
+
+    void evict() {
+        while (idle_bytes > limit) {
+            Entry& e = lru.back();
+            auto range = by_size.equal_range(e.size);
+            for (auto it = range.first; it != range.second; ++it) {
+                if (it->second == std::prev(lru.end())) {
+                    by_size.erase(it);
+                    break;
+                }
+            }
+            idle_bytes -= e.size;
+            cv::fastFree(e.data);
+            lru.pop_back();
+        }
+    }
+
+    std::list<Entry> lru; // most recently returned first
+    std::unordered_multimap<size_t, std::list<Entry>::iterator> by_size;
+};
+
+static OutputBufferPool g_outputPool;
+
+struct PooledBuffer {
+    void* data;
+    size_t size;
+};
+
+static void pooled_buffer_free(void* ptr){
+    PooledBuffer* buf = (PooledBuffer*)ptr;
+    if (buf->data) {
+        rb_gc_adjust_memory_usage(-(ssize_t)buf->size);
+        g_outputPool.put(buf->data, buf->size);
+    }
+    delete buf;
+}
+
+static size_t pooled_buffer_memsize(const void* ptr){
+    return sizeof(PooledBuffer) + ((const PooledBuffer*)ptr)->size;
+}
+
+static const rb_data_type_t pooled_buffer_type {
+    "rbopencv_pooled_buffer",
+    {NULL, pooled_buffer_free, pooled_buffer_memsize},
+    NULL, NULL,
+    RUBY_TYPED_FREE_IMMEDIATELY
+};
+
+// Gives a buffer of size bytes from the pool to NArray o, whose data is not allocated yet
+static void set_pooled_buffer(VALUE o, size_t size){
+    PooledBuffer* buf = new PooledBuffer{NULL, size};
+    VALUE keeper = TypedData_Wrap_Struct(0, &pooled_buffer_type, buf);
+    rb_ivar_set(o, rb_intern("__rbopencv_pooled_buffer"), keeper);
+    narray_data_t* nad = na_get_narray_data_t(o);
+    buf->data = g_outputPool.get(size);
+    nad->ptr = (char*)buf->data;
+    nad->owned = false;
+    rb_gc_adjust_memory_usage(size);
+    RB_GC_GUARD(keeper);
+}
+
+// CV2.set_output_pool_limit(bytes): enables the pool of the output buffers, which keeps the idle
+// buffers up to bytes in total. 0 (default) disables it, and frees the idle buffers.
+static VALUE wrap_set_output_pool_limit(VALUE self, VALUE bytes){
+    g_outputPool.set_limit(NUM2SIZET(bytes));
+    return Qnil;
+}
+
+// NArrays referred to by the UMatData of g_numpyAllocator, with the number of the UMatData for each.
+// The output NArrays allocated during a call are held only by the UMatData until rbopencv_from()
+// returns them, so they are marked by g_matOwnersKeeper to keep them (and their pooled buffers)
+// alive. It is used only by Ruby threads holding the GVL (see defer_release_mat_owner()).
+static std::unordered_map<VALUE, long> g_matOwners;
+static VALUE g_matOwnersKeeper = Qnil;
+
+// The NArrays released by the threads which are not Ruby threads (e.g. the workers of
+// cv::parallel_for_), which cannot take the GVL. They are removed from g_matOwners by the next
+// Ruby thread using it, and kept marked until then.
+static std::mutex g_pendingReleasesMutex;
+static std::vector<VALUE> g_pendingReleases;
+static std::atomic<bool> g_hasPendingReleases{false};
+
+static void erase_mat_owner(VALUE o){
+    auto it = g_matOwners.find(o);
+    if (it != g_matOwners.end() && --it->second == 0)
+        g_matOwners.erase(it);
+}
+
+// Must be called with the GVL
+static void drain_pending_releases(){
+    if (!g_hasPendingReleases.load(std::memory_order_acquire))
+        return;
+    std::lock_guard<std::mutex> lock(g_pendingReleasesMutex);
+    for (VALUE o : g_pendingReleases)
+        erase_mat_owner(o);
+    g_pendingReleases.clear();
+    g_hasPendingReleases.store(false, std::memory_order_release);
+}
+
+static void mat_owners_mark(void* ptr){
+    drain_pending_releases();
+    for (const auto& owner : g_matOwners)
+        rb_gc_mark(owner.first);
+}
+
+static const rb_data_type_t mat_owners_type {
+    "rbopencv_mat_owners",
+    {mat_owners_mark, NULL, NULL},
+    NULL, NULL,
+    RUBY_TYPED_FREE_IMMEDIATELY
+};
+
+static void retain_mat_owner(VALUE o){
+    drain_pending_releases();
+    g_matOwners[o]++;
+}
+
+// Must be called with the GVL
+static void* release_mat_owner(void* ptr){
+    drain_pending_releases();
+    erase_mat_owner((VALUE)ptr);
+    return NULL;
+}
+
+static void defer_release_mat_owner(VALUE o){
+    std::lock_guard<std::mutex> lock(g_pendingReleasesMutex);
+    g_pendingReleases.push_back(o);
+    g_hasPendingReleases.store(true, std::memory_order_release);
+}
+
+// CV2.output_pool_stats: returns {hits:, misses:, idle_bytes:, limit:} of the pool, and the number
+// of the NArrays referred to by Mats (narrays_in_use), which is 0 between the calls unless Mats of
+// the wrapped classes keep NArrays
+static VALUE wrap_output_pool_stats(VALUE self){
+    VALUE ret = rb_hash_new();
+    rb_hash_aset(ret, ID2SYM(rb_intern("hits")), ULL2NUM(g_outputPool.hits));
+    rb_hash_aset(ret, ID2SYM(rb_intern("misses")), ULL2NUM(g_outputPool.misses));
+    rb_hash_aset(ret, ID2SYM(rb_intern("idle_bytes")), SIZET2NUM(g_outputPool.idle_bytes));
+    rb_hash_aset(ret, ID2SYM(rb_intern("limit")), SIZET2NUM(g_outputPool.limit));
+    drain_pending_releases();
+    rb_hash_aset(ret, ID2SYM(rb_intern("narrays_in_use")), SIZET2NUM(g_matOwners.size()));
+    return ret;
+}
+
 class NumpyAllocator : public cv::MatAllocator {
 public:
     NumpyAllocator() { stdAllocator = cv::Mat::getStdAllocator(); }
     ~NumpyAllocator() {}
 
-    UMatData* allocate(VALUE o, int dims, const int* sizes, int type, size_t* step) const {
-        narray_data_t* nad = na_get_narray_data_t(o);
-        VALUE view = rb_funcall(o, rb_intern("view"), 0, 0);
-        narray_view_t* nav = na_get_narray_view_t(view);
-
+    // Returns UMatData which refers to data of NArray o. o is kept as userdata, and returned by rbopencv_from().
+    UMatData* wrap(VALUE o, void* data, size_t size) const {
         UMatData* u = new UMatData(this);
         //TRACE_PRINTF("  u: %p\n", u);
-        u->data = u->origdata = (uchar*)nad->ptr;
-        if (!nav->stridx) {
-            throw std::runtime_error("[NumpyAllocator::allocate] nav->stridx is NULL");
-        }
-        for (unsigned char i = 0; i < nad->base.ndim; i++) {
-            if (SDX_IS_INDEX(nav->stridx[i])) {
-                //TRACE_PRINTF("nav->stridx[%d] is not stride\n", i);
-                throw std::runtime_error("[NumpyAllocator::allocate] nav->stridx[i] is not stride");
-            } else {
-                ssize_t stride = SDX_GET_STRIDE(nav->stridx[i]);
-                step[i] = (size_t)stride;
-                //printf("step[%d]: %ld\n", i, step[i]);
-            }
-        }
-        step[dims-1] = CV_ELEM_SIZE(type);
-        //printf("step[dims-1=%d]: %ld\n", dims-1, step[dims-1]);
-        u->size = sizes[0] * step[0];
-        //printf("u->size: %ld\n", u->size);
+        u->data = u->origdata = (uchar*)data;
+        u->size = size;
         u->userdata = (void*)o;
+        retain_mat_owner(o);
         return u;
     }
 
+    // o is a new NArray, which owns its data and is contiguous. The steps are computed from the
+    // sizes without creating a view of o.
+    UMatData* allocate(VALUE o, int dims, const int* sizes, int type, size_t* step) const {
+        narray_data_t* nad = na_get_narray_data_t(o);
+        size_t stride = CV_ELEM_SIZE(type);
+        for (int i = dims - 1; i >= 0; i--) {
+            step[i] = stride;
+            stride *= sizes[i];
+        }
+        return wrap(o, nad->ptr, sizes[0] * step[0]);
+    }
+
     UMatData* allocate(int dims0, const int* sizes, int type, void* data, size_t* step, AccessFlag flags, UMatUsageFlags usageFlags) const override {
         TRACE_PRINTF("[allocate] dims0: %d, type: %d, depth: %d, cn: %d\n", dims0, type, CV_MAT_DEPTH(type), CV_MAT_CN(type));
         for (int i = 0; i < dims0; i++) {
             //TRACE_PRINTF("  sizes[%d]: %d\n", i, sizes[i]);
         }
-        if (data) {
+        // The threads which are not Ruby threads (e.g. the workers of cv::parallel_for_) cannot
+        // create NArrays, and rbopencv_from() copies their Mats.
+        if (data || (!rbopencv_without_gvl && !ruby_native_thread_p())) {
             return stdAllocator->allocate(dims0, sizes, type, data, step, flags, usageFlags);
         }
         int depth = CV_MAT_DEPTH(type);
-        int cn = CV_MAT_CN(type);
-        const int f = (int)(sizeof(size_t)/8);
         VALUE numo_type = depth == CV_8U ? numo_cUInt8 : depth == CV_8S ? numo_cInt8 :
         depth == CV_16U ? numo_cUInt16 : depth == CV_16S ? numo_cInt16 :
         depth == CV_32S ? numo_cInt32 : depth == CV_32F ? numo_cSFloat :
@@ -163,20 +386,65 @@ public:
             throw std::runtime_error("[NumpyAllocator::allocate] Unsupported type\n");
         }
 
-        int i, dims = dims0;
+        NArrayAllocation a{this, numo_type, dims0, sizes, type, step, NULL};
+        if (rbopencv_without_gvl) {
+            // Called by the C++ API without the GVL (see rbopencv_call_without_gvl()). The GVL is
+            // acquired only while the NArray is created, so the output is not copied after the call.
+            rb_thread_call_with_gvl(allocate_narray_with_gvl, &a);
+            if (!a.ret)
+                throw std::bad_alloc();
+            return a.ret;
+        }
+        allocate_narray((VALUE)&a);
+        return a.ret;
+    }
+
+    struct NArrayAllocation {
+        const NumpyAllocator* allocator;
+        VALUE numo_type;
+        int dims0;
+        const int* sizes;
+        int type;
+        size_t* step;
+        UMatData* ret;
+    };
+
+    // Creates the NArray of NArrayAllocation arg, which must be called with the GVL
+    static VALUE allocate_narray(VALUE arg){
+        NArrayAllocation* a = (NArrayAllocation*)arg;
+        int cn = CV_MAT_CN(a->type);
+        int i, dims = a->dims0;
         cv::AutoBuffer<size_t> _sizes(dims + 1);
         for (i = 0; i < dims; i++) {
-            _sizes[i] = sizes[i];
+            _sizes[i] = a->sizes[i];
         }
         if (cn > 1) {
             _sizes[dims++] = cn;
         }
-        VALUE o = rb_narray_new(numo_type, dims, _sizes.data());
-        rb_funcall(o, rb_intern("fill"), 1, INT2FIX(3));
+        VALUE o = rb_narray_new(a->numo_type, dims, _sizes.data());
+        // The data is left uninitialized, as it is written by OpenCV
+        size_t nbytes = CV_ELEM_SIZE1(a->type);
+        for (i = 0; i < dims; i++) {
+            nbytes *= _sizes[i];
+        }
+        if (g_outputPool.enabled() && nbytes > 0) {
+            set_pooled_buffer(o, nbytes);
+        } else {
+            na_get_pointer_for_write(o);
+        }
 
-        cv::UMatData* ret = allocate(o, dims0, sizes, type, step);
-        //TRACE_PRINTF("ret: %p\n", ret);
-        return ret;
+        a->ret = a->allocator->allocate(o, a->dims0, a->sizes, a->type, a->step);
+        //TRACE_PRINTF("ret: %p\n", a->ret);
+        return Qnil;
+    }
+
+    // Ruby exceptions must not be raised across the C++ API, so a->ret is left NULL if one is raised
+    static void* allocate_narray_with_gvl(void* arg){
+        int state = 0;
+        rb_protect(allocate_narray, (VALUE)arg, &state);
+        if (state)
+            rb_set_errinfo(Qnil);
+        return NULL;
     }
 
     bool allocate(UMatData* u, AccessFlag accessFlags, UMatUsageFlags usageFlags) const override {
@@ -192,6 +460,14 @@ public:
         CV_Assert(u->refcount >= 0);
         if (u->refcount == 0) {
             //TRACE_PRINTF("  refcount == 0; delete %p\n", u);
+            // The Mats given to the C++ API may be released by it without the GVL, also by the
+            // threads which are not Ruby threads
+            if (rbopencv_without_gvl)
+                rb_thread_call_with_gvl(release_mat_owner, u->userdata);
+            else if (ruby_native_thread_p())
+                release_mat_owner(u->userdata);
+            else
+                defer_release_mat_owner((VALUE)u->userdata);
             delete u;
         } else {
             //TRACE_PRINTF("  refcount >= 1\n");
@@ -203,14 +479,69 @@ public:
 
 NumpyAllocator g_numpyAllocator;
 
-template<typename T>
-static bool rbopencv_to(VALUE obj, T& p){
-    TRACE_PRINTF("[rbopencv_to primary] should not be used\n");
-    return false;
+// Computes size and step of NArray o (with ndims dimensions) from its view. Returns false if it
+// cannot be referred to by Mat without copying.
+static bool narray_view_steps(VALUE o, narray_data_t* nad, int ndims, size_t elemsize, bool ismultichannel, int* size, size_t* step){
+    bool needcopy = false;
+    VALUE view = rb_funcall(o, rb_intern("view"), 0, 0);
+    narray_view_t* nav = na_get_narray_view_t(view);
+    //TRACE_PRINTF("  ismultichannel: %d\n", ismultichannel);
+    for (int i = 0; i < ndims; i++) {
+        if (SDX_IS_STRIDE(nav->stridx[i])) {
+            //TRACE_PRINTF("  shape[%d]: %ld, stride[%d]: %ld\n", i, nad->base.shape[i], i, SDX_GET_STRIDE(nav->stridx[i]));
+        } else {
+            //TRACE_PRINTF("  shape[%d]: %ld, is not stride -> not supported\n", i, nad->base.shape[i]);
+            return false;
+        }
+    }
+
+    for( int i = ndims-1; i >= 0 && !needcopy; i-- ) {
+        // [original cv2.cpp comment]
+        // these checks handle cases of
+        //  a) multi-dimensional (ndims > 2) arrays, as well as simpler 1- and 2-dimensional cases
+        //  b) transposed arrays, where _strides[] elements go in non-descending order
+        //  c) flipped arrays, where some of _strides[] elements are negative
+        // the _sizes[i] > 1 is needed to avoid spurious copies when NPY_RELAXED_STRIDES is set
+        // [original cv2.cpp comment end]
+        // _sizes[i] can be replaced with nad->base.shape[i]
+        // _strides[i] can be replaced with SDX_GET_STRIDE(nav->stridx[i])
+        if ((i == ndims - 1 && nad->base.shape[i] > 1 && (size_t)SDX_GET_STRIDE(nav->stridx[i]) != elemsize) ||
+            (i < ndims - 1 && nad->base.shape[i] > 1 && SDX_GET_STRIDE(nav->stridx[i]) < SDX_GET_STRIDE(nav->stridx[i+1])))
+            needcopy = true;
+    }
+
+    if( ismultichannel && SDX_GET_STRIDE(nav->stridx[1]) != elemsize * nad->base.shape[2] )
+        needcopy = true;
+
+    if (needcopy) {
+        //TRACE_PRINTF("needcopy case is not supported\n");
+        return false;
+    }
+
+    // Normalize strides in case NPY_RELAXED_STRIDES is set
+    size_t default_step = elemsize;
+    for ( int i = ndims - 1; i >= 0; --i )
+    {
+        size[i] = (int)nad->base.shape[i];
+        if ( size[i] > 1 )
+        {
+            step[i] = (size_t)SDX_GET_STRIDE(nav->stridx[i]);
+            default_step = step[i] * size[i];
+        }
+        else
+        {
+            step[i] = default_step;
+            default_step *= size[i];
+        }
+    }
+
+    return true;
 }
 
-template<>
-bool rbopencv_to(VALUE o, Mat& m){
+// Converts NArray o to m without copying the data. If borrowed is false, m keeps o by UMatData of
+// g_numpyAllocator, so it can outlive the call (e.g. stored by a class, or returned as the same NArray).
+// If borrowed is true, m is only a header of the data of o (see rbopencv_to_borrowed()).
+static bool narray_to_mat(VALUE o, Mat& m, bool borrowed){
     TRACE_PRINTF("[rbopencv_to Mat] o: %s\n", db_get_class_name(o));
     bool allowND = true;
     if (NIL_P(o)) {
@@ -256,60 +587,26 @@ bool rbopencv_to(VALUE o, Mat& m){
         return false;
     }
 
-    int size[CV_MAX_DIM + 1];
-    size_t step[CV_MAX_DIM + 1];
-    size_t elemsize = CV_ELEM_SIZE1(type);
-    bool ismultichannel = ndims == 3 && nad->base.shape[2] <= CV_CN_MAX;
-    VALUE view = rb_funcall(o, rb_intern("view"), 0, 0);
-    narray_view_t* nav = na_get_narray_view_t(view);
-    //TRACE_PRINTF("  ismultichannel: %d\n", ismultichannel);
-    for (int i = 0; i < ndims; i++) {
-        if (SDX_IS_STRIDE(nav->stridx[i])) {
-            //TRACE_PRINTF("  shape[%d]: %ld, stride[%d]: %ld\n", i, nad->base.shape[i], i, SDX_GET_STRIDE(nav->stridx[i]));
-        } else {
-            //TRACE_PRINTF("  shape[%d]: %ld, is not stride -> not supported\n", i, nad->base.shape[i]);
-            return false;
-        }
-    }
-
-    for( int i = ndims-1; i >= 0 && !needcopy; i-- ) {
-        // [original cv2.cpp comment]
-        // these checks handle cases of
-        //  a) multi-dimensional (ndims > 2) arrays, as well as simpler 1- and 2-dimensional cases
-        //  b) transposed arrays, where _strides[] elements go in non-descending order
-        //  c) flipped arrays, where some of _strides[] elements are negative
-        // the _sizes[i] > 1 is needed to avoid spurious copies when NPY_RELAXED_STRIDES is set
-        // [original cv2.cpp comment end]
-        // _sizes[i] can be replaced with nad->base.shape[i]
-        // _strides[i] can be replaced with SDX_GET_STRIDE(nav->stridx[i])
-        if ((i == ndims - 1 && nad->base.shape[i] > 1 && (size_t)SDX_GET_STRIDE(nav->stridx[i]) != elemsize) ||
-            (i < ndims - 1 && nad->base.shape[i] > 1 && SDX_GET_STRIDE(nav->stridx[i]) < SDX_GET_STRIDE(nav->stridx[i+1])))
-            needcopy = true;
-    }
-
-    if( ismultichannel && SDX_GET_STRIDE(nav->stridx[1]) != elemsize * nad->base.shape[2] )
-        needcopy = true;
-
     if (needcopy) {
         //TRACE_PRINTF("needcopy case is not supported\n");
         return false;
     }
 
-    // Normalize strides in case NPY_RELAXED_STRIDES is set
-    size_t default_step = elemsize;
-    for ( int i = ndims - 1; i >= 0; --i )
-    {
-        size[i] = (int)nad->base.shape[i];
-        if ( size[i] > 1 )
-        {
-            step[i] = (size_t)SDX_GET_STRIDE(nav->stridx[i]);
-            default_step = step[i] * size[i];
-        }
-        else
-        {
+    int size[CV_MAX_DIM + 1];
+    size_t step[CV_MAX_DIM + 1];
+    size_t elemsize = CV_ELEM_SIZE1(type);
+    bool ismultichannel = ndims == 3 && nad->base.shape[2] <= CV_CN_MAX;
+    if (RNARRAY_TYPE(o) == NARRAY_DATA_T && nad->ptr) {
+        // Fast path: NArray which owns its data is contiguous, so the steps are computed from the
+        // shape without creating a view
+        size_t default_step = elemsize;
+        for (int i = ndims - 1; i >= 0; --i) {
+            size[i] = (int)nad->base.shape[i];
             step[i] = default_step;
             default_step *= size[i];
         }
+    } else if (!narray_view_steps(o, nad, ndims, elemsize, ismultichannel, size, step)) {
+        return false;
     }
 
     // handle degenerate case
@@ -336,13 +633,24 @@ bool rbopencv_to(VALUE o, Mat& m){
         //TRACE_PRINTF("  size[%d]: %d, step[%d] %ld\n", i, size[i], i, step[i]);
     }
     m = Mat(ndims, size, type, nad->ptr, step);
-    m.u = g_numpyAllocator.allocate(o, ndims, size, type, step);
-    m.addref();
-    m.allocator = &g_numpyAllocator;
+    if (!borrowed) {
+        m.u = g_numpyAllocator.wrap(o, nad->ptr, size[0] * step[0]);
+        m.addref();
+        m.allocator = &g_numpyAllocator;
+    }
 
     return true;
 }
 
+template<>
+bool rbopencv_to(VALUE o, Mat& m){
+    return narray_to_mat(o, m, false);
+}
+
+bool rbopencv_to_borrowed(VALUE o, Mat& m){
+    return narray_to_mat(o, m, true);
+}
+
 template<>
 bool rbopencv_to(VALUE obj, int& value){
     TRACE_PRINTF("[rbopencv_to int]\n");
@@ -556,29 +864,6 @@ bool rbopencv_to(VALUE obj, RotatedRect& dst){
     return true;
 }
 
-template<typename T>
-bool rbopencv_to(VALUE obj, std::vector<T>& value){
-    TRACE_PRINTF("[rbopencv_to vector_T %s]\n", typeid(T).name());
-    if (TYPE(obj) != T_ARRAY)
-        return false;
-    long len = rb_array_len(obj);
-    for (long i = 0; i < len; i++) {
-        VALUE value_elem = rb_ary_entry(obj, i);
-        T raw_elem;
-        bool ret = rbopencv_to(value_elem, raw_elem);
-        if (!ret)
-            return false;
-        value.push_back(raw_elem);
-    }
-    return true;
-}
-
-template<typename T>
-static VALUE rbopencv_from(const T& src) {
-    TRACE_PRINTF("[rbopencv_from primary] should not be used\n");
-    return Qnil;
-}
-
 template<>
 VALUE rbopencv_from(const cv::Mat& m){
     TRACE_PRINTF("[rbopencv_from Mat]\n");
@@ -588,7 +873,8 @@ VALUE rbopencv_from(const cv::Mat& m){
     }
     //TRACE_PRINTF("m.u: %p\n", m.u);
     cv::Mat temp, *p = (cv::Mat*)&m;
-    if (!p->u || p->allocator != &g_numpyAllocator) {
+    // Mats which do not refer to NArrays (e.g. allocated without the GVL) are copied to new NArrays
+    if (!p->u || p->u->currAllocator != &g_numpyAllocator) {
         temp.allocator = &g_numpyAllocator;
         m.copyTo(temp);
         p = &temp;
@@ -723,36 +1009,11 @@ VALUE rbopencv_from(const RotatedRect& src){
     return ret;
 }
 
-template<typename T>
-VALUE rbopencv_from(const std::vector<T>& value){
-    TRACE_PRINTF("[rbopencv_from vector_T %s]\n", typeid(T).name());
-    size_t size = value.size();
-    VALUE ret = rb_ary_new2(size);
-    for (const auto& x : value) {
-        VALUE item = rbopencv_from(x);
-        rb_ary_push(ret, item);
-    }
-    return ret;
-}
-
-struct MethodDef {
-    using func_ptr_for_ruby_method = VALUE (*)(int, VALUE*, VALUE);
-    const char *name;
-    func_ptr_for_ruby_method wrapper_func;
-};
-
-struct ConstDef {
-    const char *name;
-    long long val;
-};
-
-#include "autogen/rbopencv_include.hpp"
+#include "autogen/rbopencv_shared.hpp"
 static VALUE mCV2;
-#include "autogen/rbopencv_wrapclass.hpp"
-
-#include "autogen/rbopencv_enum_converter.hpp"
-#include "autogen/rbopencv_funcs.hpp"
+#include "autogen/rbopencv_unity.hpp"
 #include "autogen/rbopencv_modules_content.hpp"
+#include "autogen/rbopencv_kwargs.hpp"
 
 static std::vector<std::string> split_string(const std::string& str, char delim){
     std::vector<std::string> substrs;
@@ -890,6 +1151,22 @@ static VALUE get_parent_module_by_wname(VALUE top_module, const std::string wnam
 extern "C" {
 void Init_cv2(){
     mCV2 = rb_define_module("CV2");
+#ifndef RBOPENCV_DISABLE_TRACE
+    const char *s_env = getenv("RBOPENCV_TRACE");
+    rbopencv_trace_enabled = s_env && atoi(s_env);
+#endif
+    init_kwarg_ids();
+    g_matOwnersKeeper = TypedData_Wrap_Struct(0, &mat_owners_type, &g_matOwners);
+    rb_gc_register_address(&g_matOwnersKeeper);
+#ifdef RBOPENCV_ENABLE_STATS
+    rb_define_const(mCV2, "STATS_ENABLED", Qtrue);
+#else
+    rb_define_const(mCV2, "STATS_ENABLED", Qfalse);
+#endif
+    rb_define_module_function(mCV2, "stats", RUBY_METHOD_FUNC(wrap_stats), 0);
+    rb_define_module_function(mCV2, "reset_stats", RUBY_METHOD_FUNC(wrap_reset_stats), 0);
+    rb_define_module_function(mCV2, "set_output_pool_limit", RUBY_METHOD_FUNC(wrap_set_output_pool_limit), 1);
+    rb_define_module_function(mCV2, "output_pool_stats", RUBY_METHOD_FUNC(wrap_output_pool_stats), 0);
 
     #include "autogen/rbopencv_namespaceregistration.hpp"
     #include "autogen/rbopencv_classregistration.hpp"
@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+
+# Benchmark of the generator with synthetic headers in the style of dummycv/dummycv.hpp.
+#
+# For each scale, NAMESPACES*scale headers (one namespace each) are generated, and
+# CppHeaderParser.parse(), hdr_parser_wrapper.parse_headers() and gen2rb.generate_code() are timed
+# separately (the best of --repeat runs). The times are also divided by the time of a calibration
+# loop, so that the results of a faster or slower machine are comparable. The results are written as
+# JSON, and the normalized times are compared with a local baseline (dev-tools/bench-baseline.json by
+# default, not committed).
+#
+#   $ ./dev-tools/bench-generator.py                    # run and compare with the baseline
+#   $ ./dev-tools/bench-generator.py --save-baseline    # run and update the baseline
+
+import argparse
+import gc
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import gen2rb
+import hdr_parser
+import hdr_parser_wrapper
+
+BENCH_FORMAT_VERSION = 2
+STAGES = ["parse", "parse_headers", "generate_code"]
+
+def gen_header(ns_i:int, n_classes:int, n_functions:int, n_overloads:int, n_enums:int, n_props:int) -> str:
+    lines = []
+    lines.append(f"#ifndef BENCH{ns_i}_HPP")
+    lines.append(f"#define BENCH{ns_i}_HPP")
+    lines.append("")
+    lines.append("#include <opencv2/core/types.hpp>")
+    lines.append("#include <vector>")
+    lines.append("")
+    lines.append("namespace cv {")
+    lines.append(f"namespace bench{ns_i} {{")
+    lines.append("")
+    for e in range(n_enums):
+        lines.append(f"enum E{e} {{ E{e}_AAA, E{e}_BBB = {e + 1}, E{e}_CCC }};")
+        lines.append(f"enum class SE{e} {{ DDD, EEE }};")
+    lines.append("")
+    for c in range(n_classes):
+        # Every other class derives from the previous one
+        parent = f" : public C{c - 1}" if c % 2 == 1 else ""
+        lines.append(f"class CV_EXPORTS_W C{c}{parent} {{")
+        lines.append("public:")
+        lines.append(f"    enum Flags{c} {{ FLAG{c}_A = 1, FLAG{c}_B = 2 }};")
+        lines.append(f"    CV_WRAP C{c}() {{}}")
+        lines.append(f"    CV_WRAP C{c}(int value1, double value2 = 1.0) : m_value1(value1) {{}}")
+        for f in range(n_functions):
+            lines.append(f"    CV_WRAP int method{f}(int a) {{ return m_value1 + a; }}")
+            for o in range(1, n_overloads):
+                extra_args = ", ".join(f"double b{k}" for k in range(o))
+                lines.append(f"    CV_WRAP double method{f}(int a, {extra_args}, const Point2f& pt = Point2f()) {{ return a; }}")
+            lines.append(f"    CV_WRAP std::vector<Point2f> vecMethod{f}(const std::vector<std::vector<int>>& a, "
+                         f"CV_OUT std::vector<Rect>& rects) {{ return {{}}; }}")
+            lines.append(f"    CV_WRAP static String staticMethod{f}(const String& s, Size sz = Size()) {{ return s; }}")
+        for p in range(n_props):
+            lines.append(f"    CV_PROP_RW int prop_int{p};")
+            lines.append(f"    CV_PROP double prop_double{p};")
+            lines.append(f"    CV_PROP_RW std::vector<Point> prop_points{p};")
+        lines.append("    int m_value1{1};")
+        lines.append("};")
+        lines.append("")
+    for f in range(n_functions):
+        lines.append(f"CV_EXPORTS_W inline int func{f}(int a) {{ return a; }}")
+        for o in range(1, n_overloads):
+            extra_args = ", ".join(f"double b{k}" for k in range(o))
+            lines.append(f"CV_EXPORTS_W inline void func{f}(const Mat& src, CV_OUT Mat& dst, {extra_args}, int flags = 0) {{}}")
+        lines.append(f"CV_EXPORTS_AS(func{f}_as) inline std::vector<int> funcVec{f}(const std::vector<std::vector<Point2f>>& pts) {{ return {{}}; }}")
+        if n_classes > 0:
+            lines.append(f"CV_EXPORTS_W inline C0 funcClass{f}(C0 c, CV_IN_OUT Rect& r) {{ return c; }}")
+    lines.append("")
+    lines.append(f"}} // bench{ns_i}")
+    lines.append("} // cv")
+    lines.append("")
+    lines.append(f"#endif // BENCH{ns_i}_HPP")
+    return "\n".join(lines) + "\n"
+
+def gen_corpus(out_dir:str, n_namespaces:int, **kwargs) -> list[str]:
+    headers = []
+    for ns_i in range(n_namespaces):
+        path = os.path.join(out_dir, f"bench{ns_i}.hpp")
+        with open(path, "w") as f:
+            f.write(gen_header(ns_i, **kwargs))
+        headers.append(path)
+    return headers
+
+# Returns the best time of repeat runs of func() and the result of the last run
+def measure(func, repeat:int) -> tuple[float,object]:
+    best = None
+    for _ in range(repeat):
+        # Do not measure the garbage of the previous run
+        gc.collect()
+        t0 = time.perf_counter()
+        result = func()
+        t = time.perf_counter() - t0
+        best = t if best is None else min(best, t)
+    return best, result
+
+def bench_parse(headers:list[str]) -> int:
+    n_decls = 0
+    for hdr in headers:
+        parser = hdr_parser.CppHeaderParser(generate_umat_decls=False, generate_gpumat_decls=False)
+        n_decls += len(parser.parse(hdr))
+    return n_decls
+
+def bench_generate_code(api:hdr_parser_wrapper.CvApi, out_dir:str):
+    saved = (gen2rb.api, gen2rb.g_out_dir)
+    gen2rb.api, gen2rb.g_out_dir = api, out_dir
+    try:
+        gen2rb.analyze_support(api)
+        gen2rb.generate_code(api)
+    finally:
+        gen2rb.api, gen2rb.g_out_dir = saved
+
+# Pure Python work in the style of the generator (formatting, splitting and indexing names), whose
+# time is the unit of the normalized times
+def calibration_loop() -> int:
+    names = {}
+    for i in range(200000):
+        qname = f"cv.ns{i % 97}.C{i % 31}.method{i}"
+        names[qname] = qname.split(".")[-1].upper()
+    return len(names)
+
+def run_scale(scale:int, calibration:float, args) -> dict:
+    with tempfile.TemporaryDirectory(prefix="rbopencv-bench-") as tmp_dir:
+        hdr_dir = os.path.join(tmp_dir, "headers")
+        out_dir = os.path.join(tmp_dir, "autogen")
+        os.makedirs(hdr_dir)
+        os.makedirs(out_dir)
+        headers = gen_corpus(hdr_dir, args.namespaces*scale, n_classes=args.classes, n_functions=args.functions,
+                             n_overloads=args.overloads, n_enums=args.enums, n_props=args.props)
+        n_bytes = sum(os.path.getsize(hdr) for hdr in headers)
+        t_parse, n_decls = measure(lambda: bench_parse(headers), args.repeat)
+        t_parse_headers, api = measure(lambda: hdr_parser_wrapper.parse_headers(headers), args.repeat)
+        t_generate_code, _ = measure(lambda: bench_generate_code(api, out_dir), args.repeat)
+    seconds = {"parse": t_parse, "parse_headers": t_parse_headers, "generate_code": t_generate_code}
+    return {
+        "scale": scale,
+        "headers": len(headers),
+        "bytes": n_bytes,
+        "decls": n_decls,
+        "klasses": len(api.cvklasses),
+        "funcs": len(api.cvfuncs),
+        "seconds": seconds,
+        "normalized": {stage: t / calibration for stage, t in seconds.items()},
+    }
+
+# Prints the ratio of the normalized time of each stage to the baseline. Returns the number of regressions.
+def compare(results:dict, baseline:dict, tolerance:float) -> int:
+    if baseline.get("version") != BENCH_FORMAT_VERSION or baseline.get("corpus") != results["corpus"]:
+        print("[Warning] The baseline was created with another format or corpus. Run with --save-baseline to update it")
+        return 0
+    base_runs = {run["scale"]: run for run in baseline["runs"]}
+    n_regressions = 0
+    for run in results["runs"]:
+        base_run = base_runs.get(run["scale"])
+        if base_run is None:
+            print(f"[Info] scale {run['scale']}: not in the baseline")
+            continue
+        for stage in STAGES:
+            t = run["normalized"][stage]
+            t_base = base_run["normalized"][stage]
+            ratio = t / t_base if t_base > 0 else 1.0
+            status = "ok"
+            if ratio > 1.0 + tolerance:
+                status = "REGRESSION"
+                n_regressions += 1
+            elif ratio < 1.0 - tolerance:
+                status = "improved"
+            print(f"[Info] scale {run['scale']} {stage}: {t:.2f} (baseline {t_base:.2f}, x{ratio:.2f}) {status}")
+    return n_regressions
+
+def main():
+    default_baseline = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench-baseline.json")
+    argparser = argparse.ArgumentParser(prog="bench-generator.py")
+    argparser.add_argument("--scales", default="1,4,16",
+        help="comma separated list of scales. Each scale generates NAMESPACES*scale headers (default: 1,4,16)")
+    argparser.add_argument("--namespaces", type=int, default=4, help="number of namespaces (headers) at scale 1 (default: 4)")
+    argparser.add_argument("--classes", type=int, default=8, help="number of classes per namespace (default: 8)")
+    argparser.add_argument("--functions", type=int, default=4,
+        help="number of functions per namespace and methods per class (default: 4)")
+    argparser.add_argument("--overloads", type=int, default=3, help="number of overloads of each function (default: 3)")
+    argparser.add_argument("--enums", type=int, default=2, help="number of enums per namespace (default: 2)")
+    argparser.add_argument("--props", type=int, default=2, help="number of CV_PROP members per class (x3, default: 2)")
+    argparser.add_argument("--repeat", type=int, default=3, help="number of runs of each stage. The best is used (default: 3)")
+    argparser.add_argument("-o", "--output", metavar="FILE", help="write the results to FILE as JSON")
+    argparser.add_argument("--baseline", metavar="FILE", default=default_baseline,
+        help="baseline to compare with, created by --save-baseline (default: dev-tools/bench-baseline.json)")
+    argparser.add_argument("--save-baseline", action="store_true", help="write the results to the baseline")
+    argparser.add_argument("--tolerance", type=float, default=0.25,
+        help="a stage slower than the baseline by more than this ratio is a regression (default: 0.25)")
+    args = argparser.parse_args()
+
+    corpus = {"namespaces": args.namespaces, "classes": args.classes, "functions": args.functions,
+              "overloads": args.overloads, "enums": args.enums, "props": args.props}
+    results = {
+        "version": BENCH_FORMAT_VERSION,
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "corpus": corpus,
+        "runs": [],
+    }
+    results["calibration"], _ = measure(calibration_loop, max(args.repeat, 3))
+    print(f"[Info] calibration: {results['calibration']:.3f}s")
+    for scale in [int(s) for s in args.scales.split(",")]:
+        run = run_scale(scale, results["calibration"], args)
+        seconds = " ".join(f"{stage}={run['seconds'][stage]:.3f}s" for stage in STAGES)
+        print(f"[Info] scale {scale}: {run['headers']} header(s), {run['bytes']} bytes, {run['decls']} decl(s): {seconds}")
+        results["runs"].append(run)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"[Info] baseline: {args.baseline}")
+        return
+    if not os.path.exists(args.baseline):
+        print(f"[Warning] {args.baseline} does not exist. Run with --save-baseline to create it")
+        return
+    with open(args.baseline, "r") as f:
+        baseline = json.load(f)
+    n_regressions = compare(results, baseline, args.tolerance)
+    if n_regressions:
+        print(f"[Error] {n_regressions} regression(s)")
+        exit(1)
+
+if __name__ == "__main__":
+    main()
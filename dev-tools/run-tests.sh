@@ -0,0 +1,12 @@
+#!/bin/sh
+
+# Builds cv2.so with `ruby extconf.rb --enable-stats` and with the default options, and runs
+# test/bind-test1.rb with each of them, so that CV2.stats is tested too. Run it after gen2rb.py.
+set -e
+cd "$(dirname "$0")/.."
+for opts in --enable-stats ""; do
+    ruby extconf.rb $opts
+    make clean
+    make
+    ./test/bind-test1.rb
+done
@@ -70,7 +70,7 @@ public:
     CV_WRAP int method1(int a) { return m_value1 + a; }
     int m_value1{1};
 };
-CV_EXPORTS_W C1 bindTestClassInstance1(C1 c){ c.m_value1 = 1000; return c; }
+CV_EXPORTS_W inline C1 bindTestClassInstance1(C1 c){ c.m_value1 = 1000; return c; }
 } // classtest1
 
 namespace classtest2 {
@@ -130,120 +130,137 @@ private:
 }
 
 // global functions for test arguments and retval
-CV_EXPORTS_W int bindTest1(int a) { return a+a; } // Simple function
+CV_EXPORTS_W inline int bindTest1(int a) { return a+a; } // Simple function
 // CV_EXPORTS_W double bindTest1(int a, CV_IN_OUT Point& b, CV_OUT int* c, int d=10, RNG* rng=0, double e=1.2);
-CV_EXPORTS_W void bindTest2(int a) { int tmp = a + 10; if (tmp) {} } // retval: void
-CV_EXPORTS_W int bindTest3(int a) { return a + a; }
-CV_EXPORTS_W void bindTest4(int a, CV_IN_OUT Point& pt) { pt.x += a; pt.y -= a; }
+CV_EXPORTS_W inline void bindTest2(int a) { int tmp = a + 10; if (tmp) {} } // retval: void
+CV_EXPORTS_W inline int bindTest3(int a) { return a + a; }
+CV_EXPORTS_W inline void bindTest4(int a, CV_IN_OUT Point& pt) { pt.x += a; pt.y -= a; }
 // CV_EXPORTS_W void bindTest5(int a, CV_IN_OUT Point& pt, CV_OUT int* x);
 // CV_EXPORTS_W bool bindTest6(int a, CV_IN_OUT Point& pt, CV_OUT int* x);
-CV_EXPORTS_W int bindTest7(int a, int b=2, int c=3) { return (a + b) * c; }
-CV_EXPORTS_W void bindTest8(int a, CV_OUT int& b, int c=1) { b = a+c; }
+CV_EXPORTS_W inline int bindTest7(int a, int b=2, int c=3) { return (a + b) * c; }
+CV_EXPORTS_W inline void bindTest8(int a, CV_OUT int& b, int c=1) { b = a+c; }
 
-CV_EXPORTS_W double bindTest_double(double a) { return a + 0.5; }
+CV_EXPORTS_W inline double bindTest_double(double a) { return a + 0.5; }
 
-CV_EXPORTS_W double bindTest_overload(double a) { return a * 2.0; }
-CV_EXPORTS_W double bindTest_overload(Point pt) { return pt.x * 2.0 + pt.y * 2.0; }
-CV_EXPORTS_W double bindTest_overload(double a, double b) { return a * b; }
+CV_EXPORTS_W inline double bindTest_overload(double a) { return a * 2.0; }
+CV_EXPORTS_W inline double bindTest_overload(Point pt) { return pt.x * 2.0 + pt.y * 2.0; }
+CV_EXPORTS_W inline double bindTest_overload(double a, double b) { return a * b; }
 // CV_EXPORTS_W double bindTest_overload(Point a, Point b, double c);
 // CV_EXPORTS_W double bindTest_overload(RotatedRect a);
 
+// Both accept an Array, so the conversion of the 1st one fails for an Array of 4 elements
+CV_EXPORTS_W inline int bindTest_overload_miss(Size sz) { return sz.width * sz.height; }
+CV_EXPORTS_W inline int bindTest_overload_miss(Rect r) { return r.width * r.height; }
+
 // Overloaded functions with CV_EXPORTS and CV_EXPORTS_W (cv::clipLine uses this style).
 // Only the last one is supported even in python-binding
 // CV_EXPORTS   int bindTest_overload2(int a) { return a + 1; }
 // CV_EXPORTS_W int bindTest_overload2(int a, int b) { return a + b; }
 
-CV_EXPORTS_W void bindTest_Out_Point(int a, CV_OUT Point& pt) { pt.x=a+10; pt.y=a-10; }
-CV_EXPORTS_W void bindTest_Out_Pointp(int a, CV_OUT Point* pt) { pt->x=a+11; pt->y=a-11; }
-CV_EXPORTS_W void bindTest_InOut_Mat(CV_IN_OUT Mat&) {}
-CV_EXPORTS_W void bindTest_InOut_cvMat(CV_IN_OUT cv::Mat&) {}
-CV_EXPORTS_W void bindTest_InOut_bool(CV_IN_OUT bool& a) { a = !a; }
-CV_EXPORTS_W void bindTest_InOut_int(CV_IN_OUT int& a) { a += 10; }
-CV_EXPORTS_W void bindTest_InOut_char(CV_IN_OUT char& a) { a += 20; };
-CV_EXPORTS_W void bindTest_InOut_uchar(CV_IN_OUT uchar& a) { a += 30; };
-CV_EXPORTS_W void bindTest_Out_intp(CV_OUT int* a) { *a = 10; }
-CV_EXPORTS_W void bindTest_InOut_size_t(CV_IN_OUT size_t& a) { a += 10; }
-CV_EXPORTS_W void bindTest_InOut_float(CV_IN_OUT float& a) { a += 0.5; }
-CV_EXPORTS_W void bindTest_InOut_double(CV_IN_OUT double& a) { a += 1.5; }
-CV_EXPORTS_W void bindTest_Out_doublep(CV_OUT double* a) { *a = 2.5; }
-CV_EXPORTS_W int bindTest_In_String(const String& s) { return s.length(); }
-CV_EXPORTS_W int bindTest_In_cvString(const cv::String& s) { return s.length(); }
-CV_EXPORTS_W int bindTest_In_stdstring(const std::string& s) { return s.length(); }
-CV_EXPORTS_W String bindTest_Out_String() { return "aa"; }
-CV_EXPORTS_W cv::String bindTest_Out_cvString() { return "bb"; }
-CV_EXPORTS_W std::string bindTest_Out_stdstring() { return "cc"; }
-CV_EXPORTS_W String bindTest_InOut_String(const String& s) { return s + "x"; }
-CV_EXPORTS_W int bindTest_In_cstring(const char* s) { return static_cast<int>(strlen(s)); }
-CV_EXPORTS_W void bindTest_InOut_Scalar(CV_IN_OUT Scalar& a) { a[0] += 1; a[1] += 2; a[2] += 3; a[3] += 4; }
-CV_EXPORTS_W void bindTest_InOut_Size(CV_IN_OUT Size& a) { a.width += 10; a.height += 10; }
-CV_EXPORTS_W void bindTest_InOut_Size2i(CV_IN_OUT Size2i& a) { a.width += 20; a.height += 20; }
+CV_EXPORTS_W inline void bindTest_Out_Point(int a, CV_OUT Point& pt) { pt.x=a+10; pt.y=a-10; }
+CV_EXPORTS_W inline void bindTest_Out_Pointp(int a, CV_OUT Point* pt) { pt->x=a+11; pt->y=a-11; }
+CV_EXPORTS_W inline void bindTest_InOut_Mat(CV_IN_OUT Mat&) {}
+CV_EXPORTS_W inline void bindTest_InOut_cvMat(CV_IN_OUT cv::Mat&) {}
+CV_EXPORTS_W inline void bindTest_Out_Mat(int rows, CV_OUT Mat& dst) { dst.create(rows, 3, CV_8UC1); dst.setTo(rows); }
+// Called without the GVL (listed in _g_release_gvl_funcs of gen2rb.py)
+CV_EXPORTS_W inline void bindTest_ReleaseGVL_Mat(int rows, int value, CV_OUT Mat& dst) { CV_Assert(rows >= 0); dst.create(rows, 3, CV_32SC1); dst.setTo(value); }
+// Returns the sum of each channel of src (CV_8U)
+CV_EXPORTS_W inline Scalar bindTest_In_Mat(const Mat& src) {
+    Scalar s;
+    for (int y = 0; y < src.rows; y++)
+        for (int x = 0; x < src.cols * src.channels(); x++)
+            s[x % src.channels()] += src.ptr<uchar>(y)[x];
+    return s;
+}
+CV_EXPORTS_W inline Mat bindTest_Ret_Mat(const Mat& src) { return src; }
+CV_EXPORTS_W inline void bindTest_InOut_Out_Mat(CV_IN_OUT Mat& src, CV_OUT Mat& dst) { src.copyTo(dst); }
+CV_EXPORTS_W inline void bindTest_InOut_bool(CV_IN_OUT bool& a) { a = !a; }
+CV_EXPORTS_W inline void bindTest_InOut_int(CV_IN_OUT int& a) { a += 10; }
+CV_EXPORTS_W inline void bindTest_InOut_char(CV_IN_OUT char& a) { a += 20; };
+CV_EXPORTS_W inline void bindTest_InOut_uchar(CV_IN_OUT uchar& a) { a += 30; };
+CV_EXPORTS_W inline void bindTest_Out_intp(CV_OUT int* a) { *a = 10; }
+CV_EXPORTS_W inline void bindTest_InOut_size_t(CV_IN_OUT size_t& a) { a += 10; }
+CV_EXPORTS_W inline void bindTest_InOut_float(CV_IN_OUT float& a) { a += 0.5; }
+CV_EXPORTS_W inline void bindTest_InOut_double(CV_IN_OUT double& a) { a += 1.5; }
+CV_EXPORTS_W inline void bindTest_Out_doublep(CV_OUT double* a) { *a = 2.5; }
+CV_EXPORTS_W inline int bindTest_In_String(const String& s) { return s.length(); }
+CV_EXPORTS_W inline int bindTest_In_cvString(const cv::String& s) { return s.length(); }
+CV_EXPORTS_W inline int bindTest_In_stdstring(const std::string& s) { return s.length(); }
+CV_EXPORTS_W inline String bindTest_Out_String() { return "aa"; }
+CV_EXPORTS_W inline cv::String bindTest_Out_cvString() { return "bb"; }
+CV_EXPORTS_W inline std::string bindTest_Out_stdstring() { return "cc"; }
+CV_EXPORTS_W inline String bindTest_InOut_String(const String& s) { return s + "x"; }
+CV_EXPORTS_W inline int bindTest_In_cstring(const char* s) { return static_cast<int>(strlen(s)); }
+CV_EXPORTS_W inline void bindTest_InOut_Scalar(CV_IN_OUT Scalar& a) { a[0] += 1; a[1] += 2; a[2] += 3; a[3] += 4; }
+CV_EXPORTS_W inline void bindTest_InOut_Size(CV_IN_OUT Size& a) { a.width += 10; a.height += 10; }
+CV_EXPORTS_W inline void bindTest_InOut_Size2i(CV_IN_OUT Size2i& a) { a.width += 20; a.height += 20; }
 // CV_EXPORTS_W void bindTest_InOut_Size2l(CV_IN_OUT Size2i& a) { a.width += 30; a.height += 30; }
-CV_EXPORTS_W void bindTest_InOut_Size2f(CV_IN_OUT Size2f& a) { a.width += 0.5; a.height += 0.5; }
-CV_EXPORTS_W void bindTest_InOut_Point(CV_IN_OUT Point& a) { a.x+=10; a.y+=10; }
-CV_EXPORTS_W void bindTest_InOut_Pointpdv(CV_OUT Point* pt = 0) { if (pt) { pt->x = 10; pt->y = 20; }} // Point pointer with default value
-CV_EXPORTS_W void bindTest_InOut_Point2f(CV_IN_OUT Point2f& a) { a.x += 0.5; a.y += 0.5; }
-CV_EXPORTS_W void bindTest_Out_Point2fp(CV_OUT Point2f* p) { p->x = 0.5; p->y = 1.5; }
-CV_EXPORTS_W void bindTest_InOut_Point2d(CV_IN_OUT Point2d& a) { a.x += 1.5; a.y += 1.5; }
-CV_EXPORTS_W void bindTest_InOut_Rect(CV_IN_OUT Rect& r) { r.x += 10; r.y += 20; r.width += 30; r.height += 40; }
-CV_EXPORTS_W void bindTest_Out_Rectp(CV_OUT Rect* r = 0) { r->x = 10; r->y = 20; r->width = 30; r->height = 40; }
-CV_EXPORTS_W void bindTest_InOut_RotatedRect(CV_IN_OUT RotatedRect& a) {
+CV_EXPORTS_W inline void bindTest_InOut_Size2f(CV_IN_OUT Size2f& a) { a.width += 0.5; a.height += 0.5; }
+CV_EXPORTS_W inline void bindTest_InOut_Point(CV_IN_OUT Point& a) { a.x+=10; a.y+=10; }
+CV_EXPORTS_W inline void bindTest_InOut_Pointpdv(CV_OUT Point* pt = 0) { if (pt) { pt->x = 10; pt->y = 20; }} // Point pointer with default value
+CV_EXPORTS_W inline void bindTest_InOut_Point2f(CV_IN_OUT Point2f& a) { a.x += 0.5; a.y += 0.5; }
+CV_EXPORTS_W inline void bindTest_Out_Point2fp(CV_OUT Point2f* p) { p->x = 0.5; p->y = 1.5; }
+CV_EXPORTS_W inline void bindTest_InOut_Point2d(CV_IN_OUT Point2d& a) { a.x += 1.5; a.y += 1.5; }
+CV_EXPORTS_W inline void bindTest_InOut_Rect(CV_IN_OUT Rect& r) { r.x += 10; r.y += 20; r.width += 30; r.height += 40; }
+CV_EXPORTS_W inline void bindTest_Out_Rectp(CV_OUT Rect* r = 0) { r->x = 10; r->y = 20; r->width = 30; r->height = 40; }
+CV_EXPORTS_W inline void bindTest_InOut_RotatedRect(CV_IN_OUT RotatedRect& a) {
     a.center.x += 0.5;
     a.center.y += 0.5;
     a.size.width += 0.5;
     a.size.height += 0.5;
     a.angle += 0.5;
 }
-CV_EXPORTS_W void bindTest_InOut_vector_int(CV_IN_OUT std::vector<int>& xs) { for (auto& x : xs) { x += 3; } }
-CV_EXPORTS_W void bindTest_InOut_vector_char(CV_IN_OUT std::vector<char>& xs) { for (auto& x : xs) { x += 4; } }
-CV_EXPORTS_W void bindTest_InOut_vector_uchar(CV_IN_OUT std::vector<uchar>& xs) { for (auto& x : xs) { x += 5; } }
-CV_EXPORTS_W void bindTest_InOut_vector_float(CV_IN_OUT std::vector<float>& xs) { for (auto& x : xs) { x += 0.5; } }
-CV_EXPORTS_W void bindTest_InOut_vector_double(CV_IN_OUT std::vector<double>& xs) { for (auto& x : xs) { x += 1.5; } }
-CV_EXPORTS_W void bindTest_InOut_vector_String(CV_IN_OUT std::vector<String>& ss) { for (auto& s : ss) { s += "x"; } }
-CV_EXPORTS_W void bindTest_InOut_vector_cvString(CV_IN_OUT std::vector<cv::String>& ss) { for (auto& s : ss) { s += "y"; } }
-CV_EXPORTS_W void bindTest_InOut_vector_stdstring(CV_IN_OUT std::vector<std::string>& ss) { for (auto& s : ss) { s += "z"; } }
-CV_EXPORTS_W void bindTest_InOut_vector_Point(CV_IN_OUT std::vector<Point>& a) {
+CV_EXPORTS_W inline void bindTest_InOut_vector_int(CV_IN_OUT std::vector<int>& xs) { for (auto& x : xs) { x += 3; } }
+CV_EXPORTS_W inline void bindTest_InOut_vector_char(CV_IN_OUT std::vector<char>& xs) { for (auto& x : xs) { x += 4; } }
+CV_EXPORTS_W inline void bindTest_InOut_vector_uchar(CV_IN_OUT std::vector<uchar>& xs) { for (auto& x : xs) { x += 5; } }
+CV_EXPORTS_W inline void bindTest_InOut_vector_float(CV_IN_OUT std::vector<float>& xs) { for (auto& x : xs) { x += 0.5; } }
+CV_EXPORTS_W inline void bindTest_InOut_vector_double(CV_IN_OUT std::vector<double>& xs) { for (auto& x : xs) { x += 1.5; } }
+CV_EXPORTS_W inline void bindTest_InOut_vector_String(CV_IN_OUT std::vector<String>& ss) { for (auto& s : ss) { s += "x"; } }
+CV_EXPORTS_W inline void bindTest_InOut_vector_cvString(CV_IN_OUT std::vector<cv::String>& ss) { for (auto& s : ss) { s += "y"; } }
+CV_EXPORTS_W inline void bindTest_InOut_vector_stdstring(CV_IN_OUT std::vector<std::string>& ss) { for (auto& s : ss) { s += "z"; } }
+CV_EXPORTS_W inline void bindTest_InOut_vector_Point(CV_IN_OUT std::vector<Point>& a) {
     Point p1{10, 11}, p2{20, 21};
     for (Point& p : a) { p.x += 1; p.y += 1; }
     a.push_back(p1); a.push_back(p2);
 }
-CV_EXPORTS_W void bindTest_InOut_vector_Point2f(CV_IN_OUT std::vector<Point2f>& a) {
+CV_EXPORTS_W inline void bindTest_InOut_vector_Point2f(CV_IN_OUT std::vector<Point2f>& a) {
     Point2f p1{10.5, 11.5}, p2{20.5, 21.5};
     for (Point2f& p : a) { p.x += 0.5; p.y += 0.5; }
     a.push_back(p1); a.push_back(p2);
 }
-CV_EXPORTS_W void bindTest_InOut_vector_Rect(CV_IN_OUT std::vector<Rect>& rects) {
+CV_EXPORTS_W inline void bindTest_InOut_vector_Rect(CV_IN_OUT std::vector<Rect>& rects) {
     for (auto& rect : rects) { rect.x += 1; rect.y += 2; rect.width += 3; rect.height += 4; }
 }
-CV_EXPORTS_W void bindTest_InOut_vector_RotatedRect(CV_IN_OUT std::vector<RotatedRect>& rrects) {
+CV_EXPORTS_W inline void bindTest_InOut_vector_RotatedRect(CV_IN_OUT std::vector<RotatedRect>& rrects) {
     for (auto& rrect : rrects) {
         rrect.angle += 10;
         rrect.center.x += 1; rrect.center.y -= 1;
         rrect.size.width += 100; rrect.size.height -= 100;
     }
 }
-CV_EXPORTS_W void bindTest_InOut_vector_Size(CV_IN_OUT std::vector<Size>& sizes) {
+CV_EXPORTS_W inline void bindTest_InOut_vector_Size(CV_IN_OUT std::vector<Size>& sizes) {
     for (auto& size : sizes) { size.width += 100; size.height -= 100; }
 }
-CV_EXPORTS_W std::vector<Size> bindTest_InOut_vector_Size2(std::vector<Size>& sizes) {
+CV_EXPORTS_W inline std::vector<Size> bindTest_InOut_vector_Size2(std::vector<Size>& sizes) {
     std::vector<Size> ret_sizes;
     for (const auto& size : sizes) {
         ret_sizes.push_back(Size{size.width + 100, size.height - 100});
     }
     return ret_sizes;
 }
-CV_EXPORTS_W void bindTest_InOut_vector_vector_int(CV_IN_OUT std::vector<std::vector<int>>& xss) {
+CV_EXPORTS_W inline void bindTest_InOut_vector_vector_int(CV_IN_OUT std::vector<std::vector<int>>& xss) {
     for (auto& xs : xss) { for (auto& x : xs) { x += 1; } }
 }
-CV_EXPORTS_W void bindTest_InOut_vector_vector_Point(CV_IN_OUT std::vector<std::vector<Point>>& pss) {
+CV_EXPORTS_W inline void bindTest_InOut_vector_vector_Point(CV_IN_OUT std::vector<std::vector<Point>>& pss) {
     for (auto& ps : pss) { for (auto& p : ps) { p.x += 1; p.y += 2; } }
 }
-CV_EXPORTS_W void bindTest_InOut_vector_vector_Point2f(CV_IN_OUT std::vector<std::vector<Point2f>>& pss) {
+CV_EXPORTS_W inline void bindTest_InOut_vector_vector_Point2f(CV_IN_OUT std::vector<std::vector<Point2f>>& pss) {
     for (auto& ps : pss) { for (auto& p : ps) { p.x += 1.5; p.y += 2.5; } }
 }
-CV_EXPORTS CV_WRAP_AS(wrapAsFunc1) int bindTest_WrapAsFunc(int a) { return a + 10; }
-CV_EXPORTS CV_WRAP_AS(wrapAsFunc2) int bindTest_WrapAsFunc(std::string s) { return static_cast<int>(s.length()); }
-CV_EXPORTS_AS(exportsAsFunc1) int bindTest_ExportsAsFunc(int a) { return a + 10; }
-CV_EXPORTS_AS(exportsAsFunc2) int bindTest_ExportsAsFunc(std::string s) { return static_cast<int>(s.length()); }
+CV_EXPORTS CV_WRAP_AS(wrapAsFunc1) inline int bindTest_WrapAsFunc(int a) { return a + 10; }
+CV_EXPORTS CV_WRAP_AS(wrapAsFunc2) inline int bindTest_WrapAsFunc(std::string s) { return static_cast<int>(s.length()); }
+CV_EXPORTS_AS(exportsAsFunc1) inline int bindTest_ExportsAsFunc(int a) { return a + 10; }
+CV_EXPORTS_AS(exportsAsFunc2) inline int bindTest_ExportsAsFunc(std::string s) { return static_cast<int>(s.length()); }
 
 // enum
 enum MyEnum1 {
@@ -252,7 +269,7 @@ enum MyEnum1 {
     MYENUM1_COLOR     =  1,
     MYENUM1_IGNORE_ORIENTATION = 128,
 };
-CV_EXPORTS_W cv::MyEnum1 bindTest_OldEnum(MyEnum1 e) {
+CV_EXPORTS_W inline cv::MyEnum1 bindTest_OldEnum(MyEnum1 e) {
     if (e == MYENUM1_GRAYSCALE) { return MYENUM1_COLOR; }
     return MYENUM1_IGNORE_ORIENTATION;
 }
@@ -289,7 +306,7 @@ public:
     CV_WRAP int method1() { return m_value1; }
     int m_value1{333};
 };
-CV_EXPORTS_W Ptr<Fizz> createFizz() { auto p = std::make_shared<Fizz>(444); return p; }
+CV_EXPORTS_W inline Ptr<Fizz> createFizz() { auto p = std::make_shared<Fizz>(444); return p; }
 
 // class CV_EXPORTS_W Algorithm {
 // public:
@@ -319,7 +336,7 @@ public:
     CV_WRAP int method1(int a) { return a+10; }
 };
 namespace Ns11 { // sub-sub-namespace
-CV_EXPORTS_W int bindTest_Ns11(int a) { return a + 11; } // global function in sub-sub-namespace
+CV_EXPORTS_W inline int bindTest_Ns11(int a) { return a + 11; } // global function in sub-sub-namespace
 enum MyEnum4 {
     MYENUM4_VALUE_1 = 1000,
     MYENUM4_VALUE_2 = 1100,
@@ -349,7 +366,7 @@ public:
     int method1() override { return m_value1; }
     int m_value1{1000};
 };
-CV_EXPORTS_W Ptr<SubSubI2> createSubSubI2() {
+CV_EXPORTS_W inline Ptr<SubSubI2> createSubSubI2() {
     Ptr<SubSubI2> p{new SubSubC2(2000)};
     return p;
 }
@@ -365,8 +382,8 @@ public:
 private:
     int m_value1{300};
 };
-CV_EXPORTS CV_WRAP_AS(ns11wrapAsFunc1) int bindTest_WrapAsFunc(int a) { return a + 10; }
-CV_EXPORTS CV_WRAP_AS(ns11wrapAsFunc2) int bindTest_WrapAsFunc(std::string s) { return static_cast<int>(s.length()); }
+CV_EXPORTS CV_WRAP_AS(ns11wrapAsFunc1) inline int bindTest_WrapAsFunc(int a) { return a + 10; }
+CV_EXPORTS CV_WRAP_AS(ns11wrapAsFunc2) inline int bindTest_WrapAsFunc(std::string s) { return static_cast<int>(s.length()); }
 
 } // namespace Ns11
 } // namespace Ns1
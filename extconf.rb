@@ -20,4 +20,18 @@ end
 $LDFLAGS += " -L./dummycv -Wl,-rpath,'$$ORIGIN/dummycv'"
 opencv4_libs = `pkg-config --libs-only-l opencv4`.chomp
 $libs = opencv4_libs + " -ldummycv"
+
+# `ruby extconf.rb --disable-trace` compiles out the tracing of the conversions (RBOPENCV_TRACE=1),
+# and `--enable-stats` enables the statistics of the wrappers (CV2.stats).
+$defs << '-DRBOPENCV_DISABLE_TRACE' unless enable_config('trace', true)
+$defs << '-DRBOPENCV_ENABLE_STATS' if enable_config('stats', false)
+
+# gen2rb.py splits the bindings into autogen/rbopencv_shard_*.cpp (listed in rbopencv_sources.txt)
+# so that `make -j` compiles them in parallel. The list is empty if gen2rb.py ran with --unity.
+$srcs = ['cv2.cpp']
+sources_txt = File.join(__dir__, 'autogen', 'rbopencv_sources.txt')
+if File.exist?(sources_txt)
+  $srcs += File.readlines(sources_txt, chomp: true).reject(&:empty?)
+end
+$VPATH << '$(srcdir)/autogen'
 create_makefile('cv2')
@@ -1,16 +1,28 @@
 #!/usr/bin/env python
 
+import concurrent.futures
+import glob
 import os
+import string
 import sys
+import time
 import typing
 
+import gen_depgraph
+import gen_profiler
+import hdr_parser_cache
+import hdr_parser_prescan
+import hdr_parser_snapshot
 import hdr_parser_wrapper
+from autogen_writer import open_if_changed, write_if_changed
+import autogen_writer
 from hdr_parser_wrapper import (CvApi, CvArg, CvEnum, CvEnumerator, CvProp, CvFunc,
                                 CvKlass, CvNamespace, CvVariant)
 
 g_out_dir = "./autogen"
+api:CvApi|None = None # API being generated (set by generate())
 
-g_supported_rettypes = [
+g_supported_rettypes = {
     "", # constructor
     "void",
     "bool",
@@ -37,8 +49,8 @@ g_supported_rettypes = [
     "std.vector<cv.Mat>",
     "std.vector<cv.Point2f>",
     "std.vector<cv.Size>",
-]
-g_supported_argtypes = [
+}
+g_supported_argtypes = {
     "bool",
     "char",
     "uchar",
@@ -82,14 +94,15 @@ g_supported_argtypes = [
     "std.vector<std.vector<cv.Point>>",
     "std.vector<std.vector<cv.Point2f>>",
     #"std.vector<std.vector<>>",
-]
+}
 
-g_unsupported_argtypes = [
+g_unsupported_argtypes = {
     "cv.flann.SearchParams",
-]
+}
 
-g_supported_enum_types = []
-g_supported_class_types = []
+# Filled by analyze_support()
+g_supported_enum_types:set[str] = set()
+g_supported_class_types:set[str] = set()
 
 def check_rettype_supported(rettype_qname:str):
     if rettype_qname in g_supported_rettypes:
@@ -113,30 +126,90 @@ def check_argtype_supported(argtype_qname:str):
         return True
     return False
 
+def check_variant_support_status(v:CvVariant) -> tuple[bool,str]:
+    supported = True
+    msg = ""
+    if not check_rettype_supported(v.rettype_qname):
+        supported = False
+        msg = f"rettype ({v.rettype_qname}) is not supported"
+    for i, arg in enumerate(v.args):
+        if check_argtype_supported(arg.tp_qname):
+            pass # supported
+        else:
+            supported = False
+            msg = f"arg[{i}] ({arg.tp_qname}) is not supported"
+            break
+    return (supported, msg)
+
+# Returns (supported, reason) of each variant.
+# The status is computed only once (by analyze_support() or the first call) and kept in the CvVariant.
 def check_func_variants_support_status(func:CvFunc) -> list[tuple[bool,str]]:
-    global g_supported_rettypes, g_supported_argtypes
-    ret = []
     for v in func.variants:
-        supported = True
-        msg = ""
-        if not check_rettype_supported(v.rettype_qname):
-            supported = False
-            msg = f"rettype ({v.rettype_qname}) is not supported"
-        for i, arg in enumerate(v.args):
-            if check_argtype_supported(arg.tp_qname):
-                pass # supported
-            else:
-                supported = False
-                msg = f"arg[{i}] ({arg.tp_qname}) is not supported"
-                break
-        stat = (supported, msg)
-        ret.append(stat)
-    return ret
+        if v.supported is None:
+            v.supported, v.unsupported_reason = check_variant_support_status(v)
+    return [(v.supported, v.unsupported_reason) for v in func.variants]
+
+# Tags of the Ruby objects (RBOPENCV_TAG_* in rbopencv.hpp) which rbopencv_to() of each argument
+# type can accept. They are used by the overload pre-filter of the wrappers (see get_arg_tags()).
+_g_arg_tags = {
+    "bool": "RBOPENCV_TAG_ANY",
+    "char": "RBOPENCV_TAG_FIXNUM",
+    "uchar": "RBOPENCV_TAG_FIXNUM",
+    "int": "RBOPENCV_TAG_FIXNUM",
+    "size_t": "RBOPENCV_TAG_FIXNUM",
+    "float": "RBOPENCV_TAG_FIXNUM|RBOPENCV_TAG_BIGNUM|RBOPENCV_TAG_FLOAT",
+    "double": "RBOPENCV_TAG_FIXNUM|RBOPENCV_TAG_BIGNUM|RBOPENCV_TAG_FLOAT",
+    "c_string": "RBOPENCV_TAG_STRING",
+    "std.string": "RBOPENCV_TAG_STRING",
+    "cv.String": "RBOPENCV_TAG_STRING",
+    "cv.Mat": "RBOPENCV_TAG_NIL|RBOPENCV_TAG_DATA",
+    "cv.Point": "RBOPENCV_TAG_ARRAY",
+    "cv.Point2d": "RBOPENCV_TAG_ARRAY",
+    "cv.Point2f": "RBOPENCV_TAG_ARRAY",
+    "cv.Rect": "RBOPENCV_TAG_ARRAY",
+    "cv.RotatedRect": "RBOPENCV_TAG_ARRAY",
+    "cv.Scalar": "RBOPENCV_TAG_ARRAY",
+    "cv.Size": "RBOPENCV_TAG_ARRAY",
+    "cv.Size2f": "RBOPENCV_TAG_ARRAY",
+    "cv.Size2i": "RBOPENCV_TAG_ARRAY",
+}
+
+# Returns the tags of the Ruby objects which can be converted to an input arg of argtype_qname.
+# Types whose conversion is not known (e.g. pointers) accept any object.
+def get_arg_tags(argtype_qname:str) -> str:
+    if argtype_qname in _g_arg_tags:
+        return _g_arg_tags[argtype_qname]
+    if argtype_qname.startswith("std.vector<"):
+        return "RBOPENCV_TAG_ARRAY"
+    if argtype_qname in g_supported_enum_types:
+        return "RBOPENCV_TAG_FIXNUM"
+    if argtype_qname in g_supported_class_types:
+        return "RBOPENCV_TAG_DATA"
+    return "RBOPENCV_TAG_ANY"
+
+g_instance_used_as_retval_types:set[str] = set()
+g_symbols:hdr_parser_wrapper.SymbolTable|None = None
 
-g_instance_used_as_retval_types = []
+# Support analysis stage: indexes the enums and classes of api, and computes the support status
+# of all variants before the code generation.
+def analyze_support(api:CvApi):
+    global g_instance_used_as_retval_types, g_symbols
+    g_symbols = hdr_parser_wrapper.get_symbol_table(api)
+    g_supported_enum_types.clear()
+    g_supported_class_types.clear()
+    for _, cvenum in api.cvenums.items():
+        g_supported_enum_types.add(cvenum.name)
+    for _, cvklass in api.cvklasses.items():
+        g_supported_class_types.add(cvklass.name)
+    g_instance_used_as_retval_types = set()
+    for _, cvfunc in api.cvfuncs.items():
+        for var in cvfunc.variants:
+            if var.rettype_qname in api.cvklasses:
+                g_instance_used_as_retval_types.add(var.rettype_qname)
+            var.supported, var.unsupported_reason = check_variant_support_status(var)
 
 def check_is_constructor(cvfunc:CvFunc) -> bool:
-    is_constructor = cvfunc.klass and cvfunc.klass.name.split(".")[-1] == cvfunc.name.split(".")[-1]
+    is_constructor = cvfunc.klass and g_symbols.lookup(cvfunc.klass).basename == g_symbols.lookup(cvfunc).basename
     return is_constructor
 
 def gen_wrapper_func_name(func:CvFunc):
@@ -148,28 +221,18 @@ def gen_wrapper_func_name(func:CvFunc):
         wrapper_func_name += "_static"
     return wrapper_func_name
 
-def get_namespace_of_func(func:CvFunc):
-    ret = None
-    if func.ns:
-        ret = func.ns
-    elif func.klass:
-        if func.klass.ns:
-            ret = func.klass.ns
-        elif func.klass.klass:
-            if func.klass.klass.ns:
-                ret = func.klass.klass.ns
+def get_namespace_of_func(func:CvFunc) -> CvNamespace:
+    ret = g_symbols.lookup(func).namespace
     if ret is None:
         print(f"[Error] Could not find namespace of {func.name}")
         exit(1)
     return ret
 
+def get_namespace_of_klass(klass:CvKlass) -> CvNamespace:
+    return g_symbols.lookup(klass).namespace
+
 def get_root_class(klass:CvKlass) -> CvKlass:
-    root_klass = klass
-    while True:
-        if not root_klass.parent_klass:
-            break
-        root_klass = root_klass.parent_klass
-    return root_klass
+    return g_symbols.lookup(klass).root_klass
 
 _g_abstract_classes = [
     "cv.Ns1.Ns11.SubSubI2",
@@ -260,565 +323,1070 @@ _g_abstract_classes = [
 def check_is_abstract_class(cvklass:CvKlass):
     return cvklass.name in _g_abstract_classes
 
-def generate_accessor_wrapper_impl(f:typing.TextIO, klass:CvKlass, prop:CvProp, log_f):
-    us_klass_name = klass.name.replace(".", "_")     # underscored class name: cv_Ns1_Ns11_Foo
-    c_klass = f'c{us_klass_name}'                    # ccv_Ns1_Ns11_Foo (for VALUE name)
-    getter_wrapper_func_name = f"wrap_{us_klass_name}_{prop.name}_getter"
-    setter_wrapper_func_name = f"wrap_{us_klass_name}_{prop.name}_setter"
-    tp_cpp_qname = prop.tp_qname.replace(".", "::")
-    f.write(f'static VALUE {getter_wrapper_func_name}(VALUE self){{\n')
-    #f.write(f'    printf("[%s]\\n", __func__);\n')
-    f.write(f'    const {tp_cpp_qname}& raw_retval = get_{us_klass_name}(self)->{prop.name};\n')
-    f.write(f'    VALUE value_retval = rbopencv_from(raw_retval);\n')
-    f.write(f'    return value_retval;\n')
-    f.write(f'}}\n')
-    f.write(f'\n')
-    f.write(f'static VALUE {setter_wrapper_func_name}(VALUE self, VALUE value_{prop.name}){{\n')
-    #f.write(f'    printf("[%s]\\n", __func__);\n')
-    f.write(f'    {tp_cpp_qname} raw_{prop.name};\n')
-    f.write(f'    bool conv_arg_ok = rbopencv_to(value_{prop.name}, raw_{prop.name});\n')
-    f.write(f'    if (!conv_arg_ok) {{\n')
-    f.write(f"        std::string err_msg{{\" can't parse '{prop.name}'\"}};\n")
-    f.write(f'        rbPopulateArgumentConversionErrors(err_msg);\n')
-    f.write(f'        rbRaiseCVOverloadException("{klass.name}.{prop.name}");\n')
-    f.write(f'        return Qnil;\n')
-    f.write(f'    }}\n')
-    f.write(f'    get_{us_klass_name}(self)->{prop.name} = raw_{prop.name};\n')
-    f.write(f'    return Qnil;\n')
-    f.write(f'}}\n')
-    f.write(f'\n')
-
-def generate_wrapper_function_impl(f:typing.TextIO, cvfunc:CvFunc, log_f):
-    support_stats = check_func_variants_support_status(cvfunc)
-    num_supported_variants = 0
-    supported_vars:list[CvVariant] = []
-    for i in range(len(cvfunc.variants)):
-        stat = support_stats[i]
-        if stat[0]:
-            num_supported_variants += 1
-            supported_vars.append(cvfunc.variants[i])
-    if num_supported_variants == 0:
-        return
+# Functions whose C++ call is made without the GVL (see rbopencv_call_without_gvl() in rbopencv.hpp),
+# so that other Ruby threads run while they process images or wait for I/O. Releasing and acquiring
+# the GVL costs more than trivial functions (e.g. getters), so only heavy ones are listed.
+_g_release_gvl_funcs = {
+    "cv.imread", "cv.imwrite", "cv.imdecode", "cv.imencode",
+    "cv.resize", "cv.warpAffine", "cv.warpPerspective", "cv.remap", "cv.undistort", "cv.pyrDown", "cv.pyrUp",
+    "cv.cvtColor", "cv.equalizeHist", "cv.calcHist", "cv.threshold", "cv.adaptiveThreshold",
+    "cv.GaussianBlur", "cv.blur", "cv.boxFilter", "cv.medianBlur", "cv.bilateralFilter", "cv.filter2D",
+    "cv.sepFilter2D", "cv.Sobel", "cv.Scharr", "cv.Laplacian", "cv.Canny",
+    "cv.erode", "cv.dilate", "cv.morphologyEx", "cv.distanceTransform", "cv.watershed", "cv.grabCut",
+    "cv.inpaint", "cv.fastNlMeansDenoising", "cv.fastNlMeansDenoisingColored",
+    "cv.findContours", "cv.connectedComponents", "cv.connectedComponentsWithStats",
+    "cv.HoughLines", "cv.HoughLinesP", "cv.HoughCircles", "cv.matchTemplate",
+    "cv.goodFeaturesToTrack", "cv.cornerHarris", "cv.dft", "cv.idft",
+    "cv.calcOpticalFlowPyrLK", "cv.calcOpticalFlowFarneback",
+    "cv.findHomography", "cv.solvePnP", "cv.calibrateCamera", "cv.stereoRectify",
+    "cv.CascadeClassifier.detectMultiScale", "cv.HOGDescriptor.detectMultiScale",
+    "cv.Feature2D.detect", "cv.Feature2D.compute", "cv.Feature2D.detectAndCompute",
+    "cv.DescriptorMatcher.match", "cv.DescriptorMatcher.knnMatch", "cv.aruco.ArucoDetector.detectMarkers",
+    "cv.VideoCapture.grab", "cv.VideoCapture.retrieve", "cv.VideoCapture.read", "cv.VideoWriter.write",
+    "cv.dnn.readNet", "cv.dnn.blobFromImage", "cv.dnn.Net.forward",
+    "cv.bindTest_ReleaseGVL_Mat",  # dummycv
+}
+
+def check_releases_gvl(cvfunc:CvFunc) -> bool:
+    return cvfunc.name in _g_release_gvl_funcs and not check_is_constructor(cvfunc)
+
+# Compiles a template of the generated code into a function, which takes the fields as keyword
+# arguments and returns the rendered string. The template is in the syntax of str.format() ("{name}",
+# "{name:spec}", and "{{" and "}}" for the braces of C++ code). It is parsed only once, so rendering
+# only formats the fields.
+def _template(text:str) -> typing.Callable[..., str]:
+    converters = {None: None, "s": str, "r": repr, "a": ascii}
+    parts = [(literal, name, converters[conv], spec)
+             for literal, name, spec, conv in string.Formatter().parse(text)]
+    def render(**fields) -> str:
+        out:list[str] = []
+        for literal, name, conv, spec in parts:
+            out.append(literal)
+            if name is not None:
+                value = fields[name]
+                out.append(format(conv(value) if conv else value, spec))
+        return "".join(out)
+    return render
+
+# Templates of the generated code (the ones without fields are plain strings). Each emitter renders
+# them into a list of strings, and the strings are joined and written at once (see write_if_changed()
+# and pack_shards()).
+
+_T_WRAPPER_DECL = _template("VALUE {wrapper}(int argc, VALUE *argv, VALUE self);\n")
+_T_ACCESSOR_DECL = _template("""\
+VALUE wrap_{us_klass}_{prop}_getter(VALUE self);
+VALUE wrap_{us_klass}_{prop}_setter(VALUE self, VALUE value);
+""")
+_T_SHARED_HPP = _template("""\
+#ifndef RBOPENCV_SHARED_HPP
+#define RBOPENCV_SHARED_HPP
+#include "../rbopencv.hpp"
+#include "rbopencv_include.hpp"
+
+{decls}
+#endif // RBOPENCV_SHARED_HPP
+""")
+
+_T_ACCESSOR = _template("""\
+VALUE wrap_{us_klass}_{prop}_getter(VALUE self){{
+    const {tp}& raw_retval = get_{us_klass}(self)->{prop};
+    VALUE value_retval = rbopencv_from(raw_retval);
+    return value_retval;
+}}
+
+VALUE wrap_{us_klass}_{prop}_setter(VALUE self, VALUE value_{prop}){{
+    {tp} raw_{prop};
+    bool conv_arg_ok = rbopencv_to(value_{prop}, raw_{prop});
+    if (!conv_arg_ok) {{
+        std::string err_msg{{" can't parse '{prop}'"}};
+        rbPopulateArgumentConversionErrors(err_msg);
+        rbRaiseCVOverloadException("{klass}.{prop}");
+        return Qnil;
+    }}
+    get_{us_klass}(self)->{prop} = raw_{prop};
+    return Qnil;
+}}
+
+""")
+
+_T_WRAPPER_HEAD = _template("""\
+VALUE {wrapper}(int argc, VALUE *argv, VALUE {self})
+{{
+    using namespace {ns};
+    RBOPENCV_STATS_SCOPE("{name}");
+
+    VALUE h = rb_check_hash_type(argv[argc-1]);
+    if (!NIL_P(h)) {{
+        --argc;
+    }}
+    int arity = rb_check_arity(argc, 0, UNLIMITED_ARGUMENTS);
+
+    std::string err_msg;
+    rbClearArgumentConversionErrors();
+""")
+_T_WRAPPER_TAIL = _template("""\
+    rbRaiseCVOverloadException("{name}");
+    return Qnil;
+}}
+
+""")
+_T_VARIANT_HEAD = _template("    if (arity >= {num_mandatory}{conds}) {{\n")
+_T_VARIANT_COND_KWARGS = _template(" && !(kwargs_given & {mask:#x}ULL)")
+_T_SIGNATURES_HEAD = _template("""\
+    // Variants which can accept the types of the positional args (see rbopencv_match_signatures())
+    static const unsigned short signatures[{num}][{num_columns}] = {{
+""")
+_T_SIGNATURE = _template("        {{{num_args}{tags}}},\n")
+_T_SIGNATURES_TAIL = """\
+    };
+    const unsigned long long candidates = rbopencv_match_signatures(argc, argv, signatures);
+
+"""
+# The variants are dispatched on the candidates: case k is variant k, and the loop goes to the next
+# candidate if the conversions of the args fail.
+_T_DISPATCH_HEAD = """\
+    for (unsigned long long rest = candidates; rest; rest &= rest - 1) {
+    switch (rbopencv_lowest_bit(rest)) {
+"""
+_T_DISPATCH_CASE = _template("    case {k}:\n")
+_T_DISPATCH_CASE_TAIL = "    break;\n"
+_T_DISPATCH_TAIL = """\
+    }
+    }
+    rbopencv_populate_signature_errors(argc, argv, signatures, candidates);
+"""
+_T_RAW_VAR = _template("        {tp} {raw};{comment}\n")
+# The output Mats are allocated as NArrays by NumpyAllocator, so rbopencv_from() returns them without copying
+_T_INIT_OUTPUT_MAT = _template("        rbopencv_to(Qnil, {raw});\n")
+_T_RAW_VAR_DEFVAL = _template("        {tp} {raw} = {defval};\n")
+_T_VALUE_VAR = _template("        VALUE {value};\n")
+_T_SCAN_ARGS = _template("""
+        int scan_ret = rb_scan_args(argc, argv, "{fmt}"{ptrs});
+        bool conv_args_ok = true;
+""")
+_T_CONV_MANDATORY = _template("""\
+        conv_args_ok &= {to}({value}, {raw});
+        if (!conv_args_ok) {{
+            err_msg = " can't parse '{name}'";
+        }}
+""")
+_T_CONV_OPTIONAL = _template("""\
+        if (scan_ret >= {num}) {{
+            conv_args_ok &= {to}({value}, {raw});
+            if (!conv_args_ok) {{
+                err_msg = " can't parse '{name}'";
+            }}
+        }}
+""")
+_T_WRAPPER_KWARGS = _template("""\
+    // Keyword args of all variants, taken from h at once (see rbopencv_get_kwargs())
+    static const unsigned short kwarg_indexes[{num}] = {{{indexes}}};
+    VALUE kwargs[{num}];
+    {assign}rbopencv_get_kwargs(h, kwarg_indexes, {num}, kwargs);
+
+""")
+_T_KWARGS_HEAD = "        if (!NIL_P(h)) {\n"
+_T_CONV_KWARG = _template("""\
+            if (kwargs[{j}] == Qundef) {{
+                // Do nothing. Already set by arg w/o keyword, or use {raw} default value
+            }} else {{
+                conv_args_ok &= {to}(kwargs[{j}], {raw});
+                if (!conv_args_ok) {{
+                    err_msg = "Can't parse '{name}'";
+                }}
+            }}
+""")
+# The output Mat refers to the given NArray, so it is written in place if its shape and type fit.
+# Otherwise the C++ API allocates another one (also if the NArray cannot be referred to by a Mat,
+# e.g. Int64). Objects other than NArray are rejected by _T_CHECK_DST_KWARG before any conversion.
+_T_CONV_DST_KWARG = _template("""\
+            if (kwargs[{j}] != Qundef && !rbopencv_to(kwargs[{j}], {raw})) {{
+                rbopencv_to(Qnil, {raw});
+            }}
+""")
+_T_CHECK_DST_KWARG = _template("    rbopencv_check_dst_kwarg(kwargs[{j}], \"{name}\");\n")
+_T_KWARGS_TAIL = "        }\n"
+_T_KWARG_ENUM_HEAD = "// Indexes of the keywords in rbopencv_kwarg_ids (see rbopencv_kwargs.hpp)\nenum {\n"
+_T_KWARG_ENUM = _template("    RBOPENCV_KW_{name},\n")
+_T_KWARG_ENUM_TAIL = "    RBOPENCV_NUM_KWARGS\n};\n\n"
+_T_KWARGS_HPP = _template("""\
+// IDs of the keywords of the wrappers, interned once by Init_cv2()
+ID rbopencv_kwarg_ids[{num}];
+
+static void init_kwarg_ids(){{
+{interns}}}
+""")
+_T_KWARG_INTERN = _template("    rbopencv_kwarg_ids[RBOPENCV_KW_{name}] = rb_intern(\"{name}\");\n")
+_T_CALL_CTOR = _template("""\
+        if (conv_args_ok) {{
+            struct {root_wrap_struct} *ptr;
+            TypedData_Get_Struct(self, struct {root_wrap_struct}, &{klass_us}_type, ptr);
+            ptr->v = new {ctor}({args});
+""")
+_T_CALL_RET_INSTANCE = _template("""\
+        if (conv_args_ok) {{
+            cv::Ptr<{rettype}> p = new {rettype}{{{callee}({args})}};
+            VALUE value_retval = rbopencv_from(p);
+""")
+_T_CALL_VOID = _template("""\
+        if (conv_args_ok) {{
+            {callee}({args});
+""")
+_T_CALL = _template("""\
+        if (conv_args_ok) {{
+            {rettype} raw_retval;
+            raw_retval = {callee}({args});
+""")
+# The calls without the GVL. Ruby API must not be used in the lambda, so the instance of a method
+# is taken before it (self_def).
+_T_SELF_DEF = _template("            Ptr<{qname}> self_ptr = get_{us_klass}(klass);\n")
+_T_CALL_RET_INSTANCE_WITHOUT_GVL = _template("""\
+        if (conv_args_ok) {{
+{self_def}\
+            cv::Ptr<{rettype}> p;
+            rbopencv_call_without_gvl([&]() {{ p = cv::Ptr<{rettype}>(new {rettype}{{{callee}({args})}}); }});
+            VALUE value_retval = rbopencv_from(p);
+""")
+_T_CALL_VOID_WITHOUT_GVL = _template("""\
+        if (conv_args_ok) {{
+{self_def}\
+            rbopencv_call_without_gvl([&]() {{ {callee}({args}); }});
+""")
+_T_CALL_WITHOUT_GVL = _template("""\
+        if (conv_args_ok) {{
+{self_def}\
+            {rettype} raw_retval;
+            rbopencv_call_without_gvl([&]() {{ raw_retval = {callee}({args}); }});
+""")
+# The exceptions of the C++ API called without the GVL are raised as RuntimeError after the locals
+# of the variant are destroyed
+_T_TRY_HEAD = """\
+    VALUE exception = Qnil;
+    try {
+"""
+_T_TRY_TAIL = """\
+    } catch (const std::exception& e) {
+        exception = rb_exc_new_cstr(rb_eRuntimeError, e.what());
+    }
+    if (!NIL_P(exception))
+        rb_exc_raise(exception);
+"""
+_T_RETURN_NIL = "            return Qnil;\n"
+_T_RETURN_VALUE = "            return value_retval;\n"
+_T_RETURN_RAW = _template("""\
+            VALUE value_retval = rbopencv_from({raw});
+            return value_retval;
+""")
+_T_RETURN_ARRAY = _template("""\
+            VALUE value_retval_array = rb_ary_new3({num}{froms});
+            return value_retval_array;
+""")
+_T_VARIANT_TAIL = """\
+        } else {
+            RBOPENCV_STATS_MISS();
+            rbPopulateArgumentConversionErrors(err_msg);
+        }
+    }
+"""
+
+_T_CLASS_REGISTRATION_HEAD = _template("""\
+{{
+    VALUE parent_mod = get_parent_module_by_wname(mCV2, "{parent_mod}");
+    {c_klass} = rb_define_class_under(parent_mod, "{basename}", {parent_class_object});
+    rb_define_alloc_func({c_klass}, wrap_{us_klass}_alloc);
+""")
+_T_CLASS_REGISTRATION_INIT = _template("    rb_define_private_method({c_klass}, \"initialize\", RUBY_METHOD_FUNC(wrap_{us_klass}_init), -1);\n")
+_T_CLASS_REGISTRATION_PROP = _template("""\
+    rb_define_method({c_klass}, "{prop}", RUBY_METHOD_FUNC(wrap_{us_klass}_{prop}_getter), 0);
+    rb_define_method({c_klass}, "{prop}=", RUBY_METHOD_FUNC(wrap_{us_klass}_{prop}_setter), 1);
+""")
+_T_CLASS_REGISTRATION_SINGLETON_METHOD = _template("    rb_define_singleton_method({c_klass}, \"{name}\", RUBY_METHOD_FUNC({wrapper}), -1);\n")
+_T_CLASS_REGISTRATION_METHOD = _template("    rb_define_method({c_klass}, \"{name}\", RUBY_METHOD_FUNC({wrapper}), -1);\n")
+_T_CLASS_REGISTRATION_TAIL = "}\n"
+
+_T_CLASS_DECL = _template("extern VALUE {c_klass};\n")
+_T_ROOT_CLASS_DECL = _template("""\
+struct Wrap_{us_klass} {{
+    Ptr<{qname}> v;
+}};
+void wrap_{us_klass}_free(struct Wrap_{us_klass}* ptr);
+""")
+_T_CLASS_TYPE_DECL = _template("""\
+extern const rb_data_type_t {us_klass}_type;
+Ptr<{qname}> get_{us_klass}(VALUE self);
+VALUE wrap_{us_klass}_alloc(VALUE klass);
+template<> VALUE rbopencv_from(const Ptr<{qname}>& value);
+""")
+_T_CLASS_TO_DECL = _template("template<> bool rbopencv_to(VALUE o, {qname}& value);\n")
+_T_CLASS_DEF = _template("VALUE {c_klass};\n")
+_T_ROOT_CLASS_DEF = _template("""\
+void wrap_{us_klass}_free(struct Wrap_{us_klass}* ptr){{
+    ptr->v.reset();
+    ruby_xfree(ptr);
+}};
+""")
+_T_CLASS_TYPE_DEF = _template("""\
+const rb_data_type_t {us_klass}_type {{
+    "{c_klass}",
+    {{NULL, reinterpret_cast<RUBY_DATA_FUNC>(wrap_{root_us_klass}_free), NULL}},
+    {parent_data_type_ptr}, NULL,
+    RUBY_TYPED_FREE_IMMEDIATELY
+}};
+Ptr<{qname}> get_{us_klass}(VALUE self){{
+    struct Wrap_{root_us_klass}* ptr;
+    TypedData_Get_Struct(self, struct Wrap_{root_us_klass}, &{us_klass}_type, ptr);
+    return {cast_type}<{qname}>(ptr->v);
+}}
+VALUE wrap_{us_klass}_alloc(VALUE klass){{
+    struct Wrap_{root_us_klass}* ptr = nullptr;
+    VALUE ret = TypedData_Make_Struct(klass, struct Wrap_{root_us_klass}, &{us_klass}_type, ptr);
+    return ret;
+}}
+template<>
+VALUE rbopencv_from(const Ptr<{qname}>& value){{
+    TRACE_PRINTF("[rbopencv_from Ptr<{qname}>]\\n");
+    struct Wrap_{root_us_klass} *ptr;
+    VALUE a = wrap_{us_klass}_alloc({c_klass});
+    TypedData_Get_Struct(a, struct Wrap_{root_us_klass}, &{us_klass}_type, ptr);
+    ptr->v = value;
+    return a;
+}}
+""")
+_T_CLASS_TO_DEF = _template("""\
+template<>
+bool rbopencv_to(VALUE o, {qname}& value){{
+    TRACE_PRINTF("[rbopencv_to {qname}]\\n");
+    Ptr<{qname}> p = get_{us_klass}(o);
+    value = *p;
+    return true;
+}}
+""")
+
+_T_ENUM_DECL = _template("""\
+template<> bool rbopencv_to(VALUE obj, {qname}& value);
+template<> VALUE rbopencv_from(const {qname}& value);
+""")
+_T_ENUM_DEF = _template("""\
+template<>
+bool rbopencv_to(VALUE obj, {qname}& value){{
+    TRACE_PRINTF("[rbopencv_to {qname}]\\n");
+    if (!FIXNUM_P(obj))
+        return false;
+    int tmp = FIX2INT(obj);
+    value = static_cast<{qname}>(tmp);
+    return true;
+}}
+template<>
+VALUE rbopencv_from(const {qname}& value){{
+    TRACE_PRINTF("[rbopencv_from {qname}] %d", value);
+    return INT2NUM(static_cast<int>(value));
+}}
+""")
+
+_T_SUBMODULE_REGISTRATION = _template("init_submodule(\"{ns}\", methods_{ns_us}, consts_{ns_us});\n")
+_T_METHODS_HEAD = _template("static MethodDef methods_{ns_us}[] = {{\n")
+_T_METHOD_DEF = _template("    {{\"{name}\", {wrapper}}},\n")
+_T_METHODS_TAIL = "    {NULL, NULL}\n};\n"
+_T_CONSTS_HEAD = _template("static ConstDef consts_{ns_us}[] = {{\n")
+_T_CONST_DEF = _template("    {{\"{name}\", static_cast<long>({value})}},\n")
+_T_CONSTS_TAIL = "    {NULL, 0}\n};\n\n"
+
+_T_SUPPORT_STATUS = _template("{status},{name},{i},{rettype},\"{argtypes}\",\"{reason}\"\n")
+
+def generate_accessor_wrapper_impl(klass:CvKlass, prop:CvProp) -> str:
+    return _T_ACCESSOR(us_klass=klass.name.replace(".", "_"), klass=klass.name, prop=prop.name,
+                              tp=prop.tp_qname.replace(".", "::"))
+
+# Returns the args of v in the order of Ruby arguments: mandatory args, output args w/o default
+# value, and optional args
+def get_ordered_args(v:CvVariant) -> list[CvArg]:
+    mandatory_args:list[CvArg] = []
+    out_pyin_args:list[CvArg] = []
+    optional_args:list[CvArg] = []
+    for a in v.args:
+        if a.inputarg == False and a.outputarg == True and a.defval == "":
+            out_pyin_args.append(a)
+        elif a.defval:
+            optional_args.append(a)
+        else:
+            mandatory_args.append(a)
+    return mandatory_args + out_pyin_args + optional_args
+
+# Returns the output Mats of v which can be given by the caller as keyword args (see get_kwarg_names())
+def get_dst_args(v:CvVariant) -> list[CvArg]:
+    return [a for a in v.args
+            if a.inputarg == False and a.outputarg == True and a.defval == "" and a.tp_qname == "cv.Mat"]
+
+# Returns the names of the keyword args of v: the optional input args, and the output Mats, which
+# are written to the given NArrays if they fit (e.g. cvtColor(src, code, dst: buf))
+def get_kwarg_names(v:CvVariant) -> list[str]:
+    names = [a.name for a in get_ordered_args(v) if a.inputarg and a.defval]
+    return names + [a.name for a in get_dst_args(v) if a.name not in names]
+
+# Returns the function which converts a Ruby object to input arg a of variant v of func. Input-only
+# Mats are borrowed from NArray without keeping it, unless the Mat may outlive the call: methods of
+# classes, and functions which return an instance, may keep it.
+def get_converter(func:CvFunc, v:CvVariant, a:CvArg) -> str:
+    if (a.tp_qname == "cv.Mat" and a.inputarg and not a.outputarg and not func.klass and
+        not v.rettype_qname.startswith("Ptr<") and v.rettype_qname not in api.cvklasses):
+        return "rbopencv_to_borrowed"
+    return "rbopencv_to"
+
+# Returns the supported variants of func in the order in which the wrapper tries them
+def get_sorted_supported_variants(func:CvFunc) -> list[CvVariant]:
+    supported_vars = [v for v, stat in zip(func.variants, check_func_variants_support_status(func)) if stat[0]]
+    return sorted(supported_vars, reverse=True, key=lambda var: len(var.args))
+
+def generate_wrapper_function_impl(cvfunc:CvFunc) -> str:
+    supported_vars:list[CvVariant] = get_sorted_supported_variants(cvfunc)
+    if not supported_vars:
+        return ""
     func_cpp_basename = cvfunc.name_cpp.split(".")[-1]
-    supported_vars = sorted(supported_vars, reverse=True, key=lambda var: len(var.args))
-    wrapper_func_name = gen_wrapper_func_name(cvfunc)
     is_constructor = check_is_constructor(cvfunc)
     is_instance_method = cvfunc.klass and cvfunc.isstatic == False
-    if is_constructor:
-        print(f'static VALUE {wrapper_func_name}(int argc, VALUE *argv, VALUE self)', file=f)
-    else:
-        print(f'static VALUE {wrapper_func_name}(int argc, VALUE *argv, VALUE klass)', file=f)
-    print(f'{{', file=f)
-    ### gen-func-wrapper-start ###
-    ns = get_namespace_of_func(cvfunc)
-    f.write(f"    using namespace {ns.name.replace('.', '::')};\n\n")
-    f.write( "    VALUE h = rb_check_hash_type(argv[argc-1]);\n")
-    f.write( "    if (!NIL_P(h)) {\n        --argc;\n    }\n")
-    f.write( "    int arity = rb_check_arity(argc, 0, UNLIMITED_ARGUMENTS);\n")
-    f.write( "\n")
-    f.write( "    std::string err_msg;\n")
-    for var_idx, v in enumerate(supported_vars):
-        # variables for raw variable definitions (rvd)
-        rvd_raw_types:list[str] = []
-        rvd_raw_var_names:list[str] = []
-        rvd_raw_default_values:list[str] = []
-        # variables for value variable definitions (vvd)
-        vvd_names:list[str] = []
-        vvd_value_var_names:list[str] = []
-        vvd_corr_raw_var_names:list[str] = []
-        # variables for rb_scan_args() (rsa)
-        rsa_num_mandatory_args = 0
-        rsa_num_optional_args = 0
-        # variables for C++ API calling (cac)
-        cac_args:list[str] = []
-        cac_raw_out_var_names:list[str] = []
-        # variables for return values handling (rh)
-        rh_raw_var_names:list[str] = []
+    out:list[str] = []
+    out.append(_T_WRAPPER_HEAD(wrapper=gen_wrapper_func_name(cvfunc), self="self" if is_constructor else "klass",
+                               ns=get_namespace_of_func(cvfunc).name.replace(".", "::"), name=cvfunc.name))
+    # Overload pre-filter: the variants are dispatched on the ones whose tags match the positional
+    # args (see rbopencv_match_signatures()). The conversions are still checked, and the next
+    # candidate is tried if one fails.
+    signatures = [[get_arg_tags(a.tp_qname) for a in get_ordered_args(v) if a.inputarg] for v in supported_vars]
+    use_signatures = (2 <= len(supported_vars) <= 64 and
+                      any(tags != "RBOPENCV_TAG_ANY" for sig in signatures for tags in sig))
+    if use_signatures:
+        num_columns = 1 + max(len(sig) for sig in signatures)
+        out.append(_T_SIGNATURES_HEAD(num=len(signatures), num_columns=num_columns))
+        for sig in signatures:
+            out.append(_T_SIGNATURE(num_args=len(sig), tags="".join(f", {tags}" for tags in sig)))
+        out.append(_T_SIGNATURES_TAIL)
+    variant_tail = _T_VARIANT_TAIL + (_T_DISPATCH_CASE_TAIL if use_signatures else "")
+    # Keyword args: the union of the keywords of all variants is looked up in h once. A variant is
+    # tried only if all given keywords are its own.
+    kwarg_names:list[str] = []
+    for v in supported_vars:
+        kwarg_names += [name for name in get_kwarg_names(v) if name not in kwarg_names]
+    other_kwargs_masks = [sum(1 << j for j, name in enumerate(kwarg_names[:64]) if name not in get_kwarg_names(v))
+                          for v in supported_vars]
+    if kwarg_names:
+        out.append(_T_WRAPPER_KWARGS(num=len(kwarg_names),
+                                     indexes=", ".join(f"RBOPENCV_KW_{name}" for name in kwarg_names),
+                                     assign="const unsigned long long kwargs_given = " if any(other_kwargs_masks) else ""))
+    # The keywords of output Mats, unless another variant takes them as input args
+    input_kwarg_names = {a.name for v in supported_vars for a in get_ordered_args(v) if a.inputarg and a.defval}
+    for j, name in enumerate(kwarg_names):
+        if name not in input_kwarg_names:
+            out.append(_T_CHECK_DST_KWARG(j=j, name=name))
+    if len(kwarg_names) > len(input_kwarg_names & set(kwarg_names)):
+        out.append("\n")
+    releases_gvl = check_releases_gvl(cvfunc)
+    if releases_gvl:
+        out.append(_T_TRY_HEAD)
+    if use_signatures:
+        out.append(_T_DISPATCH_HEAD)
+    for k, v in enumerate(supported_vars):
+        ordered_args = get_ordered_args(v)
 
-        ordered_args:list[CvArg] = []
-        tmp_mandatory_args:list[CvArg] = []
-        tmp_out_pyin_args:list[CvArg] = []
-        tmp_optional_args:list[CvArg] = []
-        for a in v.args:
-            if a.inputarg == False and a.outputarg == True and a.defval == "":
-                tmp_out_pyin_args.append(a)
-            else:
-                if a.defval:
-                    tmp_optional_args.append(a)
-                else:
-                    tmp_mandatory_args.append(a)
-        ordered_args.extend(tmp_mandatory_args)
-        ordered_args.extend(tmp_out_pyin_args)
-        ordered_args.extend(tmp_optional_args)
-
-        # Collect values
-        if v.rettype and not v.rettype == "void":
-            rh_raw_var_names.append("raw_retval")
         # C++ API calling is based on original arguments order
+        cac_args:list[str] = []
         for a in v.args:
             if a.inputarg == False and a.outputarg == True and a.tp[-1] == "*":
                 # "&raw_x" is used when calling C++ API.
                 cac_args.append(f"&raw_{a.name}")
+            elif a.tp == "c_string":
+                cac_args.append(f"raw_{a.name}.c_str()")
             else:
-                if a.tp == "c_string":
-                    cac_args.append(f"raw_{a.name}.c_str()")
-                else:
-                    cac_args.append(f"raw_{a.name}")
-        # Other process is based on ordered arguments
-        for a in ordered_args:
+                cac_args.append(f"raw_{a.name}")
+        args_str = ", ".join(cac_args)
+
+        # Raw variable definitions, and the args taken from Ruby (input args)
+        raw_var_defs:list[str] = []
+        in_args:list[CvArg] = []
+        num_mandatory = 0
+        rh_raw_var_names:list[str] = []
+        if v.rettype and not v.rettype == "void":
+            rh_raw_var_names.append("raw_retval")
+        for i, a in enumerate(ordered_args):
             if a.inputarg == False and a.outputarg == True and a.tp[-1] == "*":
                 # If the arg is pointer and for OUT arg (e.g. int* x),
                 # it's declared as non-pointer (int raw_x).
-                rvd_raw_types.append(a.tp[:-1])
+                raw_tp = a.tp[:-1]
+            elif a.tp == "c_string":
+                raw_tp = "std::string"
             else:
-                if a.tp == "c_string":
-                    rvd_raw_types.append("std::string")
-                else:
-                    rvd_raw_types.append(a.tp_qname.replace(".", "::"))
-            rvd_raw_var_names.append(f"raw_{a.name}")
-            if not a.tp[-1] == "*":
-                # If pointer arg has default value, it's always 0 or nullptr (Is this correct?)
-                #   => No. cv.Cuda.GpuMat.GpuMat takes GpuAllocator*=GpuMat::defaultAllocator() [TBD]
-                # It should not be used as default value to avoid error (For example, Point raw_point = 0;)
-                rvd_raw_default_values.append(a.defval)
+                raw_tp = a.tp_qname.replace(".", "::")
+            # If pointer arg has default value, it's always 0 or nullptr (Is this correct?)
+            #   => No. cv.Cuda.GpuMat.GpuMat takes GpuAllocator*=GpuMat::defaultAllocator() [TBD]
+            # It should not be used as default value to avoid error (For example, Point raw_point = 0;)
+            if a.defval and not a.tp[-1] == "*":
+                raw_var_defs.append(_T_RAW_VAR_DEFVAL(tp=raw_tp, raw=f"raw_{a.name}", defval=a.defval))
             else:
-                rvd_raw_default_values.append("")
+                raw_var_defs.append(_T_RAW_VAR(tp=raw_tp, raw=f"raw_{a.name}", comment=f" // {v.args[i].tp_qname}"))
             if a.inputarg:
-                vvd_names.append(a.name)
-                vvd_value_var_names.append(f"value_{a.name}")
-                vvd_corr_raw_var_names.append(f"raw_{a.name}")
-                if a.defval:
-                    rsa_num_optional_args += 1
-                else:
-                    rsa_num_mandatory_args += 1
-            else:
-                if a.outputarg == True:
-                    vvd_names.append(a.name)
+                in_args.append(a)
+                if not a.defval:
+                    num_mandatory += 1
             if a.outputarg:
-                cac_raw_out_var_names.append(f"raw_{a.name}")
                 rh_raw_var_names.append(f"raw_{a.name}")
+        num_optional = len(in_args) - num_mandatory
 
-        # Generate raw variable definitions (rvd)
-        f.write(f"    if (arity >= {rsa_num_mandatory_args}) {{\n")
-        for i in range(len(rvd_raw_types)):
-            if rvd_raw_default_values[i]:
-                f.write(f"        {rvd_raw_types[i]} {rvd_raw_var_names[i]} = {rvd_raw_default_values[i]};\n")
-            else:
-                f.write(f"        {rvd_raw_types[i]} {rvd_raw_var_names[i]}; // {v.args[i].tp_qname}\n")
-        f.write("\n")
-
-        # Generate value variable definitions (vvd)
-        for i in range(len(vvd_value_var_names)):
-            f.write(f"        VALUE {vvd_value_var_names[i]};\n")
-        f.write("\n")
-
-        # Call rb_scan_args() (rsa)
-        rsa_scan_args_fmt = f"{rsa_num_mandatory_args}{rsa_num_optional_args}"
-        f.write(f"        int scan_ret = rb_scan_args(argc, argv, \"{rsa_scan_args_fmt}\"")
-        for i in range(len(vvd_value_var_names)):
-            f.write(f", &{vvd_value_var_names[i]}")
-        f.write(");\n")
-
-        # Check the result of rb_scan_args()
-        f.write("        bool conv_args_ok = true;\n")
-        for i in range(rsa_num_mandatory_args):
-            f.write(f"        conv_args_ok &= rbopencv_to({vvd_value_var_names[i]}, {vvd_corr_raw_var_names[i]});\n")
-            f.write(f"        if (!conv_args_ok) {{\n")
-            f.write(f"            err_msg = \" can't parse '{vvd_names[i]}'\";\n")
-            f.write(f"        }}\n")
-        rsa_idx_optional_start = rsa_num_mandatory_args
-        rsa_idx_optional_end = rsa_num_mandatory_args + rsa_num_optional_args - 1
-        if rsa_num_optional_args >= 1:
-            for i in range(rsa_idx_optional_start, rsa_idx_optional_end+1):
-                f.write(f"        if (scan_ret >= {i+1}) {{\n")
-                f.write(f"            conv_args_ok &= rbopencv_to({vvd_value_var_names[i]}, {vvd_corr_raw_var_names[i]});\n")
-                f.write(f"            if (!conv_args_ok) {{\n")
-                f.write(f"                err_msg = \" can't parse '{vvd_names[i]}'\";\n")
-                f.write(f"            }}\n")
-                f.write(f"        }}\n")
-        f.write("\n")
-
-        # Call rb_get_kwargs() for keyword arguments
-        if rsa_num_optional_args >= 1:
-            f.write(f"        if (!NIL_P(h)) {{\n")
-            f.write(f"            ID table[{rsa_num_optional_args}];\n")
-            f.write(f"            VALUE values[{rsa_num_optional_args}];\n")
-            for i in range(rsa_idx_optional_start, rsa_idx_optional_end+1):
-                j = i - rsa_idx_optional_start
-                f.write(f"            table[{j}] = rb_intern(\"{vvd_names[i]}\");\n")
-            f.write(f"            rb_get_kwargs(h, table, 0, {rsa_num_optional_args}, values);\n")
-
-            # Check the result of rb_get_kwargs()
-            for i in range(rsa_idx_optional_start, rsa_idx_optional_end+1):
-                j = i - rsa_idx_optional_start
-                f.write(f"            if (values[{j}] == Qundef) {{\n")
-                f.write(f"                // Do nothing. Already set by arg w/o keyword, or use {vvd_corr_raw_var_names[i]} default value\n")
-                f.write(f"            }} else {{\n")
-                f.write(f"                conv_args_ok &= rbopencv_to(values[{j}], {vvd_corr_raw_var_names[i]});\n")
-                f.write(f"                if (!conv_args_ok) {{\n")
-                f.write(f"                    err_msg = \"Can't parse '{vvd_names[i]}'\";\n")
-                f.write(f"                }}\n")
-                f.write(f"            }}\n")
-            f.write(f"        }}\n")
-
-        # Call C++ API if arguments are ready
-        f.write("        if (conv_args_ok) {\n")
-        is_ret_class_instance = False
+        conds = ""
+        if other_kwargs_masks[k]:
+            conds += _T_VARIANT_COND_KWARGS(mask=other_kwargs_masks[k])
+        if use_signatures:
+            out.append(_T_DISPATCH_CASE(k=k))
+        out.append(_T_VARIANT_HEAD(num_mandatory=num_mandatory, conds=conds))
+        out.extend(raw_var_defs)
+        dst_args = get_dst_args(v)
+        for a in dst_args:
+            out.append(_T_INIT_OUTPUT_MAT(raw=f"raw_{a.name}"))
+        out.append("\n")
+        for a in in_args:
+            out.append(_T_VALUE_VAR(value=f"value_{a.name}"))
+        out.append(_T_SCAN_ARGS(fmt=f"{num_mandatory}{num_optional}",
+                                       ptrs="".join(f", &value_{a.name}" for a in in_args)))
+        for i, a in enumerate(in_args[:num_mandatory]):
+            out.append(_T_CONV_MANDATORY(to=get_converter(cvfunc, v, a), value=f"value_{a.name}", raw=f"raw_{a.name}", name=a.name))
+        for i, a in enumerate(in_args[num_mandatory:], num_mandatory):
+            out.append(_T_CONV_OPTIONAL(num=i+1, to=get_converter(cvfunc, v, a), value=f"value_{a.name}", raw=f"raw_{a.name}",
+                                        name=a.name))
+        out.append("\n")
+
+        # Convert the keyword arguments taken by rbopencv_get_kwargs()
+        if num_optional >= 1 or dst_args:
+            out.append(_T_KWARGS_HEAD)
+            for a in in_args[num_mandatory:]:
+                out.append(_T_CONV_KWARG(j=kwarg_names.index(a.name), to=get_converter(cvfunc, v, a), raw=f"raw_{a.name}",
+                                         name=a.name))
+            for a in dst_args:
+                out.append(_T_CONV_DST_KWARG(j=kwarg_names.index(a.name), raw=f"raw_{a.name}"))
+            out.append(_T_KWARGS_TAIL)
+
+        # Call C++ API if arguments are ready, and convert the return value(s)
         if is_constructor:
-            klassname_us = cvfunc.klass.name.replace(".", "_")
-            wrap_struct = f"Wrap_{klassname_us}"
-            data_type_instance = f"{klassname_us}_type"
-            ctor_cname = cvfunc.klass.name.replace(".", '::')
-            root_klass = get_root_class(cvfunc.klass)
-            root_klassname_us = root_klass.name.replace(".", "_")
-            root_wrap_struct = f"Wrap_{root_klassname_us}"
-            f.write(f"            struct {root_wrap_struct} *ptr;\n")
-            f.write(f"            TypedData_Get_Struct(self, struct {root_wrap_struct}, &{data_type_instance}, ptr);\n")
-            args_str = ", ".join(cac_args)
-            f.write(f"            ptr->v = new {ctor_cname}({args_str});\n")
+            out.append(_T_CALL_CTOR(root_wrap_struct="Wrap_" + get_root_class(cvfunc.klass).name.replace(".", "_"),
+                                           klass_us=cvfunc.klass.name.replace(".", "_"),
+                                           ctor=cvfunc.klass.name.replace(".", "::"), args=args_str))
+        elif releases_gvl:
+            self_def = ""
+            if is_instance_method:
+                self_def = _T_SELF_DEF(qname=cvfunc.klass.name.replace(".", "::"), us_klass=cvfunc.klass.name.replace(".", "_"))
+                callee = f"self_ptr->{func_cpp_basename}"
+            else:
+                callee = cvfunc.name_cpp.replace(".", "::")
+            rettype_cpp_qname = v.rettype_qname.replace(".", "::")
+            if v.rettype_qname in api.cvklasses.keys() and not v.rettype_qname == "cv.Mat":
+                out.append(_T_CALL_RET_INSTANCE_WITHOUT_GVL(self_def=self_def, rettype=rettype_cpp_qname, callee=callee,
+                                                            args=args_str))
+                out.append(_T_RETURN_VALUE)
+                out.append(variant_tail)
+                continue
+            if v.rettype == "void":
+                out.append(_T_CALL_VOID_WITHOUT_GVL(self_def=self_def, callee=callee, args=args_str))
+            else:
+                out.append(_T_CALL_WITHOUT_GVL(self_def=self_def, rettype=rettype_cpp_qname, callee=callee, args=args_str))
         else:
-            func_cpp_qname = cvfunc.name_cpp.replace(".", "::")
+            if is_instance_method:
+                callee = f"get_{cvfunc.klass.name.replace('.', '_')}(klass)->{func_cpp_basename}"
+            else:
+                callee = cvfunc.name_cpp.replace(".", "::")
             rettype_cpp_qname = v.rettype_qname.replace(".", "::")
             if v.rettype_qname in api.cvklasses.keys() and not v.rettype_qname == "cv.Mat":
-                is_ret_class_instance = True
-                if is_instance_method:
-                    klassname_us = cvfunc.klass.name.replace(".", "_")
-                    f.write(f"            cv::Ptr<{rettype_cpp_qname}> p = new {rettype_cpp_qname}{{get_{klassname_us}(klass)->{func_cpp_basename}")
-                    pass
-                else:
-                    f.write(f"            cv::Ptr<{rettype_cpp_qname}> p = new {rettype_cpp_qname}{{{func_cpp_qname}")
-                f.write(f"({', '.join(cac_args)})}};\n")
-                f.write(f"            VALUE value_retval = rbopencv_from(p);\n")
+                out.append(_T_CALL_RET_INSTANCE(rettype=rettype_cpp_qname, callee=callee, args=args_str))
+                out.append(_T_RETURN_VALUE)
+                out.append(variant_tail)
+                continue
+            if v.rettype == "void":
+                out.append(_T_CALL_VOID(callee=callee, args=args_str))
             else:
-                if v.rettype == "void":
-                    f.write(f"            ")
-                else:
-                    f.write(f"            {rettype_cpp_qname} raw_retval;\n")
-                    f.write(f"            raw_retval = ")
-                if is_instance_method:
-                    klassname_us = cvfunc.klass.name.replace(".", "_")
-                    f.write(f"get_{klassname_us}(klass)->{func_cpp_basename}")
-                else:              # call global function
-                    f.write(f"{func_cpp_qname}")
-                f.write(f"({', '.join(cac_args)});\n")
-        # Convert the return value(s)
-        num_ruby_retvals = len(rh_raw_var_names)
-        if is_ret_class_instance:
-            f.write(f"            return value_retval;\n")
-        elif num_ruby_retvals == 0:
+                out.append(_T_CALL(rettype=rettype_cpp_qname, callee=callee, args=args_str))
+        if len(rh_raw_var_names) == 0:
             # If no retvals for ruby, return Qnil
-            f.write(f"            return Qnil;\n")
-        elif num_ruby_retvals == 1:
+            out.append(_T_RETURN_NIL)
+        elif len(rh_raw_var_names) == 1:
             # If 1 ruby retval, return it as VALUE
-            retval_raw_var_name = rh_raw_var_names[0]
-            f.write(f"            VALUE value_retval = rbopencv_from({retval_raw_var_name});\n")
-            f.write(f"            return value_retval;\n")
+            out.append(_T_RETURN_RAW(raw=rh_raw_var_names[0]))
         else:
             # If 2 or more ruby retvals, return as array
-            f.write(f"            VALUE value_retval_array = rb_ary_new3({num_ruby_retvals}")
-            for raw_var_name in rh_raw_var_names:
-                f.write(f", rbopencv_from({raw_var_name})")
-            f.write(");\n")
-            f.write(f"            return value_retval_array;\n")
-        f.write("        } else {\n")
-        f.write("            rbPopulateArgumentConversionErrors(err_msg);\n")
-        f.write("        }\n")
-        f.write("    }\n")
-    f.write(f"    rbRaiseCVOverloadException(\"{cvfunc.name}\");\n")
-    f.write("    return Qnil;\n")
-    f.write("}\n\n")
-
-def generate_code(api:CvApi):
-    sorted_namespaces:list[CvNamespace] = []
-    for _, ns in api.cvnamespaces.items():
-        sorted_namespaces.append(ns)
-    sorted(sorted_namespaces, key=lambda ns: ns.name)
-    sorted_klasses:list[CvKlass] = []
-    for _, klass in api.cvklasses.items():
-        sorted_klasses.append(klass)
-    sorted(sorted_klasses, key=lambda klass: klass.name)
+            out.append(_T_RETURN_ARRAY(num=len(rh_raw_var_names),
+                                              froms="".join(f", rbopencv_from({raw})" for raw in rh_raw_var_names)))
+        out.append(variant_tail)
+    if use_signatures:
+        out.append(_T_DISPATCH_TAIL)
+    if releases_gvl:
+        out.append(_T_TRY_TAIL)
+    out.append(_T_WRAPPER_TAIL(name=cvfunc.name))
+    return "".join(out)
+
+# Returns the definitions of klass (Ruby class object, data type and converters) in its shard
+def generate_klass_impl(klass:CvKlass) -> str:
+    us_klass_name = klass.name.replace(".", "_")
+    c_klass = f'c{us_klass_name}'
+    qname = klass.name.replace(".", "::")
+    root_klass = get_root_class(klass)
+    out:list[str] = []
+    out.append(_T_CLASS_DEF(c_klass=c_klass))
+    if not klass.parent_klass:
+        out.append(_T_ROOT_CLASS_DEF(us_klass=us_klass_name))
+    if klass.parent_klass:
+        parent_data_type_ptr = "&" + klass.parent_klass.name.replace(".", "_") + "_type"
+    else:
+        parent_data_type_ptr = "NULL"
+    if root_klass.name in _g_abstract_classes:
+        cast_type = "std::dynamic_pointer_cast"
+    else:
+        cast_type = "std::static_pointer_cast"
+    out.append(_T_CLASS_TYPE_DEF(us_klass=us_klass_name, c_klass=c_klass, qname=qname,
+        root_us_klass=root_klass.name.replace(".", "_"), parent_data_type_ptr=parent_data_type_ptr, cast_type=cast_type))
+    if not check_is_abstract_class(klass) and klass.name in g_instance_used_as_retval_types:
+        out.append(_T_CLASS_TO_DEF(qname=qname, us_klass=us_klass_name))
+    return "".join(out)
+
+# Returns the default constructor of klass, which is generated if klass has no constructor
+def make_default_ctor(klass:CvKlass) -> CvFunc:
+    ctor_name = f"{klass.name}.{g_symbols.lookup(klass).basename}"
+    ctor_var = CvVariant(wrap_as=None, isconst=False, isvirtual=False, ispurevirtual=False, rettype="",
+        rettype_qname="", args=[])
+    return CvFunc(filename="(dummy)", ns=klass.ns, klass=klass, name_cpp=ctor_name, name=ctor_name,
+        isstatic=False, variants=[ctor_var])
+
+# Returns the code of a unit of the shards, which is one of
+#   ("klass", klass name), ("enum", enum name), ("func", func name),
+#   ("accessor", klass name, index of prop), ("ctor", klass name) (default constructor)
+# Units are referred by names so that they can be rendered by the worker processes.
+def render_unit(unit:tuple) -> str:
+    kind, name = unit[0], unit[1]
+    if kind == "klass":
+        return generate_klass_impl(api.cvklasses[name])
+    if kind == "enum":
+        return _T_ENUM_DEF(qname=name.replace(".", "::"))
+    if kind == "func":
+        return generate_wrapper_function_impl(api.cvfuncs[name])
+    if kind == "accessor":
+        klass = api.cvklasses[name]
+        return generate_accessor_wrapper_impl(klass, klass.props[unit[2]])
+    if kind == "ctor":
+        return generate_wrapper_function_impl(make_default_ctor(api.cvklasses[name]))
+    raise ValueError(f"unknown unit: {unit}")
+
+# Initializer of the worker processes of render_units(). A forked worker already has the state of
+# the parent, and a spawned one analyzes api again.
+def _init_render_worker(worker_api:CvApi):
+    global api
+    if worker_api is not api:
+        api = worker_api
+        analyze_support(api)
+
+# Returns the rendered code and the time to render it
+def _render_unit_timed(unit:tuple) -> tuple[str,float]:
+    t0 = time.perf_counter()
+    code = render_unit(unit)
+    return code, time.perf_counter() - t0
+
+# Renders units in jobs processes (jobs <= 0 means os.cpu_count()), and returns the code of each
+# unit in the order of units and the total time spent in render_unit() (i.e. the time of the
+# serial rendering).
+def render_units(units:list[tuple], jobs:int=1) -> tuple[list[str],float]:
+    if jobs <= 0:
+        jobs = os.cpu_count() or 1
+    jobs = min(jobs, len(units))
+    if jobs > 1:
+        # Chunks amortize the IPC, and several chunks per worker balance the load
+        chunksize = max(1, len(units) // (jobs*8))
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs, initializer=_init_render_worker,
+                                                    initargs=(api,)) as executor:
+            results = list(executor.map(_render_unit_timed, units, chunksize=chunksize))
+    else:
+        results = [_render_unit_timed(unit) for unit in units]
+    return [code for code, _ in results], sum(t for _, t in results)
+
+# Packs the code of each namespace into shards of at most shard_size bytes (0: unlimited).
+# units are not split, so a shard can exceed shard_size if a single unit does.
+# Returns the list of (filename, content).
+def pack_shards(ns_units:dict[str,list[str]], shard_size:int) -> list[tuple[str,str]]:
+    shards = []
+    for nsname in sorted(ns_units.keys()):
+        chunks:list[list[str]] = [[]]
+        chunk_size = 0
+        for unit in ns_units[nsname]:
+            if not unit:
+                continue
+            if shard_size > 0 and chunks[-1] and chunk_size + len(unit) > shard_size:
+                chunks.append([])
+                chunk_size = 0
+            chunks[-1].append(unit)
+            chunk_size += len(unit)
+        if not chunks[0]:
+            continue
+        nsname_us = nsname.replace(".", "_") or "global"
+        for i, chunk in enumerate(chunks):
+            if len(chunks) == 1:
+                filename = f"rbopencv_shard_{nsname_us}.cpp"
+            else:
+                filename = f"rbopencv_shard_{nsname_us}_{i+1}.cpp"
+            shards.append((filename, "".join(chunk)))
+    return shards
+
+# If depgraph is given, only the shards of the namespaces affected by modified headers are
+# regenerated (see gen_depgraph.DependencyGraph). The other outputs are always generated.
+# The units of the shards are rendered in jobs processes (see render_units()).
+def generate_code(api:CvApi, shard_size:int=256*1024, unity:bool=False, depgraph:gen_depgraph.DependencyGraph|None=None,
+                  jobs:int=1):
+    # Namespaces are sorted by name, and classes are sorted by name and then by depth
+    # (sort is stable) so that parent classes are registered before their child classes.
+    sorted_namespaces:list[CvNamespace] = sorted(api.cvnamespaces.values(), key=lambda ns: ns.name)
+    sorted_klasses:list[CvKlass] = sorted(api.cvklasses.values(), key=lambda klass: klass.name)
     sorted_klasses = sorted(sorted_klasses, key=lambda klass: klass.depth)
 
-    with open(f"{g_out_dir}/rbopencv_namespaceregistration.hpp", "w") as f:
-        for ns in sorted_namespaces:
-            nsname_us = ns.name.replace(".", "_")
-            print(f"init_submodule(\"{ns.name}\", methods_{nsname_us}, consts_{nsname_us});", file=f)
-    with open(f"{g_out_dir}/rbopencv_modules_content.hpp", "w") as f:
-        for ns in sorted_namespaces:
-            name_us = ns.name.replace(".", "_")
-            print(f"static MethodDef methods_{name_us}[] = {{", file=f)
-            for cvfunc in ns.funcs:
-                funcnames_rb = set()
-                support_stats = check_func_variants_support_status(cvfunc)
-                for i in range(len(cvfunc.variants)):
-                    if support_stats[i][0]:
-                        if cvfunc.variants[i].wrap_as:
-                            funcname_rb = cvfunc.variants[i].wrap_as
-                        else:
-                            funcname_rb = cvfunc.name.split(".")[-1]
-                        funcnames_rb.add(funcname_rb)
-                wrapper_func_name = gen_wrapper_func_name(cvfunc)
-                for funcname_rb in funcnames_rb:
-                    print('    {"%s", %s},' % (funcname_rb, wrapper_func_name), file=f)
-            print(f"    {{NULL, NULL}}", file=f)
-            print(f"}};", file=f)
-            print(f"static ConstDef consts_{name_us}[] = {{", file=f)
-            for cvenum in ns.enums:
+    # Returns the sorted Ruby names of the supported variants of func
+    def get_funcnames_rb(func:CvFunc) -> list[str]:
+        funcnames_rb = set()
+        for v, stat in zip(func.variants, check_func_variants_support_status(func)):
+            if stat[0]:
+                funcnames_rb.add(v.wrap_as if v.wrap_as else g_symbols.lookup(func).basename)
+        return sorted(funcnames_rb)
+
+    out_nsreg:list[str] = []
+    out_modules:list[str] = []
+    for ns in sorted_namespaces:
+        ns_us = ns.name.replace(".", "_")
+        out_nsreg.append(_T_SUBMODULE_REGISTRATION(ns=ns.name, ns_us=ns_us))
+        out_modules.append(_T_METHODS_HEAD(ns_us=ns_us))
+        for cvfunc in ns.funcs:
+            wrapper_func_name = gen_wrapper_func_name(cvfunc)
+            for funcname_rb in get_funcnames_rb(cvfunc):
+                out_modules.append(_T_METHOD_DEF(name=funcname_rb, wrapper=wrapper_func_name))
+        out_modules.append(_T_METHODS_TAIL)
+        out_modules.append(_T_CONSTS_HEAD(ns_us=ns_us))
+        for cvenum in ns.enums:
+            for v in cvenum.values:
                 if cvenum.isscoped:
-                    for v in cvenum.values:
-                        def_name = "_".join(v.name.split(".")[-2:])
-                        def_value = v.name.replace(".", "::")
-                        print('    {"%s", static_cast<long>(%s)},' % (def_name, def_value), file=f)
-                else:
-                    for v in cvenum.values:
-                        def_name = v.name.split(".")[-1]
-                        def_value = v.name.replace(".", "::")
-                        print('    {"%s", static_cast<long>(%s)},' % (def_name, def_value), file=f)
-            for cvklass in ns.klasses:
-                for cvenum in cvklass.enums:
-                    for v in cvenum.values:
-                        def_name = "_".join(v.name.split(".")[-2:])
-                        def_value = v.name.replace(".", "::")
-                        print('    {"%s", static_cast<long>(%s)},' % (def_name, def_value), file=f)
-            print(f"    {{NULL, 0}}", file=f)
-            print(f"}};\n", file=f)
-    with (open(f"{g_out_dir}/rbopencv_classregistration.hpp", "w") as fcr,
-          open(f"{g_out_dir}/rbopencv_wrapclass.hpp", "w") as fwc):
-        for klass in sorted_klasses:
-            if klass.name == "cv.Mat":
-                continue
-            def get_parent_mod_name(klass:CvKlass) -> str:
-                if klass.ns:
-                    mod_name_raw = klass.ns.name
-                elif klass.klass:
-                    mod_name_raw = klass.klass.ns.name
+                    def_name = "_".join(v.name.split(".")[-2:])
                 else:
-                    mod_name_raw = "" # NotReached
-                strs = mod_name_raw.split(".")
-                if strs[0] == "cv":
-                    strs[0] = "CV2"
-                for i in range(1, len(strs)):
-                    strs[i] = strs[i].capitalize()
-                return "_".join(strs)
-            # Example: cv.Ns1.Ns11.Foo class
-            parent_mod_name = get_parent_mod_name(klass)     # CV2_Ns1_Ns11
-            us_klass_name = klass.name.replace(".", "_")     # underscored class name: cv_Ns1_Ns11_Foo
-            c_klass = f'c{us_klass_name}'                    # ccv_Ns1_Ns11_Foo (for VALUE name)
-            cvrb_klass_basename = klass.name.split(".")[-1]  # Foo
-            wrap_struct = f"struct Wrap_{us_klass_name}"     # struct Wrap_cv_Ns1_Ns11_Foo
-            qname = klass.name.replace(".", "::")            # "cv::Ns1::Ns11::Foo"
-            isabstract = check_is_abstract_class(klass)
-            #parent_or_this_klass = klass.parent_klass if klass.parent_klass else klass
-            root_klass = get_root_class(klass)
-            #root_qname = root_klass.name.replace(".", "::")
-            root_us_klass_name = root_klass.name.replace(".", "_")
-            #root_c_klass = f'c{root_us_klass_name}'
-            root_wrap_struct = f"struct Wrap_{root_us_klass_name}"
-            if klass.parent_klass:
-                parent_class_object = "c" + klass.parent_klass.name.replace(".", "_")
-            else:
-                parent_class_object = "rb_cObject"
-            # Write rbopenv_classregistration.hpp
-            print(f"{{", file=fcr)
-            print(f"    VALUE parent_mod = get_parent_module_by_wname(mCV2, \"{parent_mod_name}\");", file=fcr)
-            print(f'    {c_klass} = rb_define_class_under(parent_mod, "{cvrb_klass_basename}", {parent_class_object});', file=fcr)
-            print(f"    rb_define_alloc_func({c_klass}, wrap_{us_klass_name}_alloc);", file=fcr)
-            if not isabstract:
-                has_ctor = False
-                num_supported_ctor_variants = 0
-                for func in klass.funcs:
-                    if check_is_constructor(func):
-                        has_ctor = True
-                        ctor_stats = check_func_variants_support_status(func)
-                        for stat in ctor_stats:
-                            if stat[0]:
-                                num_supported_ctor_variants += 1
-                if has_ctor == False or num_supported_ctor_variants >= 1:
-                    print(f'    rb_define_private_method({c_klass}, "initialize", RUBY_METHOD_FUNC(wrap_{klass.name.replace(".", "_")}_init), -1);', file=fcr)
-            for prop in klass.props:
-                getter_wrapper_func_name = f"wrap_{us_klass_name}_{prop.name}_getter"
-                setter_wrapper_func_name = f"wrap_{us_klass_name}_{prop.name}_setter"
-                print(f'    rb_define_method({c_klass}, "{prop.name}", RUBY_METHOD_FUNC({getter_wrapper_func_name}), 0);', file=fcr)
-                print(f'    rb_define_method({c_klass}, "{prop.name}=", RUBY_METHOD_FUNC({setter_wrapper_func_name}), 1);', file=fcr)
-            for func in klass.funcs:
-                funcnames_rb = set()
-                support_stats = check_func_variants_support_status(func)
-                for i in range(len(func.variants)):
-                    if support_stats[i][0]:
-                        if func.variants[i].wrap_as:
-                            funcname_rb = func.variants[i].wrap_as
-                        else:
-                            funcname_rb = func.name.split(".")[-1]
-                        funcnames_rb.add(funcname_rb)
-                wrapper_func_name = gen_wrapper_func_name(func)
-                for funcname_rb in funcnames_rb:
-                    if func.isstatic:
-                        print(f"    rb_define_singleton_method({c_klass}, \"{funcname_rb}\", RUBY_METHOD_FUNC({wrapper_func_name}), -1);", file=fcr)
-                    else:
-                        print(f'    rb_define_method({c_klass}, "{funcname_rb}", RUBY_METHOD_FUNC({wrapper_func_name}), -1);', file=fcr)
-            print(f"}}", file=fcr)
-
-            # Write rbopenv_wrapclass.hpp
-            fwc.write(f"static VALUE {c_klass};\n")
-            if not klass.parent_klass:
-                fwc.write(f"{wrap_struct} {{\n")
-                fwc.write(f"    Ptr<{qname}> v;\n")
-                fwc.write(f"}};\n")
-                fwc.write(f"static void wrap_{us_klass_name}_free({wrap_struct}* ptr){{\n")
-                fwc.write(f"    ptr->v.reset();\n")
-                fwc.write(f"    ruby_xfree(ptr);\n")
-                fwc.write(f"}};\n")
-            if klass.parent_klass:
-                parent_data_type_ptr = "&" + klass.parent_klass.name.replace(".", "_") + "_type"
-            else:
-                parent_data_type_ptr = "NULL"
-            if root_klass.name in _g_abstract_classes:
-                cast_type = "std::dynamic_pointer_cast"
-            else:
-                cast_type = "std::static_pointer_cast"
-            fwc.write(f"static const rb_data_type_t {us_klass_name}_type {{\n")
-            fwc.write(f"    \"{c_klass}\",\n")
-            fwc.write(f"    {{NULL, reinterpret_cast<RUBY_DATA_FUNC>(wrap_{root_us_klass_name}_free), NULL}},\n")
-            fwc.write(f"    {parent_data_type_ptr}, NULL,\n")
-            fwc.write(f"    RUBY_TYPED_FREE_IMMEDIATELY\n")
-            fwc.write(f"}};\n")
-            fwc.write(f"static Ptr<{qname}> get_{us_klass_name}(VALUE self){{\n")
-            fwc.write(f"    {root_wrap_struct}* ptr;\n")
-            fwc.write(f"    TypedData_Get_Struct(self, {root_wrap_struct}, &{us_klass_name}_type, ptr);\n")
-            fwc.write(f"    return {cast_type}<{qname}>(ptr->v);\n")
-            fwc.write(f"}}\n")
-            fwc.write(f"static VALUE wrap_{us_klass_name}_alloc(VALUE klass){{\n")
-            fwc.write(f"    {root_wrap_struct}* ptr = nullptr;\n")
-            fwc.write(f"    VALUE ret = TypedData_Make_Struct(klass, {root_wrap_struct}, &{us_klass_name}_type, ptr);\n")
-            fwc.write(f"    return ret;\n")
-            fwc.write(f"}}\n")
-            fwc.write(f"template<>\n")
-            fwc.write(f"VALUE rbopencv_from(const Ptr<{qname}>& value){{\n")
-            fwc.write(f"    TRACE_PRINTF(\"[rbopencv_from Ptr<{qname}>]\\n\");\n")
-            fwc.write(f"    {root_wrap_struct} *ptr;\n")
-            fwc.write(f"    VALUE a = wrap_{us_klass_name}_alloc({c_klass});\n")
-            fwc.write(f"    TypedData_Get_Struct(a, {root_wrap_struct}, &{us_klass_name}_type, ptr);\n")
-            fwc.write(f"    ptr->v = value;\n")
-            fwc.write(f"    return a;\n")
-            fwc.write(f"}}\n")
-            if isabstract:
-                continue
-            if klass.name in g_instance_used_as_retval_types:
-                fwc.write(f"template<>\n")
-                fwc.write(f"bool rbopencv_to(VALUE o, {qname}& value){{\n")
-                fwc.write(f"    TRACE_PRINTF(\"[rbopencv_to {qname}]\\n\");\n")
-                fwc.write(f"    Ptr<{qname}> p = get_{us_klass_name}(o);\n")
-                fwc.write(f"    value = *p;\n")
-                fwc.write(f"    return true;\n")
-                fwc.write(f"}}\n")
+                    def_name = v.name.split(".")[-1]
+                out_modules.append(_T_CONST_DEF(name=def_name, value=v.name.replace(".", "::")))
+        for cvklass in ns.klasses:
+            for cvenum in cvklass.enums:
+                for v in cvenum.values:
+                    def_name = "_".join(v.name.split(".")[-2:])
+                    out_modules.append(_T_CONST_DEF(name=def_name, value=v.name.replace(".", "::")))
+        out_modules.append(_T_CONSTS_TAIL)
+    write_if_changed(f"{g_out_dir}/rbopencv_namespaceregistration.hpp", "".join(out_nsreg))
+    write_if_changed(f"{g_out_dir}/rbopencv_modules_content.hpp", "".join(out_modules))
+
+    # The wrappers are split into shards (autogen/rbopencv_shard_*.cpp) so that they can be
+    # compiled in parallel. A shard holds the code of one namespace, or a part of it if the code
+    # exceeds shard_size bytes. Everything referenced across shards is declared in rbopencv_shared.hpp.
+    # Units (see render_unit()) are collected only for the namespaces whose shards are regenerated,
+    # and rendered at once after all of them are collected.
+    dirty_namespaces = None
+    if depgraph:
+        fingerprint = gen_depgraph.global_fingerprint(api, [__file__, hdr_parser_wrapper.__file__],
+                                                      [shard_size, sorted(g_instance_used_as_retval_types)])
+        dirty_namespaces = depgraph.update(api, g_symbols, fingerprint)
+    units:list[tuple[str,tuple]] = []  # (namespace name, unit)
+    def add_unit(ns:CvNamespace, unit:tuple):
+        if dirty_namespaces is None or ns.name in dirty_namespaces:
+            units.append((ns.name, unit))
+    out_shared:list[str] = []
+
+    # Keywords of all wrappers. They are interned once by init_kwarg_ids() (rbopencv_kwargs.hpp),
+    # and the wrappers refer to them by RBOPENCV_KW_<name>.
+    kwarg_names = sorted({name for _, cvfunc in api.cvfuncs.items()
+                          for v in get_sorted_supported_variants(cvfunc) for name in get_kwarg_names(v)})
+    out_shared.append(_T_KWARG_ENUM_HEAD)
+    for name in kwarg_names:
+        out_shared.append(_T_KWARG_ENUM(name=name))
+    out_shared.append(_T_KWARG_ENUM_TAIL)
+    write_if_changed(f"{g_out_dir}/rbopencv_kwargs.hpp",
+        _T_KWARGS_HPP(num=max(len(kwarg_names), 1), interns="".join(_T_KWARG_INTERN(name=name) for name in kwarg_names)))
+
+    def get_parent_mod_name(klass:CvKlass) -> str:
+        strs = get_namespace_of_klass(klass).name.split(".")
+        if strs[0] == "cv":
+            strs[0] = "CV2"
+        for i in range(1, len(strs)):
+            strs[i] = strs[i].capitalize()
+        return "_".join(strs)
+
+    out_classreg:list[str] = []
+    for klass in sorted_klasses:
+        if klass.name == "cv.Mat":
+            continue
+        # Example: cv.Ns1.Ns11.Foo class
+        us_klass_name = klass.name.replace(".", "_")     # underscored class name: cv_Ns1_Ns11_Foo
+        c_klass = f'c{us_klass_name}'                    # ccv_Ns1_Ns11_Foo (for VALUE name)
+        qname = klass.name.replace(".", "::")            # "cv::Ns1::Ns11::Foo"
+        isabstract = check_is_abstract_class(klass)
+        if klass.parent_klass:
+            parent_class_object = "c" + klass.parent_klass.name.replace(".", "_")
+        else:
+            parent_class_object = "rb_cObject"
+        # Write rbopenv_classregistration.hpp
+        out_classreg.append(_T_CLASS_REGISTRATION_HEAD(parent_mod=get_parent_mod_name(klass), c_klass=c_klass,
+            basename=g_symbols.lookup(klass).basename, parent_class_object=parent_class_object, us_klass=us_klass_name))
+        if not isabstract:
             has_ctor = False
             num_supported_ctor_variants = 0
             for func in klass.funcs:
                 if check_is_constructor(func):
                     has_ctor = True
-                    stats = check_func_variants_support_status(func)
-                    for stat in stats:
-                        if stat[0]:
-                            num_supported_ctor_variants += 1
+                    num_supported_ctor_variants += sum(1 for stat in check_func_variants_support_status(func) if stat[0])
             if has_ctor == False or num_supported_ctor_variants >= 1:
-                fwc.write(f"static VALUE wrap_{us_klass_name}_init(int argc, VALUE *argv, VALUE self); // implemented in rbopencv_funcs.hpp\n\n")
+                out_classreg.append(_T_CLASS_REGISTRATION_INIT(c_klass=c_klass, us_klass=us_klass_name))
+        for prop in klass.props:
+            out_classreg.append(_T_CLASS_REGISTRATION_PROP(c_klass=c_klass, us_klass=us_klass_name, prop=prop.name))
+        for func in klass.funcs:
+            wrapper_func_name = gen_wrapper_func_name(func)
+            template = _T_CLASS_REGISTRATION_SINGLETON_METHOD if func.isstatic else _T_CLASS_REGISTRATION_METHOD
+            for funcname_rb in get_funcnames_rb(func):
+                out_classreg.append(template(c_klass=c_klass, name=funcname_rb, wrapper=wrapper_func_name))
+        out_classreg.append(_T_CLASS_REGISTRATION_TAIL)
+
+        # Write the declarations to rbopencv_shared.hpp and the definitions (generate_klass_impl()) to the shard
+        out_shared.append(_T_CLASS_DECL(c_klass=c_klass))
+        if not klass.parent_klass:
+            out_shared.append(_T_ROOT_CLASS_DECL(us_klass=us_klass_name, qname=qname))
+        out_shared.append(_T_CLASS_TYPE_DECL(us_klass=us_klass_name, qname=qname))
+        if not isabstract and klass.name in g_instance_used_as_retval_types:
+            out_shared.append(_T_CLASS_TO_DECL(qname=qname))
+        add_unit(get_namespace_of_klass(klass), ("klass", klass.name))
+    write_if_changed(f"{g_out_dir}/rbopencv_classregistration.hpp", "".join(out_classreg))
+
+    for _, cvenum in api.cvenums.items():
+        if cvenum.name.endswith(".<unnamed>"):
+            continue
+        qname = cvenum.name.replace(".", "::")
+        out_shared.append(_T_ENUM_DECL(qname=qname))
+        add_unit(g_symbols.lookup(cvenum).namespace, ("enum", cvenum.name))
+
+    out_log:list[str] = ["Support_Status,Function_Name,Variant_Number,Retval_Type,Argument_Types,Reason\n"]
+    for _, cvfunc in api.cvfuncs.items():
+        support_stats = check_func_variants_support_status(cvfunc)
+        for i, (var, stat) in enumerate(zip(cvfunc.variants, support_stats)):
+            out_log.append(_T_SUPPORT_STATUS(status="Generate" if stat[0] else "Skip", name=cvfunc.name, i=i,
+                rettype=var.rettype, argtypes=",".join([arg.tp for arg in var.args]), reason=stat[1]))
+        if not any(stat[0] for stat in support_stats):
+            continue
+        out_shared.append(_T_WRAPPER_DECL(wrapper=gen_wrapper_func_name(cvfunc)))
+        add_unit(get_namespace_of_func(cvfunc), ("func", cvfunc.name))
+    write_if_changed(f"{g_out_dir}/log-support-status.csv", "".join(out_log))
+    for klass in sorted_klasses:
+        for i, prop in enumerate(klass.props):
+            out_shared.append(_T_ACCESSOR_DECL(us_klass=klass.name.replace(".", "_"), prop=prop.name))
+            add_unit(get_namespace_of_klass(klass), ("accessor", klass.name, i))
+    for klass in sorted_klasses:
+        has_ctor = any(check_is_constructor(func) for func in klass.funcs)
+        isabstract = check_is_abstract_class(klass)
+        if (not has_ctor) and (not isabstract):
+            # If ctor is not defined, ClassName_init() shall be generated to support default ctor
+            out_shared.append(_T_WRAPPER_DECL(wrapper=gen_wrapper_func_name(make_default_ctor(klass))))
+            add_unit(get_namespace_of_klass(klass), ("ctor", klass.name))
 
-    with open(f"{g_out_dir}/rbopencv_enum_converter.hpp", "w") as f:
-        for _, cvenum in api.cvenums.items():
-            if cvenum.name.endswith(".<unnamed>"):
+    write_if_changed(f"{g_out_dir}/rbopencv_shared.hpp", _T_SHARED_HPP(decls="".join(out_shared)))
+
+    with gen_profiler.phase("render_units"):
+        t0 = time.perf_counter()
+        codes, serial_time = render_units([unit for _, unit in units], jobs)
+        wall_time = time.perf_counter() - t0
+    if jobs != 1 and units:
+        print(f"[Info] rendered {len(units)} unit(s) in {wall_time:.3f}s "
+              f"(serial {serial_time:.3f}s, x{serial_time / wall_time if wall_time > 0 else 1.0:.2f})")
+    ns_units:dict[str,list[str]] = {}
+    for (nsname, _), code in zip(units, codes):
+        ns_units.setdefault(nsname, []).append(code)
+
+    # The shards of the namespaces which are not regenerated are kept as they are
+    with gen_profiler.phase("write_shards"):
+        shard_filenames:list[str] = []
+        for nsname in sorted(api.cvnamespaces.keys()):
+            if dirty_namespaces is not None and nsname not in dirty_namespaces:
+                shard_filenames += depgraph.get_shards(nsname)
                 continue
-            qname = cvenum.name.replace(".", "::")
-            f.write(f"template<>\n")
-            f.write(f"bool rbopencv_to(VALUE obj, {qname}& value){{\n")
-            f.write(f"    TRACE_PRINTF(\"[rbopencv_to {qname}]\\n\");\n")
-            f.write(f"    if (!FIXNUM_P(obj))\n")
-            f.write(f"        return false;\n")
-            f.write(f"    int tmp = FIX2INT(obj);\n")
-            f.write(f"    value = static_cast<{qname}>(tmp);\n")
-            f.write(f"    return true;\n")
-            f.write(f"}}\n")
-            f.write(f"template<>\n")
-            f.write(f"VALUE rbopencv_from(const {qname}& value){{\n")
-            f.write(f"    TRACE_PRINTF(\"[rbopencv_from {qname}] %d\", value);\n")
-            f.write(f"    return INT2NUM(static_cast<int>(value));\n")
-            f.write(f"}}\n")
-
-    with (open(f"{g_out_dir}/rbopencv_funcs.hpp", "w") as f,
-          open("./autogen/log-support-status.csv", "w") as log_f):
-        print("Support_Status,Function_Name,Variant_Number,Retval_Type,Argument_Types,Reason", file=log_f)
+            filenames = []
+            for filename, content in pack_shards({nsname: ns_units.get(nsname, [])}, shard_size):
+                write_if_changed(f"{g_out_dir}/{filename}", f'#include "rbopencv_shared.hpp"\n\n{content}')
+                filenames.append(filename)
+            if depgraph:
+                depgraph.set_shards(nsname, filenames)
+            shard_filenames += filenames
+    if depgraph:
+        depgraph.save()
+    for path in glob.glob(f"{g_out_dir}/rbopencv_shard_*.cpp"):
+        if os.path.basename(path) not in shard_filenames:
+            os.remove(path)
+    # In unity mode, cv2.cpp includes all shards via rbopencv_unity.hpp and extconf.rb compiles only cv2.cpp.
+    # Otherwise extconf.rb compiles the shards listed in rbopencv_sources.txt.
+    with (open_if_changed(f"{g_out_dir}/rbopencv_unity.hpp") as fu,
+          open_if_changed(f"{g_out_dir}/rbopencv_sources.txt") as fs):
+        for filename in shard_filenames:
+            if unity:
+                print(f'#include "{filename}"', file=fu)
+            else:
+                print(filename, file=fs)
+
+# Parses the headers (or loads the snapshot) and generates the code under g_out_dir.
+# Returns the list of headers.
+def generate(args, cache:hdr_parser_cache.ParseCache|None, prescan:hdr_parser_prescan.HeaderPrescan|None) -> list[str]:
+    global api
+    autogen_writer.g_updated_files.clear()
+    autogen_writer.g_unchanged_files.clear()
+    if args.snapshot:
+        try:
+            with gen_profiler.phase("load_snapshot"):
+                api, headers = hdr_parser_snapshot.load_snapshot(args.snapshot)
+        except (OSError, hdr_parser_snapshot.SnapshotError) as e:
+            print(f"[Error] {e}")
+            exit(1)
+        with gen_profiler.phase("dump_api"):
+            hdr_parser_wrapper.dump_api(api, g_out_dir)
+    else:
+        headers = hdr_parser_wrapper.read_headers_txt(args.headers_txt)
+        if cache:
+            cache.hits = cache.misses = 0
+        if prescan:
+            prescan.skipped = 0
+        with gen_profiler.phase("parse_headers"):
+            api = hdr_parser_wrapper.parse_headers(headers, g_out_dir, jobs=args.jobs, cache=cache, prescan=prescan)
+        if cache:
+            print(f"[Info] parse cache: {cache.hits} hit(s), {cache.misses} miss(es)")
+        if prescan:
+            print(f"[Info] pre-scan: {prescan.skipped} of {len(headers)} header(s) skipped")
+    if args.save_snapshot:
+        with gen_profiler.phase("save_snapshot"):
+            hdr_parser_snapshot.save_snapshot(args.save_snapshot, api, headers)
+    os.makedirs(g_out_dir, exist_ok=True)
+    with open_if_changed(f"{g_out_dir}/rbopencv_include.hpp") as f:
+        for hdr in headers:
+            print(f'#include "{hdr}"', file=f)
+    with gen_profiler.phase("analyze_support"):
+        analyze_support(api)
+    with (open_if_changed(f"{g_out_dir}/log-unsupported-retvals.txt") as fr,
+          open_if_changed(f"{g_out_dir}/log-unsupported-args.txt") as fa):
         for _, cvfunc in api.cvfuncs.items():
-            support_stats = check_func_variants_support_status(cvfunc)
-            num_supported_variants = 0
-            supported_vars:list[CvVariant] = []
-            for i in range(len(cvfunc.variants)):
-                var = cvfunc.variants[i]
-                stat = support_stats[i]
-                if stat[0]:
-                    num_supported_variants += 1
-                    supported_vars.append(cvfunc.variants[i])
-                    gen_stat = "Generate"
-                else:
-                    gen_stat = "Skip"
-                arg_tps = [arg.tp for arg in var.args]
-                str_arg_tps = ",".join(arg_tps)
-                print(f'{gen_stat},{cvfunc.name},{i},{var.rettype},"{str_arg_tps}"', file=log_f, end="")
-                print(f',"{stat[1]}"', file=log_f)
-            if num_supported_variants == 0:
+            for var in cvfunc.variants:
+                if not check_rettype_supported(var.rettype_qname):
+                    print(f"{var.rettype_qname}", file=fr)
+                for arg in var.args:
+                    if not check_argtype_supported(arg.tp_qname):
+                        print(f"{arg.tp_qname}", file=fa)
+    depgraph = gen_depgraph.DependencyGraph(g_out_dir, reuse=not args.no_incremental)
+    if args.snapshot:
+        # The headers may differ from the ones the snapshot was created from
+        depgraph.remove()
+        depgraph = None
+    with gen_profiler.phase("generate_code"):
+        generate_code(api, shard_size=args.shard_size*1024, unity=args.unity, depgraph=depgraph, jobs=args.jobs)
+    if depgraph:
+        print(f"[Info] incremental: {depgraph.num_regenerated} of {depgraph.num_namespaces} namespace(s) regenerated")
+    print(f"[Info] {g_out_dir}: {len(autogen_writer.g_updated_files)} file(s) updated, "
+          f"{len(autogen_writer.g_unchanged_files)} file(s) unchanged")
+    return headers
+
+def _get_mtimes(paths:list[str]) -> dict[str,int|None]:
+    mtimes = {}
+    for path in paths:
+        try:
+            mtimes[path] = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            mtimes[path] = None
+    return mtimes
+
+# Polls headers_txt and the headers every interval seconds, and generates the code again when one of
+# them is modified. The parse results stay in memory (cache), so only the modified headers are parsed
+# and only the affected shards are written (see generate_code()). If a module of the generator itself
+# is modified, the process is restarted with the same arguments to load it.
+def watch(args, headers:list[str], cache:hdr_parser_cache.ParseCache, prescan:hdr_parser_prescan.HeaderPrescan|None):
+    gen_dir = os.path.dirname(os.path.abspath(__file__))
+    sources = sorted(glob.glob(f"{gen_dir}/*.py"))
+    source_mtimes = _get_mtimes(sources)
+    header_mtimes = _get_mtimes([args.headers_txt] + headers)
+    print(f"[Info] watching {len(headers)} header(s) in {args.headers_txt} (Ctrl-C to stop)")
+    try:
+        while True:
+            time.sleep(args.watch_interval)
+            if _get_mtimes(sources) != source_mtimes:
+                print("[Info] generator modified, restarting")
+                sys.stdout.flush()
+                os.execv(sys.executable, [sys.executable] + sys.argv)
+            mtimes = _get_mtimes([args.headers_txt] + headers)
+            if mtimes == header_mtimes:
                 continue
-            generate_wrapper_function_impl(f, cvfunc, log_f)
-        for klass in sorted_klasses:
-            for prop in klass.props:
-                generate_accessor_wrapper_impl(f, klass, prop, log_f)
-        for klass in sorted_klasses:
-            has_ctor = False
-            for func in klass.funcs:
-                if check_is_constructor(func):
-                    has_ctor = True
-                    break
-            isabstract = check_is_abstract_class(klass)
-            if (not has_ctor) and (not isabstract):
-                # If ctor is not defined, ClassName_init() shall be generated to support default ctor
-                klass_basename = klass.name.split(".")[-1]
-                ctor_name = f"{klass.name}.{klass_basename}"
-                ctor_var = CvVariant(wrap_as=None, isconst=False, isvirtual=False, ispurevirtual=False, rettype="",
-                    rettype_qname="", args=[])
-                dummy_func = CvFunc(filename="(dummy)", ns=klass.ns, klass=klass, name_cpp=ctor_name, name=ctor_name,
-                    isstatic=False, variants=[ctor_var])
-                generate_wrapper_function_impl(f, dummy_func, log_f)
-
-headers_txt = "./headers.txt"
-if len(sys.argv) == 2:
-    headers_txt = sys.argv[1]
-headers = []
-with open(headers_txt) as f:
-    for line in f:
-        line = line.strip()
-        if line.startswith("#"):
-            continue
-        headers.append(line.split("#")[0].strip())
-
-api = hdr_parser_wrapper.parse_headers(headers, g_out_dir)
-os.makedirs(g_out_dir, exist_ok=True)
-with open(f"{g_out_dir}/rbopencv_include.hpp", "w") as f:
-    for hdr in headers:
-        print(f'#include "{hdr}"', file=f)
-for _, cvenum in api.cvenums.items():
-    g_supported_enum_types.append(cvenum.name)
-for _, cvklass in api.cvklasses.items():
-    g_supported_class_types.append(cvklass.name)
-tmp_instance_used_as_retval_types = set()
-for _, cvfunc in api.cvfuncs.items():
-    for var in cvfunc.variants:
-        if var.rettype_qname in api.cvklasses.keys():
-            tmp_instance_used_as_retval_types.add(var.rettype_qname)
-g_instance_used_as_retval_types = list(tmp_instance_used_as_retval_types)
-with (open(f"{g_out_dir}/log-unsupported-retvals.txt", "w") as fr,
-      open(f"{g_out_dir}/log-unsupported-args.txt", "w") as fa):
-    for _, cvfunc in api.cvfuncs.items():
-        for var in cvfunc.variants:
-            if not check_rettype_supported(var.rettype_qname):
-                print(f"{var.rettype_qname}", file=fr)
-            for arg in var.args:
-                if not check_argtype_supported(arg.tp_qname):
-                    print(f"{arg.tp_qname}", file=fa)
-generate_code(api)
+            changed = [path for path, mtime in mtimes.items() if header_mtimes.get(path) != mtime]
+            print(f"[Info] modified: {', '.join(changed)}")
+            t0 = time.perf_counter()
+            try:
+                headers = generate(args, cache, prescan)
+                print(f"[Info] generated in {time.perf_counter() - t0:.3f}s")
+            except SystemExit:
+                # Errors are reported by exit(1). Keep watching until the headers are fixed.
+                print("[Error] generation failed, waiting for the next modification")
+            header_mtimes = _get_mtimes([args.headers_txt] + headers)
+    except KeyboardInterrupt:
+        pass
+
+def main():
+    import argparse
+    argparser = argparse.ArgumentParser(prog="gen2rb.py")
+    argparser.add_argument("headers_txt", nargs="?", default="./headers.txt",
+        help="list of header files (one per line, default: ./headers.txt)")
+    argparser.add_argument("-j", "--jobs", type=int, default=1,
+        help="number of processes to parse headers and to generate the code (0: number of CPUs, default: 1)")
+    argparser.add_argument("--parse-cache", metavar="DIR", default="./.parse-cache",
+        help="cache parsed headers in DIR (default: ./.parse-cache)")
+    argparser.add_argument("--parse-cache-size", metavar="MB", type=int, default=256,
+        help="max size of the parse cache in MB (default: 256)")
+    argparser.add_argument("--clear-parse-cache", action="store_true",
+        help="remove all entries of the parse cache before parsing")
+    argparser.add_argument("--no-parse-cache", action="store_true",
+        help="parse all headers without the parse cache")
+    argparser.add_argument("--no-prescan", action="store_true",
+        help="parse all headers, including the ones without declarations to bind")
+    argparser.add_argument("--shard-size", metavar="KB", type=int, default=256,
+        help="max size of each generated autogen/rbopencv_shard_*.cpp in KB (0: one shard per namespace, default: 256)")
+    argparser.add_argument("--unity", action="store_true",
+        help="compile all shards as a part of cv2.cpp instead of separate translation units")
+    argparser.add_argument("--no-incremental", action="store_true",
+        help=f"regenerate all shards instead of the ones affected by modified headers (see {g_out_dir}/depgraph.json)")
+    argparser.add_argument("--watch", action="store_true",
+        help="keep running, and generate the code again when headers_txt or the headers are modified")
+    argparser.add_argument("--watch-interval", metavar="SEC", type=float, default=0.5,
+        help="interval of polling the headers with --watch (default: 0.5)")
+    argparser.add_argument("--snapshot", metavar="FILE",
+        help="read the API from FILE (saved by --save-snapshot) instead of parsing headers_txt")
+    argparser.add_argument("--save-snapshot", metavar="FILE",
+        help="save the parsed API to FILE")
+    argparser.add_argument("--profile", action="store_true",
+        help="record time and memory of each phase and header, and write the report to --profile-out")
+    argparser.add_argument("--profile-out", metavar="FILE", default=f"{g_out_dir}/profile.json",
+        help=f"file of the report of --profile (default: {g_out_dir}/profile.json)")
+    argparser.add_argument("--profile-top", metavar="N", type=int, default=10,
+        help="number of the slowest headers printed with --profile (default: 10)")
+    args = argparser.parse_args()
+    if args.profile:
+        gen_profiler.enable()
+
+    if args.watch and args.snapshot:
+        print("[Error] --watch cannot be used with --snapshot")
+        exit(1)
+
+    cache = None
+    prescan = None
+    if not args.snapshot:
+        if not args.no_parse_cache:
+            cache = hdr_parser_wrapper.create_parse_cache(args.parse_cache, args.parse_cache_size*1024*1024, in_memory=args.watch)
+            if args.clear_parse_cache:
+                cache.clear()
+        elif args.watch:
+            cache = hdr_parser_wrapper.create_parse_cache(None)
+        if not args.no_prescan:
+            prescan = hdr_parser_wrapper.create_prescan(cache)
+    headers = generate(args, cache, prescan)
+    if gen_profiler.g_profiler:
+        gen_profiler.g_profiler.write_report(args.profile_out)
+        gen_profiler.g_profiler.print_summary(args.profile_top)
+        print(f"[Info] profile: {args.profile_out}")
+    if args.watch:
+        watch(args, headers, cache, prescan)
+
+if __name__ == "__main__":
+    main()
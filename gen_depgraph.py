@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+
+import hashlib
+import json
+import os
+
+import hdr_parser_cache
+from hdr_parser_wrapper import CvApi, CvFunc, CvTypedef, SymbolTable
+
+# Bump this when the format of the state file changes
+DEPGRAPH_FORMAT_VERSION = 1
+
+def _file_sha256(path:str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+def _typedef_target(td:CvTypedef) -> str:
+    for obj in [td.klass, td.func, td.enum]:
+        if obj:
+            return obj.name
+    return td.other or ""
+
+# Returns the fingerprint of everything which the generated code of a symbol depends on besides
+# the declarations of its own headers: the sources of the generator (sources) and the parser,
+# the names of the namespaces, classes (with their parents), enums and typedefs of api, and extra
+# (e.g. options and results of the support analysis). It must be JSON serializable.
+def global_fingerprint(api:CvApi, sources:list[str], extra:list) -> str:
+    h = hashlib.sha256(f"{DEPGRAPH_FORMAT_VERSION}:{hdr_parser_cache.parser_version()}".encode())
+    for path in sources:
+        h.update(_file_sha256(path).encode())
+    names = [
+        sorted(api.cvnamespaces.keys()),
+        sorted((name, klass.parent_klass.name if klass.parent_klass else "") for name, klass in api.cvklasses.items()),
+        sorted(api.cvenums.keys()),
+        sorted((name, td.tdtype.name, _typedef_target(td)) for name, td in api.cvtypedefs.items()),
+        extra,
+    ]
+    h.update(json.dumps(names).encode())
+    return h.hexdigest()
+
+def _func_headers(func:CvFunc) -> list[str]:
+    return sorted(set(var.filename or func.filename for var in func.variants) or {func.filename})
+
+# Graph of headers -> symbols (classes, enums and functions) -> generated shards, which is used to
+# regenerate only the shards (autogen/rbopencv_shard_*.cpp) affected by modified headers.
+#
+# The code of a symbol is always emitted to the shards of its namespace, so the graph is recorded
+# by namespace: the symbols of the namespace with the headers which declare them, and the shards
+# written for it. The graph is saved to <out_dir>/depgraph.json with the sha256 of the headers and
+# a global fingerprint (see global_fingerprint()). On the next run, the shards of a namespace are
+# regenerated if one of the headers of its symbols (in this run or in the previous one) was
+# modified, added or removed, or if one of its shards is missing. Everything is regenerated if the
+# global fingerprint differs.
+class DependencyGraph:
+    def __init__(self, out_dir:str, reuse:bool=True):
+        self.out_dir = out_dir
+        self.path = f"{out_dir}/depgraph.json"
+        self.num_namespaces = 0
+        self.num_regenerated = 0
+        self._prev = self._load() if reuse else None
+        self._header_stats:dict[str,list] = {}  # path -> [mtime_ns, size, sha256]
+        self._fingerprint = ""
+        self._namespaces:dict[str,dict] = {}    # nsname -> {"symbols": {name: [headers]}, "shards": [filenames]}
+
+    def _load(self) -> dict|None:
+        try:
+            with open(self.path, "r") as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (ValueError, UnicodeDecodeError):
+            print(f"[Warning] ignored broken dependency graph: {self.path}")
+            return None
+        if not isinstance(state, dict) or state.get("version") != DEPGRAPH_FORMAT_VERSION:
+            return None
+        return state
+
+    # Returns sha256 of hdr ("" if it does not exist, e.g. the pseudo header of the classes added by
+    # hdr_parser_wrapper). It is computed again only if the modification time or the size of hdr
+    # differs from the previous run.
+    def _header_sha256(self, hdr:str) -> str:
+        stat = self._header_stats.get(hdr)
+        if stat:
+            return stat[2]
+        try:
+            st = os.stat(hdr)
+        except FileNotFoundError:
+            self._header_stats[hdr] = [0, 0, ""]
+            return ""
+        prev = self._prev["headers"].get(hdr) if self._prev else None
+        if prev and prev[0] == st.st_mtime_ns and prev[1] == st.st_size:
+            sha256 = prev[2]
+        else:
+            sha256 = _file_sha256(hdr)
+        self._header_stats[hdr] = [st.st_mtime_ns, st.st_size, sha256]
+        return sha256
+
+    def _is_header_modified(self, hdr:str) -> bool:
+        prev = self._prev["headers"].get(hdr)
+        return prev is None or prev[2] != self._header_sha256(hdr)
+
+    # Records the symbols of api by namespace, and returns the names of the namespaces whose
+    # shards must be regenerated. The shards of the other namespaces can be kept as they are.
+    def update(self, api:CvApi, symbols:SymbolTable, fingerprint:str) -> set[str]:
+        self._fingerprint = fingerprint
+        self._namespaces = {nsname: {"symbols": {}, "shards": []} for nsname in api.cvnamespaces.keys()}
+        def add(obj, headers:list[str]):
+            ns = symbols.lookup(obj).namespace
+            if ns is not None:
+                self._namespaces[ns.name]["symbols"][obj.name] = headers
+        for _, cvklass in api.cvklasses.items():
+            add(cvklass, [cvklass.filename])
+        for _, cvenum in api.cvenums.items():
+            add(cvenum, [cvenum.filename])
+        for _, cvfunc in api.cvfuncs.items():
+            add(cvfunc, _func_headers(cvfunc))
+        for entry in self._namespaces.values():
+            for headers in entry["symbols"].values():
+                for hdr in headers:
+                    self._header_sha256(hdr)
+
+        prev_namespaces = {}
+        if self._prev and self._prev.get("fingerprint") == fingerprint:
+            prev_namespaces = self._prev["namespaces"]
+        dirty = set()
+        for nsname, entry in self._namespaces.items():
+            prev = prev_namespaces.get(nsname)
+            if prev is None:
+                dirty.add(nsname)
+                continue
+            headers = set()
+            for symbol_headers in list(entry["symbols"].values()) + list(prev["symbols"].values()):
+                headers.update(symbol_headers)
+            if (any(self._is_header_modified(hdr) for hdr in headers) or
+                any(not os.path.exists(f"{self.out_dir}/{filename}") for filename in prev["shards"])):
+                dirty.add(nsname)
+            else:
+                entry["shards"] = prev["shards"]
+        self.num_namespaces = len(self._namespaces)
+        self.num_regenerated = len(dirty)
+        return dirty
+
+    # Returns the shards of nsname (kept from the previous run, or set by set_shards())
+    def get_shards(self, nsname:str) -> list[str]:
+        return self._namespaces[nsname]["shards"]
+
+    def set_shards(self, nsname:str, filenames:list[str]):
+        self._namespaces[nsname]["shards"] = filenames
+
+    def save(self):
+        state = {
+            "version": DEPGRAPH_FORMAT_VERSION,
+            "fingerprint": self._fingerprint,
+            "headers": dict(sorted(self._header_stats.items())),
+            "namespaces": self._namespaces,
+        }
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f, indent=1)
+        os.replace(tmp_path, self.path)
+
+    # Removes the saved graph (e.g. when the outputs are generated from something else than headers)
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
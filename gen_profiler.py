@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+
+import contextlib
+import json
+import time
+import tracemalloc
+
+# Records wall time, CPU time and peak traced memory (tracemalloc) of the phases of the generator
+# and of each parsed header.
+#
+# Phases can be nested. The peak of a phase is the maximum traced memory while it runs, and it is
+# also taken into account for the enclosing phases (tracemalloc has only one peak counter, so it is
+# reset when a phase starts and the peak so far is kept in the stack).
+class Profiler:
+    def __init__(self):
+        self.phases:list[dict] = []
+        self.headers:list[dict] = []
+        self._stack:list[dict] = []
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextlib.contextmanager
+    def _measure(self, record:dict):
+        if self._stack:
+            parent = self._stack[-1]
+            parent["peak"] = max(parent["peak"], tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+        frame = {"peak": 0}
+        self._stack.append(frame)
+        wall0 = time.perf_counter()
+        cpu0 = time.process_time()
+        try:
+            yield
+        finally:
+            record["wall"] = time.perf_counter() - wall0
+            record["cpu"] = time.process_time() - cpu0
+            record["peak"] = max(frame["peak"], tracemalloc.get_traced_memory()[1])
+            self._stack.pop()
+
+    @contextlib.contextmanager
+    def phase(self, name:str):
+        path = "/".join([r["name"] for r in self._stack if "name" in r] + [name])
+        record = {"name": name, "path": path, "depth": len([r for r in self._stack if "name" in r])}
+        self.phases.append(record)
+        with self._measure(record):
+            # The frame holds the name so that nested phases can build their path
+            self._stack[-1]["name"] = name
+            yield
+
+    @contextlib.contextmanager
+    def header(self, hdr:str, cached:bool=False):
+        record = {"header": hdr, "cached": cached}
+        self.headers.append(record)
+        with self._measure(record):
+            yield
+
+    # For headers parsed in other processes (see measure_header())
+    def add_header(self, hdr:str, wall:float, cpu:float, peak:int|None, cached:bool=False):
+        self.headers.append({"header": hdr, "cached": cached, "wall": wall, "cpu": cpu, "peak": peak})
+
+    def write_report(self, path:str):
+        report = {
+            "phases": [{"path": r["path"], "wall_sec": r["wall"], "cpu_sec": r["cpu"], "peak_bytes": r["peak"]}
+                       for r in self.phases],
+            "headers": [{"header": r["header"], "cached": r["cached"], "wall_sec": r["wall"], "cpu_sec": r["cpu"],
+                         "peak_bytes": r["peak"]} for r in self.headers],
+        }
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2)
+
+    def print_summary(self, top_n:int=10):
+        print("[Profile] phase: wall(s) cpu(s) peak(MB)")
+        for r in self.phases:
+            print(f"[Profile]   {'  '*r['depth']}{r['name']}: {r['wall']:.3f} {r['cpu']:.3f} {r['peak']/1024/1024:.1f}")
+        if not self.headers:
+            return
+        print(f"[Profile] top {top_n} slowest headers: wall(s) cpu(s) peak(MB)")
+        for r in sorted(self.headers, key=lambda r: r["wall"], reverse=True)[0:top_n]:
+            peak = f"{r['peak']/1024/1024:.1f}" if r["peak"] is not None else "-"
+            cached = " (cached)" if r["cached"] else ""
+            print(f"[Profile]   {r['header']}{cached}: {r['wall']:.3f} {r['cpu']:.3f} {peak}")
+
+# The profiler of this process. None if profiling is disabled.
+g_profiler:Profiler|None = None
+
+def enable() -> Profiler:
+    global g_profiler
+    if g_profiler is None:
+        g_profiler = Profiler()
+    return g_profiler
+
+# Same as Profiler.phase(), but does nothing if profiling is disabled
+@contextlib.contextmanager
+def phase(name:str):
+    if g_profiler is None:
+        yield
+        return
+    with g_profiler.phase(name):
+        yield
+
+# Same as Profiler.header(), but does nothing if profiling is disabled
+@contextlib.contextmanager
+def header(hdr:str, cached:bool=False):
+    if g_profiler is None:
+        yield
+        return
+    with g_profiler.header(hdr, cached):
+        yield
+
+# Measures func(hdr) in a worker process, where the profiler of the main process is not available.
+# Returns (result, {"wall", "cpu", "peak"}).
+def measure_header(func, hdr:str):
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    wall0 = time.perf_counter()
+    cpu0 = time.process_time()
+    result = func(hdr)
+    stats = {"wall": time.perf_counter() - wall0, "cpu": time.process_time() - cpu0,
+             "peak": tracemalloc.get_traced_memory()[1]}
+    return result, stats
@@ -31,11 +31,35 @@ where the list of modifiers is yet another nested list of strings
 original_return_type is None if the original_return_type is the same as return_value_type
 """
 
+# G-API specific aliases (every pattern contains "GAPI_")
+_GAPI_ALIASES = [
+    ("GAPI_EXPORTS", "CV_EXPORTS"),
+    ("GAPI_EXPORTS_W", "CV_EXPORTS_W"),
+    ("GAPI_EXPORTS_W_SIMPLE","CV_EXPORTS_W_SIMPLE"),
+    ("GAPI_WRAP", "CV_WRAP"),
+    ("GAPI_PROP", "CV_PROP"),
+    ("GAPI_PROP_RW", "CV_PROP_RW"),
+    ('defined(GAPI_STANDALONE)', '0'),
+]
+
+# Tokens for the "regex" tokenizer. Only one token can start at a position,
+# so the leftmost match is the same token as the one find_next_token() returns.
+_STMT_TOKEN_RE = re.compile(r'[;"{}]|//|/\*')
+_STR_TOKEN_RE = re.compile(r'[\\"]')
+_EMPTY_INIT_RE = re.compile(r'=\s*\{\s*\}')
+
 class CppHeaderParser(object):
 
-    def __init__(self, generate_umat_decls=False, generate_gpumat_decls=False):
+    def __init__(self, generate_umat_decls=False, generate_gpumat_decls=False, tokenizer="regex"):
+        """
+        tokenizer: "regex" scans each line with precompiled regexes, "legacy" runs str.find()
+        for each token. Both produce the same declarations.
+        """
+        if tokenizer not in ("regex", "legacy"):
+            raise ValueError("unknown tokenizer: %s" % tokenizer)
         self._generate_umat_decls = generate_umat_decls
         self._generate_gpumat_decls = generate_gpumat_decls
+        self._tokenizer = tokenizer
 
         self.BLOCK_TYPE = 0
         self.BLOCK_NAME = 1
@@ -812,13 +836,33 @@ class CppHeaderParser(object):
                 token = t
         return token, tpos
 
+    def match_next_token(self, s, token_re, p=0):
+        """
+        Same as find_next_token(), but the tokens are given as a compiled regex
+        """
+        m = token_re.search(s, p)
+        if m is None:
+            return "", len(s)
+        return m.group(), m.start()
+
     def parse(self, hname, wmode=True):
         """
         The main method. Parses the input file.
         Returns the list of declarations (that can be print using print_decls)
         """
+        return list(self.iter_decls(hname, wmode))
+
+    def iter_decls(self, hname, wmode=True):
+        """
+        Same as parse(), but yields the declarations one by one while parsing the input file.
+        The declarations inside an exported class are held back until the class block is closed,
+        since the properties (CV_PROP) are appended to the class declaration until then.
+        self.namespaces is complete only after all declarations are consumed.
+        """
         self.hname = hname
-        decls = []
+        decls = [] # declarations not yielded yet
+        # length of the block stack while the outermost exported class is open
+        class_block_depth = None
         f = io.open(hname, 'rt', encoding='utf-8')
         linelist = list(f.readlines())
         f.close()
@@ -840,6 +884,17 @@ class CppHeaderParser(object):
 
         depth_if_0 = 0
 
+        if self._tokenizer == "regex":
+            def next_stmt_token(s):
+                return self.match_next_token(s, _STMT_TOKEN_RE)
+            def next_str_token(s, p):
+                return self.match_next_token(s, _STR_TOKEN_RE, p)
+        else:
+            def next_stmt_token(s):
+                return self.find_next_token(s, [";", "\"", "{", "}", "//", "/*"])
+            def next_str_token(s, p):
+                return self.find_next_token(s, ["\\", "\""], p)
+
         for l0 in linelist:
             self.lineno += 1
             #print(state, self.lineno, l0)
@@ -847,15 +902,8 @@ class CppHeaderParser(object):
             l = l0.strip()
 
             # G-API specific aliases
-            l = self.batch_replace(l, [
-                    ("GAPI_EXPORTS", "CV_EXPORTS"),
-                    ("GAPI_EXPORTS_W", "CV_EXPORTS_W"),
-                    ("GAPI_EXPORTS_W_SIMPLE","CV_EXPORTS_W_SIMPLE"),
-                    ("GAPI_WRAP", "CV_WRAP"),
-                    ("GAPI_PROP", "CV_PROP"),
-                    ("GAPI_PROP_RW", "CV_PROP_RW"),
-                    ('defined(GAPI_STANDALONE)', '0'),
-                ])
+            if self._tokenizer == "legacy" or "GAPI_" in l:
+                l = self.batch_replace(l, _GAPI_ALIASES)
 
             if state == SCAN and l.startswith("#"):
                 state = DIRECTIVE
@@ -915,13 +963,16 @@ class CppHeaderParser(object):
                 print("Error at %d: invalid state = %d" % (self.lineno, state))
                 sys.exit(-1)
 
+            # l is only shortened from the front below, so '= {}' can appear in l
+            # only if the whole line has it
+            has_empty_init = self._tokenizer == "legacy" or _EMPTY_INIT_RE.search(l) is not None
             while 1:
                 # NB: Avoid parsing '{' for case:
                 # foo(Obj&& = {});
-                if re.search(r'=\s*\{\s*\}', l):
+                if has_empty_init and _EMPTY_INIT_RE.search(l):
                     token, pos = ';', len(l)
                 else:
-                    token, pos = self.find_next_token(l, [";", "\"", "{", "}", "//", "/*"])
+                    token, pos = next_stmt_token(l)
 
                 if not token:
                     block_head += " " + l
@@ -958,7 +1009,7 @@ class CppHeaderParser(object):
                 if token == "\"":
                     pos2 = pos + 1
                     while 1:
-                        t2, pos2 = self.find_next_token(l, ["\\", "\""], pos2)
+                        t2, pos2 = next_str_token(l, pos2)
                         if t2 == "":
                             print("Error at %d: no terminating '\"'" % (self.lineno,))
                             sys.exit(-1)
@@ -1026,6 +1077,8 @@ class CppHeaderParser(object):
                     else:
                         public_section = True
                     self.block_stack.append([stmt_type, name, parse_flag, public_section, decl])
+                    if decl and stmt_type in ["class", "struct"] and class_block_depth is None:
+                        class_block_depth = len(self.block_stack)
 
                 if token == "}":
                     if not self.block_stack:
@@ -1033,11 +1086,17 @@ class CppHeaderParser(object):
                     self.block_stack[-1:] = []
                     if pos+1 < len(l) and l[pos+1] == ';':
                         pos += 1
+                    if class_block_depth is not None and len(self.block_stack) < class_block_depth:
+                        class_block_depth = None
+
+                if class_block_depth is None and decls:
+                    yield from decls
+                    decls = []
 
                 block_head = ""
                 l = l[pos+1:]
 
-        return decls
+        yield from decls
 
     def print_decls(self, decls):
         """
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+
+import hashlib
+import os
+import pickle
+
+import hdr_parser
+
+# Bump this when the format of cache entries changes
+CACHE_FORMAT_VERSION = 1
+
+def parser_version() -> str:
+    # Any change of hdr_parser.py invalidates all entries
+    with open(hdr_parser.__file__, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+# On-disk cache of CppHeaderParser.parse() results.
+#
+# Each entry is a pickled (decls, namespaces) tuple stored as <cache_dir>/<key>.pickle.
+# The key is the hash of the header contents, the parser version and the parser flags,
+# so the same header is parsed only once as long as none of them changes.
+# The modification time of an entry is updated on every hit, and the least recently used
+# entries are removed by evict() when the total size exceeds max_bytes.
+#
+# If in_memory is True (or cache_dir is None), the entries are also kept in memory for the processes
+# which parse the same headers repeatedly (e.g. gen2rb.py --watch). The entries in memory which are
+# not used between two calls of evict() are removed.
+class ParseCache:
+    def __init__(self, cache_dir:str|None, max_bytes:int=256*1024*1024,
+                 generate_umat_decls:bool=False, generate_gpumat_decls:bool=False, wmode:bool=True,
+                 in_memory:bool=False):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._salt = (f"{CACHE_FORMAT_VERSION}:{parser_version()}:"
+                      f"{generate_umat_decls}:{generate_gpumat_decls}:{wmode}:").encode()
+        self._memory:dict[str,tuple[list,set[str]]]|None = None
+        self._memory_used:set[str] = set()
+        if in_memory or cache_dir is None:
+            self._memory = {}
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, hdr:str) -> str:
+        h = hashlib.sha256(self._salt)
+        with open(hdr, "rb") as f:
+            h.update(f.read())
+        return h.hexdigest()
+
+    def _path(self, key:str) -> str:
+        return f"{self.cache_dir}/{key}.pickle"
+
+    # Returns (decls, namespaces), or None if not cached
+    def get(self, key:str) -> tuple[list,set[str]]|None:
+        if self._memory is not None:
+            value = self._memory.get(key)
+            if value is not None:
+                self._memory_used.add(key)
+                self.hits += 1
+                return value
+            if not self.cache_dir:
+                self.misses += 1
+                return None
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                value = pickle.load(f)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except (pickle.UnpicklingError, EOFError, AttributeError, ValueError):
+            # Broken entry (e.g. interrupted write by older version). Parse again.
+            print(f"[Warning] removed broken parse cache entry: {path}")
+            os.remove(path)
+            self.misses += 1
+            return None
+        os.utime(path)
+        self.hits += 1
+        if self._memory is not None:
+            self._memory[key] = value
+            self._memory_used.add(key)
+        return value
+
+    def put(self, key:str, value:tuple[list,set[str]]):
+        if self._memory is not None:
+            self._memory[key] = value
+            self._memory_used.add(key)
+            if not self.cache_dir:
+                return
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    # Removes the least recently used entries until the total size is within max_bytes
+    def evict(self):
+        if self._memory is not None:
+            self._memory = {key: self._memory[key] for key in self._memory_used}
+            self._memory_used = set()
+        if not self.cache_dir:
+            return
+        entries = []
+        total = 0
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                if not entry.name.endswith(".pickle"):
+                    continue
+                st = entry.stat()
+                entries.append((st.st_mtime_ns, st.st_size, entry.path))
+                total += st.st_size
+        if total <= self.max_bytes:
+            return
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            os.remove(path)
+            total -= size
+
+    # Removes all entries, and the index of the pre-scan (see hdr_parser_wrapper.create_prescan())
+    def clear(self):
+        if self._memory is not None:
+            self._memory = {}
+            self._memory_used = set()
+        if not self.cache_dir:
+            return
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                if entry.name.endswith(".pickle") or entry.name.endswith(".tmp") or entry.name.endswith(".index"):
+                    os.remove(entry.path)
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+
+import hashlib
+import mmap
+import os
+import pickle
+import re
+
+import hdr_parser_cache
+
+# Bump this when the markers or the format of the index change
+PRESCAN_FORMAT_VERSION = 1
+
+# CppHeaderParser (in wrap mode) returns a declaration only for a statement which contains one of
+# these markers: exported classes (CV_EXPORTS_W*, CV_EXPORTS_AS), functions (CV_EXPORTS_W*,
+# CV_EXPORTS_AS, CV_WRAP*), properties (CV_PROP*) and enums. "GAPI_" covers the G-API aliases,
+# which are replaced by the CV_* macros before parsing.
+_DECL_MARKERS_RE = re.compile(rb"CV_EXPORTS_W|CV_EXPORTS_AS|CV_WRAP|CV_PROP|GAPI_|enum")
+# ... and it adds to CppHeaderParser.namespaces only for "namespace", "inline namespace" and 'extern "C"'
+_NAMESPACE_MARKERS_RE = re.compile(rb"namespace|extern")
+
+# Kinds of headers
+HEADER_DECLS = "decls"           # may have declarations. Must be parsed.
+HEADER_NAMESPACES = "namespaces" # has no declarations, but may define namespaces
+HEADER_EMPTY = "empty"           # has neither declarations nor namespaces
+
+# Returns (kind, sha256 of the contents) of hdr.
+# The file is memory-mapped and searched for the markers without decoding it.
+def scan_header(hdr:str) -> tuple[str,str]:
+    with open(hdr, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return HEADER_EMPTY, hashlib.sha256().hexdigest()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            sha256 = hashlib.sha256(m).hexdigest()
+            if _DECL_MARKERS_RE.search(m):
+                return HEADER_DECLS, sha256
+            if _NAMESPACE_MARKERS_RE.search(m):
+                return HEADER_NAMESPACES, sha256
+            return HEADER_EMPTY, sha256
+
+# Pre-scan of headers to skip the ones which have no declarations.
+#
+# The kind of each header is cached in an index file with the modification time, size and sha256
+# of the header. The namespaces defined by a HEADER_NAMESPACES header are known only after it is
+# parsed once, so they are also stored in the index (set_namespaces()), and the header is
+# skipped from the next time. The index is saved by save() and is discarded when hdr_parser.py
+# changes.
+class HeaderPrescan:
+    def __init__(self, index_path:str|None=None):
+        self.index_path = index_path
+        self.skipped = 0
+        self._salt = f"{PRESCAN_FORMAT_VERSION}:{hdr_parser_cache.parser_version()}"
+        # path -> (mtime_ns, size, sha256, kind, namespaces or None)
+        self._index:dict[str,tuple[int,int,str,str,set[str]|None]] = {}
+        self._modified = False
+        if index_path:
+            self._load()
+
+    def _load(self):
+        try:
+            with open(self.index_path, "rb") as f:
+                value = pickle.load(f)
+        except FileNotFoundError:
+            return
+        except (pickle.UnpicklingError, EOFError, AttributeError, ValueError):
+            print(f"[Warning] ignored broken pre-scan index: {self.index_path}")
+            return
+        if isinstance(value, dict) and value.get("salt") == self._salt:
+            self._index = value["index"]
+
+    def save(self):
+        if not self.index_path or not self._modified:
+            return
+        tmp_path = f"{self.index_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump({"salt": self._salt, "index": self._index}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.index_path)
+        self._modified = False
+
+    def _entry(self, hdr:str) -> tuple[int,int,str,str,set[str]|None]:
+        path = os.path.abspath(hdr)
+        st = os.stat(path)
+        entry = self._index.get(path)
+        if entry and entry[0] == st.st_mtime_ns and entry[1] == st.st_size:
+            return entry
+        kind, sha256 = scan_header(path)
+        if entry and entry[2] == sha256:
+            # Touched, but not modified
+            entry = (st.st_mtime_ns, st.st_size, sha256, entry[3], entry[4])
+        else:
+            entry = (st.st_mtime_ns, st.st_size, sha256, kind, set() if kind == HEADER_EMPTY else None)
+        self._index[path] = entry
+        self._modified = True
+        return entry
+
+    # Returns the namespaces defined by hdr if it has no declarations and does not need to be
+    # parsed, otherwise None
+    def get_skipped_namespaces(self, hdr:str) -> set[str]|None:
+        _, _, _, kind, namespaces = self._entry(hdr)
+        if kind == HEADER_DECLS or namespaces is None:
+            return None
+        self.skipped += 1
+        return set(namespaces)
+
+    # Stores the namespaces of a parsed HEADER_NAMESPACES header
+    def set_namespaces(self, hdr:str, namespaces:set[str]):
+        path = os.path.abspath(hdr)
+        entry = self._index.get(path)
+        if entry and entry[3] == HEADER_NAMESPACES:
+            self._index[path] = entry[0:4] + (set(namespaces),)
+            self._modified = True
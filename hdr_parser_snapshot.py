@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+
+import os
+import pickle
+import sys
+
+from hdr_parser_wrapper import (CvApi, CvArg, CvEnum, CvEnumerator, CvFunc, CvKlass, CvNamespace,
+                                CvProp, CvTypedef, CvVariant, TypedefType)
+
+# Bump this when the layout below changes
+SNAPSHOT_FORMAT_VERSION = 2
+_SNAPSHOT_MAGIC = "rbopencv-cvapi-snapshot"
+
+# Snapshot of a fully resolved CvApi (qnames and depths are filled in) and the list of headers.
+#
+# The snapshot is a pickle of plain lists/tuples (not of the dataclasses), so it does not depend on
+# the module path of the classes. Namespaces, classes, enums and functions are stored in tables,
+# and the references between them are stored as indices in the tables (None for no reference).
+# The support status of variants (set by gen2rb.py) is not stored.
+
+class SnapshotError(Exception):
+    pass
+
+def _intern(s:str|None) -> str|None:
+    return None if s is None else sys.intern(s)
+
+class _Table:
+    def __init__(self):
+        self.objs = []
+        self.index = {}
+
+    def ref(self, obj) -> int|None:
+        if obj is None:
+            return None
+        i = self.index.get(obj)
+        if i is None:
+            i = len(self.objs)
+            self.index[obj] = i
+            self.objs.append(obj)
+        return i
+
+def _encode(api:CvApi) -> dict:
+    nss, klasses, enums, funcs = _Table(), _Table(), _Table(), _Table()
+    # Register the objects of the dicts first so that their order is kept
+    keys = {
+        "cvnamespaces": [(k, nss.ref(v)) for k, v in api.cvnamespaces.items()],
+        "cvklasses": [(k, klasses.ref(v)) for k, v in api.cvklasses.items()],
+        "cvenums": [(k, enums.ref(v)) for k, v in api.cvenums.items()],
+        "cvfuncs": [(k, funcs.ref(v)) for k, v in api.cvfuncs.items()],
+    }
+    typedefs = []
+    for k, td in api.cvtypedefs.items():
+        typedefs.append((k, td.tdtype.name, td.name, klasses.ref(td.klass), funcs.ref(td.func), enums.ref(td.enum), td.other))
+    # The tables can grow while they are encoded (objects only referenced from other objects)
+    enc_nss, enc_klasses, enc_enums, enc_funcs = [], [], [], []
+    while (len(enc_nss) < len(nss.objs) or len(enc_klasses) < len(klasses.objs) or
+           len(enc_enums) < len(enums.objs) or len(enc_funcs) < len(funcs.objs)):
+        for ns in nss.objs[len(enc_nss):]:
+            enc_nss.append((ns.name, [klasses.ref(x) for x in ns.klasses], [enums.ref(x) for x in ns.enums],
+                            [funcs.ref(x) for x in ns.funcs]))
+        for k in klasses.objs[len(enc_klasses):]:
+            enc_klasses.append((k.filename, nss.ref(k.ns), klasses.ref(k.klass), k.name,
+                                [klasses.ref(x) for x in k.klasses], [enums.ref(x) for x in k.enums],
+                                [(p.tp, p.tp_qname, p.name, p.rw) for p in k.props], [funcs.ref(x) for x in k.funcs],
+                                k.str_parent_klass, klasses.ref(k.parent_klass), [klasses.ref(x) for x in k.child_klasses],
+                                k.depth, k.no_bind))
+        for e in enums.objs[len(enc_enums):]:
+            enc_enums.append((e.filename, nss.ref(e.ns), klasses.ref(e.klass), e.name, e.isscoped,
+                              [(v.name, v.value) for v in e.values]))
+        for f in funcs.objs[len(enc_funcs):]:
+            variants = []
+            for v in f.variants:
+                args = [(a.tp, a.tp_qname, a.name, a.defval, a.inputarg, a.outputarg) for a in v.args]
+                variants.append((v.wrap_as, v.isconst, v.isvirtual, v.ispurevirtual, v.rettype, v.rettype_qname, args, v.filename))
+            enc_funcs.append((f.filename, nss.ref(f.ns), klasses.ref(f.klass), f.name_cpp, f.name, f.isstatic, variants))
+    return {"keys": keys, "namespaces": enc_nss, "klasses": enc_klasses, "enums": enc_enums, "funcs": enc_funcs,
+            "typedefs": typedefs}
+
+def _decode(d:dict) -> CvApi:
+    nss = [CvNamespace(name, klasses=[], enums=[], funcs=[]) for name, _, _, _ in d["namespaces"]]
+    klasses = [CvKlass(filename=e[0], ns=None, klass=None, name=e[3], klasses=[], enums=[],
+                       props=[CvProp(tp=_intern(tp), tp_qname=_intern(tp_qname), name=name, rw=rw) for tp, tp_qname, name, rw in e[6]],
+                       funcs=[], str_parent_klass=e[8], parent_klass=None, child_klasses=[], depth=e[11], no_bind=e[12])
+               for e in d["klasses"]]
+    enums = [CvEnum(filename=e[0], ns=None, klass=None, name=e[3], isscoped=e[4],
+                    values=[CvEnumerator(name=name, value=value) for name, value in e[5]])
+             for e in d["enums"]]
+    funcs = []
+    for e in d["funcs"]:
+        variants = []
+        for wrap_as, isconst, isvirtual, ispurevirtual, rettype, rettype_qname, args, filename in e[6]:
+            cvargs = [CvArg(tp=_intern(tp), tp_qname=_intern(tp_qname), name=name, defval=_intern(defval),
+                            inputarg=inputarg, outputarg=outputarg)
+                      for tp, tp_qname, name, defval, inputarg, outputarg in args]
+            variants.append(CvVariant(wrap_as=wrap_as, isconst=isconst, isvirtual=isvirtual, ispurevirtual=ispurevirtual,
+                                      rettype=_intern(rettype), rettype_qname=_intern(rettype_qname), args=cvargs,
+                                      filename=filename))
+        funcs.append(CvFunc(filename=e[0], ns=None, klass=None, name_cpp=e[3], name=e[4], isstatic=e[5], variants=variants))
+
+    def get(table:list, i:int|None):
+        return None if i is None else table[i]
+    for ns, e in zip(nss, d["namespaces"]):
+        ns.klasses = [klasses[i] for i in e[1]]
+        ns.enums = [enums[i] for i in e[2]]
+        ns.funcs = [funcs[i] for i in e[3]]
+    for k, e in zip(klasses, d["klasses"]):
+        k.ns = get(nss, e[1])
+        k.klass = get(klasses, e[2])
+        k.klasses = [klasses[i] for i in e[4]]
+        k.enums = [enums[i] for i in e[5]]
+        k.funcs = [funcs[i] for i in e[7]]
+        k.parent_klass = get(klasses, e[9])
+        k.child_klasses = [klasses[i] for i in e[10]]
+    for en, e in zip(enums, d["enums"]):
+        en.ns = get(nss, e[1])
+        en.klass = get(klasses, e[2])
+    for f, e in zip(funcs, d["funcs"]):
+        f.ns = get(nss, e[1])
+        f.klass = get(klasses, e[2])
+    keys = d["keys"]
+    cvtypedefs = {}
+    for k, tdtype, name, klass_i, func_i, enum_i, other in d["typedefs"]:
+        cvtypedefs[k] = CvTypedef(tdtype=TypedefType[tdtype], name=name, klass=get(klasses, klass_i),
+                                  func=get(funcs, func_i), enum=get(enums, enum_i), other=other)
+    return CvApi(cvnamespaces={k: nss[i] for k, i in keys["cvnamespaces"]},
+                 cvenums={k: enums[i] for k, i in keys["cvenums"]},
+                 cvklasses={k: klasses[i] for k, i in keys["cvklasses"]},
+                 cvfuncs={k: funcs[i] for k, i in keys["cvfuncs"]},
+                 cvtypedefs=cvtypedefs)
+
+# Saves api (returned by hdr_parser_wrapper.parse_headers()) and the headers parsed to build it
+def save_snapshot(path:str, api:CvApi, headers:list[str]):
+    value = {"magic": _SNAPSHOT_MAGIC, "version": SNAPSHOT_FORMAT_VERSION, "headers": list(headers), "api": _encode(api)}
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+# Returns (api, headers). Raises SnapshotError if path is not a snapshot of this version.
+def load_snapshot(path:str) -> tuple[CvApi,list[str]]:
+    try:
+        with open(path, "rb") as f:
+            value = pickle.load(f)
+    except (pickle.UnpicklingError, EOFError, AttributeError, ValueError) as e:
+        raise SnapshotError(f"{path} is not a CvApi snapshot ({e})")
+    if not isinstance(value, dict) or value.get("magic") != _SNAPSHOT_MAGIC:
+        raise SnapshotError(f"{path} is not a CvApi snapshot")
+    if value.get("version") != SNAPSHOT_FORMAT_VERSION:
+        raise SnapshotError(f"{path} is snapshot format version {value.get('version')}, "
+                            f"but version {SNAPSHOT_FORMAT_VERSION} is required. Create it again")
+    return _decode(value["api"]), value["headers"]
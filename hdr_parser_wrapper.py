@@ -1,12 +1,23 @@
 #!/usr/bin/env python
 
+import concurrent.futures
 import enum
 import dataclasses
 import os
 import re
+import sys
+import typing
+import gen_profiler
 import hdr_parser
+import hdr_parser_cache
+import hdr_parser_prescan
+from autogen_writer import open_if_changed
 
-@dataclasses.dataclass
+# The API model is built from slotted dataclasses, and the type strings in it are interned
+# (sys.intern), so that the many args/retvals of the same type share one string object.
+# CvFunc, CvEnum, CvKlass and CvNamespace refer to each other, so they are compared by identity (eq=False).
+
+@dataclasses.dataclass(slots=True)
 class CvArg:
     tp:str
     tp_qname:str|None
@@ -15,7 +26,7 @@ class CvArg:
     inputarg:bool
     outputarg:bool
 
-@dataclasses.dataclass
+@dataclasses.dataclass(slots=True)
 class CvVariant:
     wrap_as:str|None
     isconst:bool
@@ -24,8 +35,11 @@ class CvVariant:
     rettype:str
     rettype_qname:str|None
     args:list[CvArg]
+    filename:str = ""           # header filename of the declaration (overloads can be in other headers)
+    supported:bool|None = None  # Set by the support analysis of gen2rb.py
+    unsupported_reason:str = ""
 
-@dataclasses.dataclass
+@dataclasses.dataclass(slots=True, eq=False)
 class CvFunc:
     filename:str             # header filename (for debug)
     ns:"CvNamespace|None"    # For global function. None if it's a member func
@@ -35,12 +49,12 @@ class CvFunc:
     isstatic:bool
     variants:list[CvVariant]
 
-@dataclasses.dataclass
+@dataclasses.dataclass(slots=True)
 class CvEnumerator:
     name:str
     value:int
 
-@dataclasses.dataclass
+@dataclasses.dataclass(slots=True, eq=False)
 class CvEnum:
     filename:str           # header filename (for debug)
     ns:"CvNamespace|None"  # For global enum. None if it's defined in a class
@@ -49,14 +63,14 @@ class CvEnum:
     isscoped:bool
     values:list[CvEnumerator]
 
-@dataclasses.dataclass
+@dataclasses.dataclass(slots=True)
 class CvProp:
     tp:str
     tp_qname:str|None
     name:str
     rw:bool
 
-@dataclasses.dataclass
+@dataclasses.dataclass(slots=True, eq=False)
 class CvKlass:
     filename:str            # header filename (for debug)
     ns:"CvNamespace|None"   # namespace if it's defined directly under namespace, else None
@@ -72,7 +86,7 @@ class CvKlass:
     depth:int               # depth in class hierarchy (root class is 0)
     no_bind:bool = False
 
-@dataclasses.dataclass
+@dataclasses.dataclass(slots=True, eq=False)
 class CvNamespace:
     name:str
     klasses:list[CvKlass]
@@ -85,7 +99,7 @@ class TypedefType(enum.Enum):
     ENUM = enum.auto()
     OTHER = enum.auto() # int, short, std::vector<int>, etc.
 
-@dataclasses.dataclass
+@dataclasses.dataclass(slots=True)
 class CvTypedef:
     tdtype:TypedefType
     name:str
@@ -94,13 +108,66 @@ class CvTypedef:
     enum:CvEnum|None
     other:str|None
 
-@dataclasses.dataclass
+@dataclasses.dataclass(slots=True)
 class CvApi:
     cvnamespaces:dict[str,CvNamespace]
     cvenums:dict[str,CvEnum]
     cvklasses:dict[str,CvKlass]
     cvfuncs:dict[str,CvFunc]
     cvtypedefs:dict[str,CvTypedef]
+    symbols:"SymbolTable|None" = None  # Built by get_symbol_table()
+
+@dataclasses.dataclass(slots=True, eq=False)
+class CvSymbol:
+    basename:str                        # last component of the name: "Foo" of "cv.Ns1.Foo"
+    owner:CvNamespace|CvKlass|None      # namespace or class which defines the symbol
+    namespace:CvNamespace|None          # innermost namespace which encloses the symbol
+    root_klass:CvKlass|None = None      # For class. root of the class hierarchy (itself if no parent)
+    depth:int = 0                       # For class. depth in class hierarchy (root class is 0)
+
+# Index of the namespaces, classes, enums and functions of a CvApi.
+# The symbol of each object (keyed by identity) holds its basename, owner and enclosing namespace,
+# and also the root class and depth for classes, so that they are computed only once.
+# Objects which are not in the CvApi (e.g. default constructors made by gen2rb.py) are indexed
+# when they are looked up first.
+class SymbolTable:
+    def __init__(self, api:CvApi):
+        self._symbols:dict[CvNamespace|CvKlass|CvEnum|CvFunc,CvSymbol] = {}
+        for objs in [api.cvnamespaces, api.cvklasses, api.cvenums, api.cvfuncs]:
+            for obj in objs.values():
+                self.lookup(obj)
+
+    def lookup(self, obj:CvNamespace|CvKlass|CvEnum|CvFunc) -> CvSymbol:
+        symbol = self._symbols.get(obj)
+        if symbol is None:
+            symbol = self._create_symbol(obj)
+            self._symbols[obj] = symbol
+        return symbol
+
+    def _create_symbol(self, obj:CvNamespace|CvKlass|CvEnum|CvFunc) -> CvSymbol:
+        basename = obj.name.rpartition(".")[2]
+        if isinstance(obj, CvNamespace):
+            return CvSymbol(basename=basename, owner=None, namespace=obj)
+        owner = obj.ns if obj.ns else obj.klass
+        if isinstance(owner, CvKlass):
+            namespace = self.lookup(owner).namespace
+        else:
+            namespace = owner
+        symbol = CvSymbol(basename=basename, owner=owner, namespace=namespace)
+        if isinstance(obj, CvKlass):
+            if obj.parent_klass:
+                parent = self.lookup(obj.parent_klass)
+                symbol.root_klass = parent.root_klass
+                symbol.depth = parent.depth + 1
+            else:
+                symbol.root_klass = obj
+        return symbol
+
+# Returns the symbol table of api. It is built at the first call, so api must be complete.
+def get_symbol_table(api:CvApi) -> SymbolTable:
+    if api.symbols is None:
+        api.symbols = SymbolTable(api)
+    return api.symbols
 
 # Returns the string representaion of parent class. "" if no parent.
 def _parse_parent_klass_str(str_parent_klasses:str, str_this_klass:str) -> str|None:
@@ -118,14 +185,130 @@ def _parse_parent_klass_str(str_parent_klasses:str, str_this_klass:str) -> str|N
         exit(1)
     return parent_class_str
 
-def _parse_headers(headers:list[str]) -> CvApi:
+def _create_parser() -> hdr_parser.CppHeaderParser:
+    return hdr_parser.CppHeaderParser(generate_umat_decls=False, generate_gpumat_decls=False)
+
+# Parses one header with its own parser instance.
+# Returns the declarations and the namespaces found in the header.
+def _parse_header(hdr:str) -> tuple[list,set[str]]:
+    parser = _create_parser()
+    decls = parser.parse(hdr)
+    return decls, parser.namespaces
+
+# Same as _parse_header(), and also returns the wall time, CPU time and peak memory of the worker process
+def _parse_header_profiled(hdr:str) -> tuple[list,set[str],dict]:
+    (decls, namespaces), stats = gen_profiler.measure_header(_parse_header, hdr)
+    return decls, namespaces, stats
+
+# Yields decls, and records the time to parse and consume them as the profile of hdr
+def _iter_profiled(decls:typing.Iterable[list], hdr:str, cached:bool):
+    with gen_profiler.header(hdr, cached):
+        yield from decls
+
+# Yields decls, and puts all of them to the cache when they are consumed
+def _iter_and_put_cache(decls:typing.Iterator[list], namespaces:set[str], cache:hdr_parser_cache.ParseCache, key:str):
+    consumed = []
+    for decl in decls:
+        consumed.append(decl)
+        yield decl
+    cache.put(key, (consumed, namespaces))
+
+# If cache_dir is None, the entries are kept only in memory (see ParseCache)
+def create_parse_cache(cache_dir:str|None, max_bytes:int=256*1024*1024, in_memory:bool=False) -> hdr_parser_cache.ParseCache:
+    # The flags must be the same as the ones used in _create_parser()
+    return hdr_parser_cache.ParseCache(cache_dir, max_bytes,
+        generate_umat_decls=False, generate_gpumat_decls=False, wmode=True, in_memory=in_memory)
+
+# The index of the pre-scan is stored in the directory of cache. Without cache, the pre-scan
+# skips only the headers which have neither declarations nor namespaces.
+def create_prescan(cache:hdr_parser_cache.ParseCache|None=None) -> hdr_parser_prescan.HeaderPrescan:
+    index_path = None
+    if cache and cache.cache_dir:
+        index_path = f"{cache.cache_dir}/prescan.index"
+    return hdr_parser_prescan.HeaderPrescan(index_path)
+
+# Yields (hdr, decls, namespaces) in the order of headers.
+# If jobs is not 1, headers are parsed in a process pool (jobs <= 0 means os.cpu_count()).
+# Otherwise decls is an iterator which parses the header while the caller consumes it,
+# and namespaces is complete only after decls is consumed.
+# If cache is given, only the headers which are not in the cache are parsed.
+# If prescan is given, the headers which have no declarations are not parsed (decls is empty).
+# If profiling is enabled (gen_profiler.enable()), the profile of each header is recorded.
+def _iter_parsed_headers(headers:list[str], jobs:int=1, cache:hdr_parser_cache.ParseCache|None=None,
+                         prescan:hdr_parser_prescan.HeaderPrescan|None=None):
+    skipped:dict[str,set[str]] = {}
+    if prescan:
+        for hdr in headers:
+            namespaces = prescan.get_skipped_namespaces(hdr)
+            if namespaces is not None:
+                skipped[hdr] = namespaces
+    cached:dict[str,tuple[list,set[str]]] = {}
+    keys:dict[str,str] = {}
+    if cache:
+        for hdr in headers:
+            if hdr in skipped:
+                continue
+            keys[hdr] = cache.key(hdr)
+            value = cache.get(keys[hdr])
+            if value is not None:
+                cached[hdr] = value
+    not_cached = [hdr for hdr in headers if not hdr in cached and not hdr in skipped]
+    if jobs <= 0:
+        jobs = os.cpu_count() or 1
+    jobs = min(jobs, len(not_cached))
+    profiler = gen_profiler.g_profiler
+    executor = None
+    parsed = None
+    # (hdr, namespaces) of the parsed headers, to store the namespaces to prescan after they are consumed
+    parsed_namespaces:list[tuple[str,set[str]]] = []
+    if jobs > 1:
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=jobs)
+        # map() returns the results in the order of headers, so the merge is deterministic
+        parsed = executor.map(_parse_header_profiled if profiler else _parse_header, not_cached)
+    try:
+        for hdr in headers:
+            if hdr in skipped:
+                yield hdr, [], skipped.pop(hdr)
+                continue
+            if hdr in cached:
+                decls, namespaces = cached.pop(hdr)
+                if profiler:
+                    decls = _iter_profiled(decls, hdr, True)
+            elif parsed:
+                if profiler:
+                    decls, namespaces, stats = next(parsed)
+                    profiler.add_header(hdr, **stats)
+                else:
+                    decls, namespaces = next(parsed)
+                if cache:
+                    cache.put(keys[hdr], (decls, namespaces))
+            else:
+                parser = _create_parser()
+                decls, namespaces = parser.iter_decls(hdr), parser.namespaces
+                if cache:
+                    decls = _iter_and_put_cache(decls, namespaces, cache, keys[hdr])
+                if profiler:
+                    decls = _iter_profiled(decls, hdr, False)
+            parsed_namespaces.append((hdr, namespaces))
+            yield hdr, decls, namespaces
+    finally:
+        if executor:
+            executor.shutdown()
+    if cache:
+        cache.evict()
+    if prescan:
+        for hdr, namespaces in parsed_namespaces:
+            prescan.set_namespaces(hdr, namespaces)
+        prescan.save()
+
+def _parse_headers(headers:list[str], jobs:int=1, cache:hdr_parser_cache.ParseCache|None=None,
+                   prescan:hdr_parser_prescan.HeaderPrescan|None=None) -> CvApi:
     cvklasses:dict[str,CvKlass] = {}
     cvnamespaces:dict[str,CvNamespace] = {}
     cvenums:dict[str,CvEnum] = {}
     cvfuncs:dict[str,CvFunc] = {}
-    parser = hdr_parser.CppHeaderParser(generate_umat_decls=False, generate_gpumat_decls=False)
-    for hdr in headers:
-        decls = parser.parse(hdr)
+    namespaces:set[str] = set()
+    for hdr, decls, hdr_namespaces in _iter_parsed_headers(headers, jobs, cache, prescan):
         for decl in decls:
             # Remove unexpected whitespace in decl[0] of "cv.ClassName.operator ()"
             decl0 = decl[0].replace("operator ()", "operator()")
@@ -151,12 +334,11 @@ def _parse_headers(headers:list[str]) -> CvApi:
                         else:
                             print(f"[Error] unsupported prop_prop: {prop_prop_str} in {clsname} {hdr}")
                             exit(0)
-                    cvprops.append(CvProp(tp=prop_tp, tp_qname=None, name=prop_name, rw=prop_rw))
+                    cvprops.append(CvProp(tp=sys.intern(prop_tp), tp_qname=None, name=prop_name, rw=prop_rw))
                 cvklass = CvKlass(filename=hdr, ns=None, klass=None, name=clsname, klasses=[], enums=[], props=cvprops, funcs=[],
                     str_parent_klass=None, parent_klass=None, child_klasses=[], depth=-1)
                 cvklasses[clsname] = cvklass
                 cvklass.str_parent_klass = _parse_parent_klass_str(decl[1], clsname)
-                ns = ".".join(clsname.split(".")[0:-1])
             elif d00 in ["enum"]:
                 ss = decl0.split()
                 enum_name = ""
@@ -219,13 +401,13 @@ def _parse_headers(headers:list[str]) -> CvApi:
                             pass # no need to handle lvalueref
                         else:
                             print(f"[Warning] {decl0} has unsupported arg attribute: {arg_attr}")
-                    cvarg = CvArg(tp=tp, tp_qname=None, name=arg_tuple[1], defval=arg_tuple[2], inputarg=inputarg, outputarg=outputarg)
+                    cvarg = CvArg(tp=sys.intern(tp), tp_qname=None, name=arg_tuple[1], defval=sys.intern(arg_tuple[2]), inputarg=inputarg, outputarg=outputarg)
                     args.append(cvarg)
 
                 variant = CvVariant(wrap_as=wrap_as, isconst=isconst, isvirtual=isvirtual,
-                    ispurevirtual=ispurevirtual, rettype=rettype, rettype_qname=None, args=args)
+                    ispurevirtual=ispurevirtual, rettype=sys.intern(rettype), rettype_qname=None, args=args, filename=hdr)
                 if wrap_as:
-                    name = ".".join(decl0.split(".")[0:-1]) + "." + wrap_as
+                    name = decl0.rpartition(".")[0] + "." + wrap_as
                 else:
                     name = decl0
                 if name in cvfuncs.keys():
@@ -235,9 +417,11 @@ def _parse_headers(headers:list[str]) -> CvApi:
                         isstatic=isstatic, variants=[])
                     cvfuncs[name] = func
                 func.variants.append(variant)
+        # hdr_namespaces is complete only after all decls are consumed
+        namespaces |= hdr_namespaces
 
-    # Append defined namespaces
-    for nsname in parser.namespaces:
+    # Append defined namespaces (sorted so that the order does not depend on set iteration order)
+    for nsname in sorted(namespaces):
         ns = CvNamespace(nsname, klasses=[], enums=[], funcs=[])
         cvnamespaces[nsname] = ns
 
@@ -254,8 +438,8 @@ def _parse_headers(headers:list[str]) -> CvApi:
 
     # Construct tree structure of definition: enum <-> namespace or class
     for _, cvenum in cvenums.items():
-        ns_or_klass = ".".join(cvenum.name.split(".")[0:-1])
-        if ns_or_klass in parser.namespaces:
+        ns_or_klass = cvenum.name.rpartition(".")[0]
+        if ns_or_klass in namespaces:
             #print(f"ENUM {cvenum.name:40s} in ns")
             ns = cvnamespaces[ns_or_klass]
             ns.enums.append(cvenum)
@@ -270,12 +454,12 @@ def _parse_headers(headers:list[str]) -> CvApi:
             # If an enum (.e.g cv.Foo.Bar.Enum1) is not included in neither namespaces nor klasses,
             # it's assumed that cv.Foo.Bar is a class without CV_EXPORTS_W, and cv.Foo is a namespace.
             #print(f"ENUM {cvenum.name:40s} nb_class")
-            nsname = ".".join(ns_or_klass.split(".")[0:-1])
+            nsname = ns_or_klass.rpartition(".")[0]
             if not nsname in cvnamespaces.keys():
                 print(f"[Error] {nsname} of {cvenum.name} is assumed to be a namespace, but not defined")
                 exit(1)
             # Class name should start with small character or "_".
-            first_char = ns_or_klass.split(".")[-1][0]
+            first_char = ns_or_klass.rpartition(".")[2][0]
             if not (first_char.isupper() or first_char == "_"):
                 print(f"[Error] {ns_or_klass} of {cvenum} is probably a class, but does not start with [A-Z_]")
                 exit(1)
@@ -290,7 +474,7 @@ def _parse_headers(headers:list[str]) -> CvApi:
     sorted_klassnames = sorted(cvklasses.keys())
     for klassname in sorted_klassnames:
         cvklass = cvklasses[klassname]
-        ns_or_klass = ".".join(cvklass.name.split(".")[0:-1])
+        ns_or_klass = cvklass.name.rpartition(".")[0]
         if ns_or_klass in cvnamespaces.keys():
             ns = cvnamespaces[ns_or_klass]
             ns.klasses.append(cvklass)
@@ -307,7 +491,7 @@ def _parse_headers(headers:list[str]) -> CvApi:
 
     # Construct tree structure of definition: func <-> namespace or class
     for _, cvfunc in cvfuncs.items():
-        ns_or_klass = ".".join(cvfunc.name.split(".")[0:-1])
+        ns_or_klass = cvfunc.name.rpartition(".")[0]
         if ns_or_klass in cvnamespaces.keys():
             ns = cvnamespaces[ns_or_klass]
             ns.funcs.append(cvfunc)
@@ -400,156 +584,235 @@ def gen_supported_typenames(api:CvApi) -> list[str]:
         supported_typenames.append(t)
     return supported_typenames
 
+# Resolves the qualified name of a type used in the header (e.g. "vector_Point" => "std.vector<cv.Point>").
+# The typenames are held as sets, and the results are memoized by (tp, current_qualifier)
+# since the same types appear in many props, retvals and args.
+#
 # current_qualifier:
 #   if tp is arg/retval of class/instance method => class qname (cv.Ns1.C1)
 #   if tp is arg/retval of global function       => ns qname (cv.Ns1)
 #   if tp is public member of class              => class qname
-def check_qname(tp:str, current_qualifier:str, supported_primitive_types:list[str], supported_typenames:list[str]) -> str|None:
-    if tp == "":  # for constructor rettype
-        return ""
-    template = "%s"
-    tp = tp.replace("std::", "")
-    if tp[-1] == "*":
-        template = "%s*"
-        tp = tp[0:-1]
-    main_type = tp # main_type is Xxx of vector<Xxx>, Ptr<Xxx>, etc.
-    m = re.match("vector_(.+)", tp)
-    if m:
-        template = "std.vector<%s>"
-        main_type = m.group(1)
-    m = re.match("vector_vector_(.+)", tp)
-    if m:
-        template = "std.vector<std.vector<%s>>"
-        main_type = m.group(1)
-    m = re.match("vector<(.+)>", tp)
-    if m:
-        template = "std.vector<%s>"
-        main_type = m.group(1)
-    m = re.match("vector<vector<(.+)> *>", tp)
-    if m:
-        template = "std.vector<std.vector<%s>>"
-        main_type = m.group(1)
-    m = re.match("Ptr<(.+)>", tp)
-    if m:
-        template = "Ptr<%s>"
-        # Special handling for ANN_MLP. It's not ANN.MLP
-        if m.group(1) == "ANN_MLP":
-            main_type = m.group(1)
-        else:
-            main_type = m.group(1).replace("_", ".")
-
-    main_type = main_type.replace("::", ".")
-    if main_type in ["string", "String"]:
-        main_type = "std.string"
-    if main_type in supported_primitive_types:
-        return template % main_type
-    if main_type.startswith("cv."):
-        if main_type in supported_typenames:
-            return template % main_type
-    else:
-        if main_type in supported_typenames:
+class QnameResolver:
+    _re_vector = re.compile("vector_(.+)")
+    _re_vector_vector = re.compile("vector_vector_(.+)")
+    _re_vector_template = re.compile("vector<(.+)>")
+    _re_vector_vector_template = re.compile("vector<vector<(.+)> *>")
+    _re_ptr = re.compile("Ptr<(.+)>")
+
+    def __init__(self, supported_primitive_types:list[str], supported_typenames:list[str]):
+        self.supported_primitive_types = frozenset(supported_primitive_types)
+        self.supported_typenames = frozenset(supported_typenames)
+        self._memo:dict[tuple[str,str],str|None] = {}
+        self._qualifier_candidates:dict[str,list[str]] = {}
+
+    # Returns None if tp is not supported
+    def resolve(self, tp:str, current_qualifier:str) -> str|None:
+        key = (tp, current_qualifier)
+        if key in self._memo:
+            return self._memo[key]
+        qname = self._resolve(tp, current_qualifier)
+        if qname is not None:
+            qname = sys.intern(qname)
+        self._memo[key] = qname
+        return qname
+
+    # "cv.NsName1.Class1" => ["cv.NsName1.Class1", "cv.NsName1", "cv"]
+    def _get_qualifier_candidates(self, current_qualifier:str) -> list[str]:
+        candidates = self._qualifier_candidates.get(current_qualifier)
+        if candidates is None:
+            qualifier_elems = current_qualifier.split(".")
+            candidates = [".".join(qualifier_elems[0:i]) for i in range(len(qualifier_elems), 0, -1)]
+            self._qualifier_candidates[current_qualifier] = candidates
+        return candidates
+
+    def _resolve(self, tp:str, current_qualifier:str) -> str|None:
+        if tp == "":  # for constructor rettype
+            return ""
+        template = "%s"
+        tp = tp.replace("std::", "")
+        if tp[-1] == "*":
+            template = "%s*"
+            tp = tp[0:-1]
+        main_type = tp # main_type is Xxx of vector<Xxx>, Ptr<Xxx>, etc.
+        if tp.startswith("vector"):
+            m = self._re_vector.match(tp)
+            if m:
+                template = "std.vector<%s>"
+                main_type = m.group(1)
+            m = self._re_vector_vector.match(tp)
+            if m:
+                template = "std.vector<std.vector<%s>>"
+                main_type = m.group(1)
+            m = self._re_vector_template.match(tp)
+            if m:
+                template = "std.vector<%s>"
+                main_type = m.group(1)
+            m = self._re_vector_vector_template.match(tp)
+            if m:
+                template = "std.vector<std.vector<%s>>"
+                main_type = m.group(1)
+        elif tp.startswith("Ptr<"):
+            m = self._re_ptr.match(tp)
+            if m:
+                template = "Ptr<%s>"
+                # Special handling for ANN_MLP. It's not ANN.MLP
+                if m.group(1) == "ANN_MLP":
+                    main_type = m.group(1)
+                else:
+                    main_type = m.group(1).replace("_", ".")
+
+        main_type = main_type.replace("::", ".")
+        if main_type in ["string", "String"]:
+            main_type = "std.string"
+        if main_type in self.supported_primitive_types:
             return template % main_type
-        elif "cv." + main_type in supported_typenames:
-            return template % ("cv." + main_type)
-
-    # qualifiler_elems: ["cv", "NsName1", "Class1"]
-    qualifier_elems = current_qualifier.split(".")
-    # qualifier_candidates: ["cv.NsName1.Class1", "cv.NsName1", "cv"]
-    qualifier_candidates = [".".join(qualifier_elems[0:i]) for i in range(len(qualifier_elems), 0, -1)]
-    for qualifier_candidate in qualifier_candidates:
-        qname = qualifier_candidate + "." + main_type
-        if qname in supported_typenames:
-            return template % qname
-    return None
-
-def _set_klass_depth(cvklass:CvKlass):
-    depth = 0
-    pklass = cvklass
-    while True:
-        pklass = pklass.parent_klass
-        if not pklass:
-            break
-        depth += 1
-    cvklass.depth = depth
+        if main_type.startswith("cv."):
+            if main_type in self.supported_typenames:
+                return template % main_type
+        else:
+            if main_type in self.supported_typenames:
+                return template % main_type
+            elif "cv." + main_type in self.supported_typenames:
+                return template % ("cv." + main_type)
+
+        for qualifier_candidate in self._get_qualifier_candidates(current_qualifier):
+            qname = qualifier_candidate + "." + main_type
+            if qname in self.supported_typenames:
+                return template % qname
+        return None
+
+# Resolves a single type. Use QnameResolver to resolve many types.
+def check_qname(tp:str, current_qualifier:str, supported_primitive_types:list[str], supported_typenames:list[str]) -> str|None:
+    return QnameResolver(supported_primitive_types, supported_typenames).resolve(tp, current_qualifier)
 
 def _dump_api(cvapi:CvApi,log_dir:str):
     os.makedirs(log_dir, exist_ok=True)
-    with open(f"{log_dir}/log-cvnamespaces.txt", "w") as f:
+    with open_if_changed(f"{log_dir}/log-cvnamespaces.txt") as f:
         for _, cvns in cvapi.cvnamespaces.items():
             print(f"{cvns.name}", file=f)
-    with open(f"{log_dir}/log-cvklasses.txt", "w") as f:
+    with open_if_changed(f"{log_dir}/log-cvklasses.txt") as f:
         for _, cvklass in cvapi.cvklasses.items():
             print(f"{cvklass.name}", file=f)
-    with open(f"{log_dir}/log-cvenums.txt", "w") as f:
+    with open_if_changed(f"{log_dir}/log-cvenums.txt") as f:
         for _, cvenum in cvapi.cvenums.items():
             print(f"{cvenum.name}", file=f)
-    with open(f"{log_dir}/log-cvtypedefs.txt", "w") as f:
+    with open_if_changed(f"{log_dir}/log-cvtypedefs.txt") as f:
         for _, cvtypedef in cvapi.cvtypedefs.items():
             print(f"{cvtypedef.name}", file=f)
-    with open(f"{log_dir}/log-cvfuncs.txt", "w") as f:
+    with open_if_changed(f"{log_dir}/log-cvfuncs.txt") as f:
         for _, cvfunc in cvapi.cvfuncs.items():
             for var_i, var in enumerate(cvfunc.variants, 1):
                 print(f"{cvfunc.name} {var_i} {var.rettype_qname}", file=f)
                 for arg in var.args:
                     print(f"  {arg.tp} {arg.tp_qname} {arg.inputarg} {arg.outputarg}", file=f)
 
-def parse_headers(headers:list[str], log_dir:str|None=None) -> CvApi:
-    cvapi = _parse_headers(headers)
-    supported_primitive_types = gen_supported_primitive_types()
-    supported_typenames = gen_supported_typenames(cvapi)
+def parse_headers(headers:list[str], log_dir:str|None=None, jobs:int=1,
+                  cache:hdr_parser_cache.ParseCache|None=None,
+                  prescan:hdr_parser_prescan.HeaderPrescan|None=None) -> CvApi:
+    with gen_profiler.phase("parse"):
+        cvapi = _parse_headers(headers, jobs, cache, prescan)
+    with gen_profiler.phase("resolve_qnames"):
+        _resolve_qnames(cvapi)
+    if log_dir:
+        with gen_profiler.phase("dump_api"):
+            dump_api(cvapi, log_dir)
+    return cvapi
+
+# Sets qname of props, rettypes and args, and depth of classes
+def _resolve_qnames(cvapi:CvApi):
+    resolver = QnameResolver(gen_supported_primitive_types(), gen_supported_typenames(cvapi))
+    symbols = get_symbol_table(cvapi)
     # Set qname of public members
     for _, cvklass in cvapi.cvklasses.items():
-        if cvklass.ns:
-            current_qualifier = cvklass.ns.name
-        elif cvklass.klass:
-            current_qualifier = cvklass.klass.name
-        else:
-            current_qualifier = ""
+        owner = symbols.lookup(cvklass).owner
+        current_qualifier = owner.name if owner else ""
         for prop in cvklass.props:
-            tp_qname = check_qname(prop.tp, current_qualifier, supported_primitive_types, supported_typenames)
+            tp_qname = resolver.resolve(prop.tp, current_qualifier)
             if tp_qname is None:
                 print(f"[Error] Could not find qname of public member: {cvklass.name}.{prop.name}")
                 exit(1)
             prop.tp_qname = tp_qname
     # Set qname of each arg
     for _, cvfunc in cvapi.cvfuncs.items():
+        owner = symbols.lookup(cvfunc).owner
+        current_qualifier = owner.name if owner else ""
         for var in cvfunc.variants:
-            if cvfunc.ns:
-                current_qualifier = cvfunc.ns.name
-            elif cvfunc.klass:
-                current_qualifier = cvfunc.klass.name
-            else:
-                current_qualifier = ""
-            rettype_qname = check_qname(var.rettype, current_qualifier, supported_primitive_types, supported_typenames)
+            rettype_qname = resolver.resolve(var.rettype, current_qualifier)
             if rettype_qname is None:
                 print(f"[Error] Could not find qname of rettype: {var.rettype} {cvfunc.name}")
                 exit(1)
             var.rettype_qname = rettype_qname
             for arg in var.args:
-                tp_qname = check_qname(arg.tp, current_qualifier, supported_primitive_types, supported_typenames)
+                tp_qname = resolver.resolve(arg.tp, current_qualifier)
                 if tp_qname is None:
                     print(f"[Error] Could not find qname argtype: {arg.tp} {cvfunc.name}")
                     exit(1)
                 arg.tp_qname = tp_qname
     # Set depth of each CvKlass
     for _, cvklass in cvapi.cvklasses.items():
-        _set_klass_depth(cvklass)
+        cvklass.depth = symbols.lookup(cvklass).depth
 
-    if log_dir:
-        log_dir = log_dir.replace("\\", "/").rstrip("/")
-        _dump_api(cvapi, log_dir)
-    return cvapi
+# Writes the lists of namespaces, classes, enums, typedefs and functions of cvapi to log_dir
+def dump_api(cvapi:CvApi, log_dir:str):
+    log_dir = log_dir.replace("\\", "/").rstrip("/")
+    _dump_api(cvapi, log_dir)
 
-if __name__ == "__main__":
-    import sys
-    if not len(sys.argv) == 3:
-        print(f"usage: hdr_parser_wraper.py <headers.txt> <log_dir>", file=sys.stderr)
-        exit(1)
+def read_headers_txt(headers_txt:str) -> list[str]:
     headers = []
-    with open(sys.argv[1], "r") as f:
+    with open(headers_txt, "r") as f:
         for line in f:
             line = line.strip()
             if line.startswith("#"):
                 continue
             headers.append(line.split("#")[0].strip())
-    cvapi = parse_headers(headers, sys.argv[2])
+    return headers
+
+if __name__ == "__main__":
+    import argparse
+    argparser = argparse.ArgumentParser(prog="hdr_parser_wrapper.py")
+    argparser.add_argument("headers_txt", help="list of header files (one per line)")
+    argparser.add_argument("log_dir", help="directory to dump the parsed API")
+    argparser.add_argument("-j", "--jobs", type=int, default=1,
+        help="number of processes to parse headers (0: number of CPUs, default: 1)")
+    argparser.add_argument("--parse-cache", metavar="DIR",
+        help="cache parsed headers in DIR (disabled by default)")
+    argparser.add_argument("--parse-cache-size", metavar="MB", type=int, default=256,
+        help="max size of the parse cache in MB (default: 256)")
+    argparser.add_argument("--clear-parse-cache", action="store_true",
+        help="remove all entries of the parse cache before parsing")
+    argparser.add_argument("--no-prescan", action="store_true",
+        help="parse all headers, including the ones without declarations to bind")
+    argparser.add_argument("--save-snapshot", metavar="FILE",
+        help="save the parsed API to FILE, which gen2rb.py --snapshot reads instead of parsing headers")
+    argparser.add_argument("--profile", action="store_true",
+        help="record time and memory of each phase and header, and write the report to --profile-out")
+    argparser.add_argument("--profile-out", metavar="FILE",
+        help="file of the report of --profile (default: LOG_DIR/profile.json)")
+    argparser.add_argument("--profile-top", metavar="N", type=int, default=10,
+        help="number of the slowest headers printed with --profile (default: 10)")
+    args = argparser.parse_args()
+    if args.profile:
+        gen_profiler.enable()
+    headers = read_headers_txt(args.headers_txt)
+    cache = None
+    if args.parse_cache:
+        cache = create_parse_cache(args.parse_cache, args.parse_cache_size*1024*1024)
+        if args.clear_parse_cache:
+            cache.clear()
+    prescan = None
+    if not args.no_prescan:
+        prescan = create_prescan(cache)
+    cvapi = parse_headers(headers, args.log_dir, jobs=args.jobs, cache=cache, prescan=prescan)
+    if cache:
+        print(f"[Info] parse cache: {cache.hits} hit(s), {cache.misses} miss(es)")
+    if prescan:
+        print(f"[Info] pre-scan: {prescan.skipped} of {len(headers)} header(s) skipped")
+    if args.save_snapshot:
+        import hdr_parser_snapshot
+        with gen_profiler.phase("save_snapshot"):
+            hdr_parser_snapshot.save_snapshot(args.save_snapshot, cvapi, headers)
+    if gen_profiler.g_profiler:
+        profile_path = args.profile_out or os.path.join(args.log_dir, "profile.json")
+        gen_profiler.g_profiler.write_report(profile_path)
+        gen_profiler.g_profiler.print_summary(args.profile_top)
+        print(f"[Info] profile: {profile_path}")
@@ -0,0 +1,382 @@
+#ifndef RBOPENCV_HPP
+#define RBOPENCV_HPP
+
+// Declarations shared by cv2.cpp and the generated translation units (autogen/rbopencv_shard_*.cpp).
+// The converters for the basic types are implemented in cv2.cpp.
+
+#include <ruby.h>
+#include <ruby/thread.h>
+#include <opencv2/opencv.hpp>
+#include <opencv2/core/types.hpp>
+#include <opencv2/core/types_c.h>
+#include <numo/narray.h>
+#include <sstream>
+#include <string>
+#include <type_traits>
+#include <vector>
+#include <cstdio>
+#include <cstdlib>
+#include <cstdarg>
+#include <exception>
+#ifdef RBOPENCV_ENABLE_STATS
+#include <atomic>
+#include <chrono>
+#endif
+
+// Tracing of the conversions is enabled by RBOPENCV_TRACE=1, which is read once by Init_cv2().
+// The arguments are not evaluated if it is disabled, and it is compiled out by
+// -DRBOPENCV_DISABLE_TRACE (ruby extconf.rb --disable-trace).
+#ifdef RBOPENCV_DISABLE_TRACE
+#define TRACE_PRINTF(fmt, ...) ((void)0)
+#else
+extern bool rbopencv_trace_enabled;
+int trace_printf(const char *filename, int line, const char *fmt, ...);
+
+#define TRACE_PRINTF(fmt, ...) (rbopencv_trace_enabled ? trace_printf(__FILE__, __LINE__, fmt, ##__VA_ARGS__) : 0)
+#endif
+
+// Statistics of the wrappers (CV2.stats), enabled by -DRBOPENCV_ENABLE_STATS (ruby extconf.rb --enable-stats).
+// Each wrapper has a RbopencvStats, which is registered by the first call, and counts the calls,
+// the variants whose conversions of the args failed (overload misses), and the latency of the
+// calls which returned. The latency histogram has a bucket for each power of 2 of microseconds.
+#ifdef RBOPENCV_ENABLE_STATS
+struct RbopencvStats {
+    static const int NUM_BUCKETS = 32;
+    const char* name;
+    std::atomic<unsigned long long> calls;
+    std::atomic<unsigned long long> misses;
+    std::atomic<unsigned long long> total_ns;
+    std::atomic<unsigned long long> histogram[NUM_BUCKETS];
+    RbopencvStats* next;
+
+    explicit RbopencvStats(const char* name);
+    void reset();
+};
+
+class RbopencvStatsScope {
+public:
+    explicit RbopencvStatsScope(RbopencvStats& stats) : stats(stats), start(std::chrono::steady_clock::now()) {
+        stats.calls.fetch_add(1, std::memory_order_relaxed);
+    }
+    ~RbopencvStatsScope() {
+        unsigned long long ns = std::chrono::duration_cast<std::chrono::nanoseconds>(std::chrono::steady_clock::now() - start).count();
+        int bucket = 0;
+        for (unsigned long long us = ns / 1000; us > 0 && bucket < RbopencvStats::NUM_BUCKETS - 1; us >>= 1)
+            bucket++;
+        stats.total_ns.fetch_add(ns, std::memory_order_relaxed);
+        stats.histogram[bucket].fetch_add(1, std::memory_order_relaxed);
+    }
+
+private:
+    RbopencvStats& stats;
+    std::chrono::steady_clock::time_point start;
+};
+
+#define RBOPENCV_STATS_SCOPE(name) \
+    static RbopencvStats rbopencv_stats{name}; \
+    RbopencvStatsScope rbopencv_stats_scope{rbopencv_stats}
+#define RBOPENCV_STATS_MISS() rbopencv_stats.misses.fetch_add(1, std::memory_order_relaxed)
+#else
+#define RBOPENCV_STATS_SCOPE(name)
+#define RBOPENCV_STATS_MISS()
+#endif
+
+using namespace cv;
+using namespace std;
+
+void rbRaiseCVOverloadException(const std::string& functionName);
+void rbClearArgumentConversionErrors();
+void rbPopulateArgumentConversionErrors(const std::string& msg);
+
+using vector_int = std::vector<int>;
+using vector_char = std::vector<char>;
+using vector_uchar = std::vector<uchar>;
+using vector_float = std::vector<float>;
+using vector_double = std::vector<double>;
+using vector_String = std::vector<std::string>;
+using vector_string = std::vector<std::string>;
+using vector_Mat = std::vector<Mat>;
+using vector_Point = std::vector<Point>;
+using vector_Point2f = std::vector<Point2f>;
+using vector_Rect = std::vector<Rect>;
+using vector_vector_int = std::vector<std::vector<int>>;
+using vector_vector_Point2f = std::vector<std::vector<Point2f>>;
+
+// Tags of Ruby objects for the overload pre-filter of the generated wrappers. A variant of an
+// overloaded function is tried only if the tag of each positional arg is one of the tags which
+// rbopencv_to() of the parameter can accept (see rbopencv_match_signatures()).
+enum {
+    RBOPENCV_TAG_NIL = 1 << 0,
+    RBOPENCV_TAG_BOOL = 1 << 1,
+    RBOPENCV_TAG_FIXNUM = 1 << 2,
+    RBOPENCV_TAG_BIGNUM = 1 << 3,
+    RBOPENCV_TAG_FLOAT = 1 << 4,
+    RBOPENCV_TAG_STRING = 1 << 5,
+    RBOPENCV_TAG_ARRAY = 1 << 6,
+    RBOPENCV_TAG_HASH = 1 << 7,
+    RBOPENCV_TAG_DATA = 1 << 8,     // NArray and instances of the wrapped classes
+    RBOPENCV_TAG_OTHER = 1 << 9,
+    RBOPENCV_TAG_ANY = (1 << 10) - 1,
+};
+
+static inline unsigned int rbopencv_arg_tag(VALUE obj){
+    if (FIXNUM_P(obj))
+        return RBOPENCV_TAG_FIXNUM;
+    if (NIL_P(obj))
+        return RBOPENCV_TAG_NIL;
+    if (obj == Qtrue || obj == Qfalse)
+        return RBOPENCV_TAG_BOOL;
+    switch (TYPE(obj)) {
+    case T_FLOAT:
+        return RBOPENCV_TAG_FLOAT;
+    case T_BIGNUM:
+        return RBOPENCV_TAG_BIGNUM;
+    case T_STRING:
+        return RBOPENCV_TAG_STRING;
+    case T_ARRAY:
+        return RBOPENCV_TAG_ARRAY;
+    case T_HASH:
+        return RBOPENCV_TAG_HASH;
+    case T_DATA:
+        return RBOPENCV_TAG_DATA;
+    default:
+        return RBOPENCV_TAG_OTHER;
+    }
+}
+
+// Returns the variants (bit i for signatures[i]) which can accept the positional args.
+// signatures[i][0] is the number of positional args of variant i, and signatures[i][1 + j] is the
+// tags accepted by its j-th arg. The args beyond the number of a variant are not checked here
+// (rb_scan_args() reports them as before).
+template<size_t NumSignatures, size_t NumColumns>
+unsigned long long rbopencv_match_signatures(int argc, const VALUE* argv, const unsigned short (&signatures)[NumSignatures][NumColumns]){
+    static_assert(NumSignatures <= 64, "too many signatures");
+    static_assert(NumColumns >= 2, "no args to check");
+    unsigned int tags[NumColumns - 1];
+    int num_tags = argc < (int)(NumColumns - 1) ? argc : (int)(NumColumns - 1);
+    for (int i = 0; i < num_tags; i++)
+        tags[i] = rbopencv_arg_tag(argv[i]);
+    unsigned long long ret = 0;
+    for (size_t s = 0; s < NumSignatures; s++) {
+        int n = signatures[s][0] < num_tags ? signatures[s][0] : num_tags;
+        bool match = true;
+        for (int i = 0; i < n && match; i++)
+            match = (tags[i] & signatures[s][i + 1]) != 0;
+        if (match)
+            ret |= 1ULL << s;
+    }
+    return ret;
+}
+
+// Returns the index of the lowest set bit of bits, which must not be 0
+static inline int rbopencv_lowest_bit(unsigned long long bits){
+#if defined(__GNUC__) || defined(__clang__)
+    return __builtin_ctzll(bits);
+#else
+    int i = 0;
+    for (; !(bits & 1); bits >>= 1)
+        i++;
+    return i;
+#endif
+}
+
+// Returns the names of tags (e.g. "Fixnum|Float")
+static inline std::string rbopencv_tag_names(unsigned int tags){
+    static const char* const names[] = {"nil", "true/false", "Fixnum", "Bignum", "Float", "String",
+                                        "Array", "Hash", "NArray or wrapped object", "other"};
+    if (tags == RBOPENCV_TAG_ANY)
+        return "any";
+    std::string ret;
+    for (int i = 0; tags >> i; i++) {
+        if (tags & (1u << i)) {
+            if (!ret.empty())
+                ret += "|";
+            ret += names[i];
+        }
+    }
+    return ret;
+}
+
+// Records the conversion errors of the variants which were not tried because their tags did not
+// match the positional args (i.e. not in candidates). It is called only when the call fails.
+template<size_t NumSignatures, size_t NumColumns>
+void rbopencv_populate_signature_errors(int argc, const VALUE* argv, const unsigned short (&signatures)[NumSignatures][NumColumns], unsigned long long candidates){
+    for (size_t s = 0; s < NumSignatures; s++) {
+        if (candidates & (1ULL << s))
+            continue;
+        int n = signatures[s][0] < argc ? signatures[s][0] : argc;
+        for (int i = 0; i < n; i++) {
+            unsigned int tag = rbopencv_arg_tag(argv[i]);
+            if (!(tag & signatures[s][i + 1])) {
+                rbPopulateArgumentConversionErrors(" argument " + std::to_string(i + 1) + ": got " + rbopencv_tag_names(tag) +
+                                                   ", expected " + rbopencv_tag_names(signatures[s][i + 1]));
+                break;
+            }
+        }
+    }
+}
+
+// True while the thread calls the C++ API without the GVL (see rbopencv_call_without_gvl()).
+// Ruby API must not be used then, so NumpyAllocator acquires the GVL again while it creates the
+// NArrays of the output Mats.
+extern thread_local bool rbopencv_without_gvl;
+
+template<typename F>
+struct RbopencvCall {
+    F& f;
+    std::exception_ptr exception;
+};
+
+template<typename F>
+static void* rbopencv_call_trampoline(void* arg){
+    RbopencvCall<F>* call = static_cast<RbopencvCall<F>*>(arg);
+    rbopencv_without_gvl = true;
+    try {
+        call->f();
+    } catch (...) {
+        // Must not be thrown across rb_thread_call_without_gvl()
+        call->exception = std::current_exception();
+    }
+    rbopencv_without_gvl = false;
+    return NULL;
+}
+
+// Calls f (the call of the C++ API, after all args are converted) without the GVL, so that other
+// Ruby threads run meanwhile. The exception thrown by f is thrown again after the GVL is acquired.
+// There is no unblocking function, as the C++ API cannot be stopped in the middle: Ctrl-C and
+// Thread#kill take effect only after f returns.
+template<typename F>
+void rbopencv_call_without_gvl(F f){
+    RbopencvCall<F> call{f, nullptr};
+    rb_thread_call_without_gvl(rbopencv_call_trampoline<F>, &call, NULL, NULL);
+    if (call.exception)
+        std::rethrow_exception(call.exception);
+}
+
+// IDs of the keywords of the wrappers, indexed by RBOPENCV_KW_* (see autogen/rbopencv_kwargs.hpp)
+extern ID rbopencv_kwarg_ids[];
+
+// Looks up the keywords (indexes in rbopencv_kwarg_ids) in the keyword hash h, and stores the values
+// (Qundef if not given) to values. Returns the keywords given (bit i for indexes[i], i < 64).
+// ArgumentError is raised if h has other keys, as rb_get_kwargs() does. h is not modified.
+static inline unsigned long long rbopencv_get_kwargs(VALUE h, const unsigned short* indexes, int num, VALUE* values){
+    unsigned long long given = 0;
+    long num_given = 0;
+    for (int i = 0; i < num; i++) {
+        values[i] = NIL_P(h) ? Qundef : rb_hash_lookup2(h, ID2SYM(rbopencv_kwarg_ids[indexes[i]]), Qundef);
+        if (values[i] != Qundef) {
+            if (i < 64)
+                given |= 1ULL << i;
+            num_given++;
+        }
+    }
+    if (!NIL_P(h) && num_given != (long)RHASH_SIZE(h)) {
+        // Let rb_get_kwargs() report the unknown keywords. It removes the known ones from the hash.
+        std::vector<ID> table(num);
+        std::vector<VALUE> tmp(num);
+        for (int i = 0; i < num; i++)
+            table[i] = rbopencv_kwarg_ids[indexes[i]];
+        rb_get_kwargs(rb_hash_dup(h), table.data(), 0, num, tmp.data());
+    }
+    return given;
+}
+
+// Raises TypeError if the value of the keyword arg name for an output Mat (Qundef if not given) is
+// not an NArray. It is called before the args are converted, as rb_raise() skips the destructors of
+// the Mats referring to NArrays, which would keep them forever.
+static inline void rbopencv_check_dst_kwarg(VALUE value, const char* name){
+    if (value != Qundef && !NIL_P(value) && !rb_obj_is_kind_of(value, numo_cNArray))
+        rb_raise(rb_eTypeError, "'%s' must be Numo::NArray, not %s", name, rb_obj_classname(value));
+}
+
+template<typename T>
+bool rbopencv_to(VALUE obj, T& p){
+    TRACE_PRINTF("[rbopencv_to primary] should not be used\n");
+    return false;
+}
+
+template<> bool rbopencv_to(VALUE o, Mat& m);
+// Same as rbopencv_to(), but m does not keep o. Only for the input args which do not outlive the call.
+bool rbopencv_to_borrowed(VALUE o, Mat& m);
+template<> bool rbopencv_to(VALUE obj, int& value);
+template<> bool rbopencv_to(VALUE obj, char& value);
+template<> bool rbopencv_to(VALUE obj, uchar& value);
+template<> bool rbopencv_to(VALUE obj, size_t& value);
+template<> bool rbopencv_to(VALUE obj, bool& value);
+template<> bool rbopencv_to(VALUE obj, double& value);
+template<> bool rbopencv_to(VALUE obj, float& value);
+template<> bool rbopencv_to(VALUE obj, String& value);
+template<> bool rbopencv_to(VALUE obj, Point& p);
+template<> bool rbopencv_to(VALUE obj, Point2f& p);
+template<> bool rbopencv_to(VALUE obj, Point2d& p);
+template<> bool rbopencv_to(VALUE obj, Rect& r);
+template<> bool rbopencv_to(VALUE obj, Scalar& s);
+template<> bool rbopencv_to(VALUE obj, Size_<float>& sz);
+template<> bool rbopencv_to(VALUE obj, Size& sz);
+template<> bool rbopencv_to(VALUE obj, RotatedRect& dst);
+
+template<typename T>
+bool rbopencv_to(VALUE obj, std::vector<T>& value){
+    TRACE_PRINTF("[rbopencv_to vector_T %s]\n", typeid(T).name());
+    if (TYPE(obj) != T_ARRAY)
+        return false;
+    long len = rb_array_len(obj);
+    for (long i = 0; i < len; i++) {
+        VALUE value_elem = rb_ary_entry(obj, i);
+        T raw_elem;
+        bool ret = rbopencv_to(value_elem, raw_elem);
+        if (!ret)
+            return false;
+        value.push_back(raw_elem);
+    }
+    return true;
+}
+
+template<typename T>
+VALUE rbopencv_from(const T& src) {
+    TRACE_PRINTF("[rbopencv_from primary] should not be used\n");
+    return Qnil;
+}
+
+template<> VALUE rbopencv_from(const cv::Mat& m);
+template<> VALUE rbopencv_from(const int& value);
+template<> VALUE rbopencv_from(const char& value);
+template<> VALUE rbopencv_from(const uchar& value);
+template<> VALUE rbopencv_from(const size_t& value);
+template<> VALUE rbopencv_from(const bool& value);
+template<> VALUE rbopencv_from(const double& value);
+template<> VALUE rbopencv_from(const float& value);
+template<> VALUE rbopencv_from(const String& value);
+template<> VALUE rbopencv_from(const Rect& rect);
+template<> VALUE rbopencv_from(const Scalar& s);
+template<> VALUE rbopencv_from(const Size& sz);
+template<> VALUE rbopencv_from(const Size_<float>& sz);
+template<> VALUE rbopencv_from(const Point& p);
+template<> VALUE rbopencv_from(const Point2f& p);
+template<> VALUE rbopencv_from(const Point2d& p);
+template<> VALUE rbopencv_from(const RotatedRect& src);
+
+template<typename T>
+VALUE rbopencv_from(const std::vector<T>& value){
+    TRACE_PRINTF("[rbopencv_from vector_T %s]\n", typeid(T).name());
+    size_t size = value.size();
+    VALUE ret = rb_ary_new2(size);
+    for (const auto& x : value) {
+        VALUE item = rbopencv_from(x);
+        rb_ary_push(ret, item);
+    }
+    return ret;
+}
+
+struct MethodDef {
+    using func_ptr_for_ruby_method = VALUE (*)(int, VALUE*, VALUE);
+    const char *name;
+    func_ptr_for_ruby_method wrapper_func;
+};
+
+struct ConstDef {
+    const char *name;
+    long long val;
+};
+
+#endif // RBOPENCV_HPP
@@ -59,11 +59,37 @@ class BindTest < Test::Unit::TestCase
     assert_equal(CV2.bindTest7(1, 3), (1+3)*3)
     assert_equal(CV2.bindTest7(1, c:4), (1+2)*4)
     assert_equal(CV2.bindTest7(1, c:5, b:6), (1+6)*5)
+    assert_raise(ArgumentError) { CV2.bindTest7(1, d:7) }
+  end
+
+  # Run with the build of `ruby extconf.rb --enable-stats` too (see dev-tools/run-tests.sh)
+  def test_stats
+    CV2.reset_stats
+    CV2.bindTest7(1)
+    CV2.bindTest7(2)
+    assert_equal(12, CV2.bindTest_overload_miss([0, 0, 3, 4]))
+    stats = CV2.stats
+    assert_kind_of(Hash, stats)
+    unless CV2::STATS_ENABLED
+      assert_empty(stats)
+      return
+    end
+    assert_equal(2, stats["cv.bindTest7"][:calls])
+    assert_equal(0, stats["cv.bindTest7"][:overload_misses])
+    assert_equal(2, stats["cv.bindTest7"][:histogram].sum)
+    assert_operator(stats["cv.bindTest7"][:total_time], :>=, 0.0)
+    # The conversion of the Size variant fails
+    assert_equal(1, stats["cv.bindTest_overload_miss"][:calls])
+    assert_equal(1, stats["cv.bindTest_overload_miss"][:overload_misses])
+    assert_equal(1, stats["cv.bindTest_overload_miss"][:histogram].sum)
+    CV2.reset_stats
+    assert_equal(0, CV2.stats["cv.bindTest7"][:calls])
   end
 
   def test_bindTest8
     assert_equal(11, CV2.bindTest8(10))
     assert_equal(15, CV2.bindTest8(10, 5))
+    assert_equal(13, CV2.bindTest8(10, c:3))
   end
 
   def test_bindTest_double
@@ -75,6 +101,10 @@ class BindTest < Test::Unit::TestCase
     assert_equal(CV2.bindTest_overload(3.0), 6.0)
     assert_equal(CV2.bindTest_overload([10, 20]), 60)
     assert_equal(CV2.bindTest_overload(3.0, 3), 9.0)
+    assert_equal(CV2.bindTest_overload(3, 3.0), 9.0)
+    e = assert_raise(TypeError) { CV2.bindTest_overload("3.0") }
+    assert_match(/argument 1: got String, expected Fixnum\|Bignum\|Float/, e.message)
+    assert_match(/argument 1: got String, expected Array/, e.message)
   #   ret = CV2.bindTest_overload([1, 2], [3, 4], 5)
   #   assert_equal(ret, 15)
   #   ret = CV2.bindTest_overload([[1, 2], [3, 4], 5])
@@ -161,6 +191,104 @@ class BindTest < Test::Unit::TestCase
     assert_equal(img2.shape[1], 300)
   end
 
+  def test_mat_in
+    # Contiguous NArrays are converted without creating views
+    a = Numo::UInt8.new(3, 4).seq
+    assert_equal([a.to_a.flatten.sum, 0, 0, 0], CV2.bindTest_In_Mat(a))
+    b = Numo::UInt8.new(2, 3, 3).seq
+    sums = 3.times.map { |c| b[true, true, c].to_a.flatten.sum }
+    assert_equal(sums + [0], CV2.bindTest_In_Mat(b))
+    # Views are converted by their strides
+    v = a[true, 0..1]
+    assert_equal([v.to_a.flatten.sum, 0, 0, 0], CV2.bindTest_In_Mat(v))
+  end
+
+  def test_mat_in_returned
+    # Input Mats of free functions are borrowed, so the returned Mat is copied to a new NArray
+    a = Numo::UInt8.new(3, 4).seq
+    ret = CV2.bindTest_Ret_Mat(a)
+    assert_equal(a, ret)
+    assert_not_same(a, ret)
+    ret[0, 0] = 99
+    assert_equal(0, a[0, 0])
+  end
+
+  def test_mat_out
+    dst = CV2.bindTest_Out_Mat(4)
+    assert_equal([4, 3], dst.shape)
+    assert_equal(4, dst[0, 0])
+  end
+
+  def test_mat_out_dst
+    dst = Numo::UInt8.zeros(4, 3)
+    assert_same(dst, CV2.bindTest_Out_Mat(4, dst: dst))
+    assert_equal(4, dst[3, 2])
+    small = Numo::UInt8.zeros(2, 3)
+    ret = CV2.bindTest_Out_Mat(4, dst: small)
+    assert_equal([4, 3], ret.shape)
+    assert_equal(0, small[0, 0])
+    # NArrays of other types are not written either
+    [Numo::DFloat.zeros(4, 3), Numo::Int64.zeros(4, 3)].each do |other|
+      ret = CV2.bindTest_Out_Mat(4, dst: other)
+      assert_not_same(other, ret)
+      assert_equal(Numo::UInt8.new(4, 3).fill(4), ret)
+      assert_equal(0, other[0, 0])
+    end
+    ["dst", 1.0, [[0, 0, 0]]].each do |other|
+      assert_raise(TypeError) { CV2.bindTest_Out_Mat(4, dst: other) }
+    end
+  end
+
+  def test_mat_out_dst_invalid
+    # The input NArray converted with the invalid dst is not kept by a Mat
+    src = Numo::UInt8.new(2, 3).seq
+    in_use = CV2.output_pool_stats[:narrays_in_use]
+    assert_raise(TypeError) { CV2.bindTest_InOut_Out_Mat(src, dst: "dst") }
+    assert_equal(in_use, CV2.output_pool_stats[:narrays_in_use])
+    ret = CV2.bindTest_InOut_Out_Mat(src)
+    assert_equal([src, src], ret)
+    assert_equal(in_use, CV2.output_pool_stats[:narrays_in_use])
+  end
+
+  def test_release_gvl
+    threads = 8.times.map { |i| Thread.new { 20.times.map { CV2.bindTest_ReleaseGVL_Mat(i + 1, i) } } }
+    threads.each_with_index do |t, i|
+      t.value.each { |dst| assert_equal(Numo::Int32.new(i + 1, 3).fill(i), dst) }
+    end
+    dst = Numo::Int32.zeros(2, 3)
+    assert_same(dst, CV2.bindTest_ReleaseGVL_Mat(2, 7, dst: dst))
+    assert_equal(7, dst[1, 2])
+    # The exception of the C++ API is raised in the calling thread
+    e = assert_raise(RuntimeError) { Thread.new { CV2.bindTest_ReleaseGVL_Mat(-1, 0) }.value }
+    assert_match(/rows >= 0/, e.message)
+  end
+
+  def test_output_pool
+    CV2.set_output_pool_limit(1024 * 1024)
+    10.times { CV2.bindTest_Out_Mat(4) }
+    GC.start
+    hits = CV2.output_pool_stats[:hits]
+    dsts = 10.times.map { CV2.bindTest_Out_Mat(4) }
+    assert_operator(CV2.output_pool_stats[:hits], :>, hits)
+    # The recycled buffers are not shared by the outputs alive
+    dsts[0][0, 0] = 99
+    dsts[1..-1].each { |dst| assert_equal(Numo::UInt8.new(4, 3).fill(4), dst) }
+  ensure
+    CV2.set_output_pool_limit(0)
+    assert_equal(0, CV2.output_pool_stats[:idle_bytes])
+  end
+
+  def test_output_pool_eviction
+    # Two buffers of bindTest_Out_Mat(4) (12 bytes each) fit in the limit
+    CV2.set_output_pool_limit(30)
+    10.times { CV2.bindTest_Out_Mat(4) }
+    10.times { CV2.bindTest_Out_Mat(5) }
+    GC.start
+    assert_operator(CV2.output_pool_stats[:idle_bytes], :<=, 30)
+  ensure
+    CV2.set_output_pool_limit(0)
+  end
+
   def test_mat_1
   #   m1 = CV2.imread(__dir__ + "/images/200x200bgrw.png")
   #   c = m1.at(50, 50)